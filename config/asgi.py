@@ -3,6 +3,10 @@ ASGI config for config project.
 
 It exposes the ASGI callable as a module-level variable named ``application``.
 
+The Server-Sent Events endpoints for rooms and DMs (``core.events``) are
+async views and need this entry point to stream without holding a thread
+per connection.
+
 For more information on this file, see
 https://docs.djangoproject.com/en/6.0/howto/deployment/asgi/
 """
@@ -14,3 +18,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'config.settings')
 
 application = get_asgi_application()
+
+# Pub/Sub のバックエンドを起動時に用意しておく（受信スレッドの開始など）
+from core.pubsub import get_broker  # noqa: E402
+
+get_broker()
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/6.0/ref/settings/
 """
 
 from pathlib import Path
+from datetime import timedelta
 import os
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -45,6 +46,9 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.PerformanceMiddleware",
+    "core.middleware.ReadYourWritesMiddleware",
+    "core.middleware.CompressionMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -58,7 +62,8 @@ ROOT_URLCONF = "config.urls"
 
 TEMPLATES = [
     {
-        "BACKEND": "django.template.backends.django.DjangoTemplates",
+        # 描画時間を計測する DjangoTemplates（core.middleware.PerformanceMiddleware）
+        "BACKEND": "core.template_backend.TimedDjangoTemplates",
         "DIRS": [],
         "APP_DIRS": True,
         "OPTIONS": {
@@ -73,6 +78,9 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "config.wsgi.application"
 
+# ASGI（config.asgi）で動かすときは True にして、ホーム・ルーム・DM を非同期ビューにする
+ASYNC_VIEWS = False
+
 
 # Database
 # https://docs.djangoproject.com/en/6.0/ref/settings/#databases
@@ -86,10 +94,67 @@ DATABASES = {
         "HOST": "localhost",
         "PORT": "3306",
         "OPTIONS": {"charset": "utf8mb4"},
+    },
+    # 読み取り専用のレプリカを足すときは別名で追加し、DATABASE_REPLICAS に並べる
+    # "replica1": {
+    #     "ENGINE": "django.db.backends.mysql",
+    #     "NAME": "sns_app",
+    #     "HOST": "replica1.internal",
+    #     ...
+    # },
+}
+
+# 書き込みは default、読み取りはレプリカへ（core.db_router）
+DATABASE_ROUTERS = ["core.db_router.PrimaryReplicaRouter"]
+DATABASE_REPLICAS = []
+# レプリカから読んでよいアプリ（セッションなどは常に default）
+DATABASE_REPLICA_APPS = ["core", "auth"]
+# 書き込んだユーザーの読み取りを default に固定する秒数（レプリカの遅延より長く）
+READ_YOUR_WRITES_SECONDS = 5
+# 接続できなかったレプリカを使わない秒数
+REPLICA_RETRY_SECONDS = 30
+
+# チャットの送信をプロセス内のキューで受け付け、まとめて INSERT する（core.writebehind）
+# キューが満杯のときは 503 + Retry-After を返す
+# MySQL では innodb_autoinc_lock_mode が 0 / 1 のときだけ複数行 INSERT になる（2 では 1 件ずつ）
+WRITE_BEHIND = False
+WRITE_BEHIND_QUEUE_SIZE = 5000
+# 1 回にまとめる件数と、最初の 1 件から待つ秒数
+WRITE_BEHIND_BATCH_SIZE = 200
+WRITE_BEHIND_INTERVAL = 0.05
+
+# 書き込みの上限（core.ratelimit）。(回数, 秒): 直近の秒数のあいだに回数分まで書ける
+RATE_LIMITS = {
+    "user": (30, 60),
+    "room": (300, 60),
+    "global": (5000, 60),
+}
+# view の平均応答時間（移動平均）がこれを超えたら、投稿・参加リクエストを 503 で断る
+# None で無効
+LOAD_SHEDDING_LATENCY_MS = 2000
+LOAD_SHEDDING_RETRY_SECONDS = 10
+
+
+# Cache
+# ホームのタイムラインなどを保持する。複数プロセスで運用する場合は
+# 共有できるバックエンド（FileBasedCache / Redis など）に切り替える。
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "sns-app",
     }
 }
 
 
+# セッションは cache から読み、書き込みは DB にも通す（cache が消えてもログインは切れない）
+SESSION_ENGINE = "django.contrib.sessions.backends.cached_db"
+
+# ログインユーザー（プロフィール込み）を cache から読む（core.backends）
+AUTHENTICATION_BACKENDS = ["core.backends.CachedModelBackend"]
+AUTH_USER_CACHE_TTL = 600
+
+
 # Password validation
 # https://docs.djangoproject.com/en/6.0/ref/settings/#auth-password-validators
 
@@ -116,9 +181,32 @@ AUTH_PASSWORD_VALIDATORS = [
 
 
 MEDIA_URL = '/media/'
-MEDIA_ROOT = BASE_DIR / "media"
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# 参照されなくなった画像の実体を削除するまでの猶予（delete_old_messages が削除する）
+MEDIA_GC_GRACE = timedelta(hours=1)
+
+# アップロードは常に一時ファイルへ書き、大きさと形式を受信しながら確かめる（core.uploads）
+FILE_UPLOAD_HANDLERS = ["core.uploads.CappedImageUploadHandler"]
+IMAGE_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+IMAGE_UPLOAD_USER_BYTES_PER_HOUR = 100 * 1024 * 1024
+
+# アップロード画像の派生画像（サムネイル等）を作るワーカースレッド数
+IMAGE_DERIVATIVE_WORKERS = 2
+
+# 投稿・メッセージの保存期間（expires_at の既定値）
+CONTENT_TTL = timedelta(hours=24)
+# MySQL ではメッセージを expires_at の 1 時間ごとにパーティション分割し、
+# delete_old_messages が期限切れのパーティションを DROP する（core.partitions）。
+# 期限の最大値（CONTENT_TTL 後）より何時間先までパーティションを用意しておくか
+PARTITION_HOURS_AHEAD = 6
+
+# リアルタイム配信（Server-Sent Events）の Pub/Sub バックエンド
+# 単一プロセス: core.pubsub.InProcessBroker
+# 同一ホストの複数プロセス: core.pubsub.LocalSocketBroker
+PUBSUB_BACKEND = "core.pubsub.InProcessBroker"
+PUBSUB_SOCKET_DIR = os.path.join(BASE_DIR, "run", "pubsub")
+
 LOGIN_REDIRECT_URL = '/home'
 LOGOUT_REDIRECT_URL = '/'
 
@@ -139,6 +227,34 @@ USE_TZ = True
 
 STATIC_URL = "static/"
 STATICFILES_DIRS = []
+STATIC_ROOT = BASE_DIR / "staticfiles"
+
+# collectstatic で 1 ファイルにまとめて縮小する CSS（base.html の {% stylesheet %}）
+STATIC_BUNDLES = {
+    "core/app.css": [
+        "core/style.css",
+        "core/css/layout.css",
+        "core/css/home.css",
+        "core/css/chat.css",
+        "core/css/lists.css",
+        "core/css/forms.css",
+    ],
+}
+
+# 静的ファイルは内容ハッシュ付きの名前で保存し、.gz/.br も事前に作る（core.storage）
+STORAGES = {
+    "default": {"BACKEND": "django.core.files.storage.FileSystemStorage"},
+    # 投稿画像・プロフィール画像（内容のハッシュで保存し、同じ内容は 1 つだけ置く）
+    "media": {"BACKEND": "core.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "core.storage.BundledStaticStorage"},
+}
+
+# 前段に nginx などがない場合に、アプリが STATIC_ROOT を配信する
+# （ハッシュ付きの名前は 1 年キャッシュ、.br/.gz を Accept-Encoding で選ぶ）
+SERVE_STATIC = False
+
+# これより小さいレスポンスは gzip しない（bytes）
+GZIP_MIN_LENGTH = 1024
 
 
 LANGUAGE_CODE = 'ja'
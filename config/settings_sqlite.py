@@ -0,0 +1,27 @@
+"""
+ローカル確認用の設定（MySQL の代わりに SQLite を 2 つ使う）。
+
+db.sqlite3 を primary、db_replica.sqlite3 をレプリカとして扱う。
+レプリカへの複製は `manage.py sync_sqlite_replica` で行う（実行するまでの間は
+レプリカが遅れている状態を再現できる）。
+
+    DJANGO_SETTINGS_MODULE=config.settings_sqlite python manage.py runserver
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import BASE_DIR
+
+DATABASES = {
+    "default": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+    },
+    "replica": {
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db_replica.sqlite3",
+        # テストでは default と同じ DB を見る
+        "TEST": {"MIRROR": "default"},
+    },
+}
+
+DATABASE_REPLICAS = ["replica"]
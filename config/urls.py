@@ -14,11 +14,23 @@ Including another URLconf
     1. Import the include() function: from django.urls import include, path
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
 
+from core import views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('', include('core.urls')),
     path('accounts/', include('django.contrib.auth.urls')),
-]
\ No newline at end of file
+]
+
+if settings.SERVE_STATIC:
+    urlpatterns += [
+        path(
+            f"{settings.STATIC_URL.strip('/')}/<path:path>",
+            views.static_asset,
+            name="static_asset",
+        ),
+    ]
@@ -1,5 +1,13 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from . import backends, events, images, media, membership, search, timeline  # noqa: F401
+        from .metrics import install_sql_timer
+
+        # 新しい DB 接続すべてに SQL 計測用のラッパーを付ける
+        connection_created.connect(install_sql_timer)
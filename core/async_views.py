@@ -0,0 +1,203 @@
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.shortcuts import aget_object_or_404, redirect, render
+
+from .conditional import conditional_page
+from .forms import MessageForm
+from .membership import acan_enter_room
+from .models import Conversation, DirectMessage, Message, Room
+from .timeline import aget_home_timeline
+from .views import (
+    DM_PAGE_SIZE,
+    ROOM_PAGE_SIZE,
+    _dm_list_version,
+    _dm_version,
+    _home_version,
+    _parse_cursor,
+    _room_messages_response,
+    _room_version,
+)
+from .ratelimit import rate_limit, retry_later
+from .rendering import arender_direct_messages, arender_room_messages
+from .writebehind import QueueFull, get_writer
+
+# =====================
+# ASGI 用の非同期版ビュー（settings.ASYNC_VIEWS で core.urls が差し替える）
+# 同時接続の多いホーム・ルーム・DM で、ORM とキャッシュをイベントループから直接呼び
+# 1 リクエストごとにスレッドを占有しないようにする。描画と入力の扱いは views と同じ
+# =====================
+
+
+async def _auser(request):
+    # テンプレートの auth コンテキストプロセッサが同期 ORM で読み込まないよう、
+    # 読み込んだユーザーで request.user を置き換えておく
+    user = await request.auser()
+    request.user = user
+    return user
+
+
+async def _asave_message(instance):
+    # views._save_message の非同期版（キューへの追加はブロックしない）
+    if settings.WRITE_BEHIND:
+        get_writer().submit(instance)
+        return False
+    await instance.asave()
+    return True
+
+
+# =====================
+# ホーム画面
+# =====================
+@conditional_page(_home_version)
+async def home(request):
+    await _auser(request)
+    posts = await aget_home_timeline()
+
+    return render(
+        request,
+        "core/home.html",
+        {
+            "posts": posts,
+        }
+    )
+
+
+# =====================
+# ルーム画面
+# =====================
+@login_required
+@rate_limit("user", "room", "global", when=acan_enter_room)
+@conditional_page(_room_version)
+async def room_detail(request, room_id):
+    user = await _auser(request)
+    room = await aget_object_or_404(Room, id=room_id)
+
+    is_host = room.host_id == user.id
+    if not await acan_enter_room(user, room.id):
+        return redirect("room_list")
+
+    if request.method == "POST":
+        form = MessageForm(request.POST)
+        if form.is_valid():
+            msg = form.save(commit=False)
+            msg.room = room
+            msg.user = user
+            try:
+                saved = await _asave_message(msg)
+            except QueueFull:
+                return retry_later(request, 503, 1)
+
+            if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+                after_id = _parse_cursor(request.POST.get("after_id"))
+                if after_id is None:
+                    new_messages = [msg] if saved else []
+                else:
+                    new_messages = [
+                        m
+                        async for m in Message.objects.live()
+                        .filter(room=room, id__gt=after_id)
+                        .select_related("user__profile")
+                        .order_by("id")[:ROOM_PAGE_SIZE]
+                    ]
+                return _room_messages_response(
+                    request, new_messages, status=200 if saved else 202
+                )
+
+            return redirect("room_detail", room_id=room.id)
+    else:
+        form = MessageForm()
+
+    latest = [
+        m
+        async for m in Message.objects.live()
+        .filter(room=room)
+        .select_related("user__profile")
+        .order_by("-id")[: ROOM_PAGE_SIZE + 1]
+    ]
+    has_older = len(latest) > ROOM_PAGE_SIZE
+    messages = latest[:ROOM_PAGE_SIZE][::-1]
+    return render(
+        request,
+        "core/room_detail.html",
+        {
+            "room": room,
+            "messages": messages,
+            "messages_html": await arender_room_messages(messages, user),
+            "form": form,
+            "is_host": is_host,
+            "has_older": has_older,
+            "first_id": messages[0].id if messages else None,
+            "last_id": messages[-1].id if messages else None,
+        },
+    )
+
+
+# ==============================
+# DM 一覧（会話相手一覧）
+# ==============================
+@login_required
+@conditional_page(_dm_list_version)
+async def dm_list(request):
+    user = await _auser(request)
+    conversations = [
+        conv
+        async for conv in Conversation.objects.live()
+        .filter(owner=user)
+        .exclude(other=user)
+        .select_related("other__profile")
+        .order_by("-last_message_at")
+    ]
+
+    return render(
+        request,
+        "core/dm_list.html",
+        {"conversations": conversations},
+    )
+
+
+# ==============================
+# DM チャット画面
+# ==============================
+@login_required
+@rate_limit("user", "global")
+@conditional_page(_dm_version)
+async def dm_chat(request, user_id):
+    user = await _auser(request)
+    other_user = await aget_object_or_404(User, id=user_id)
+
+    if request.method == "POST":
+        text = request.POST.get("text", "").strip()
+        if text:
+            try:
+                await _asave_message(
+                    DirectMessage(sender=user, receiver=other_user, text=text)
+                )
+            except QueueFull:
+                return retry_later(request, 503, 1)
+        return redirect("dm_chat", user_id=other_user.id)
+
+    await Conversation.amark_read(user, other_user)
+
+    # 最新のページだけ（過去ログは views.dm_messages）
+    page = [
+        msg
+        async for msg in DirectMessage.objects.live()
+        .between(user, other_user)
+        .select_related("sender__profile")
+        .order_by("-created_at", "-id")[: DM_PAGE_SIZE + 1]
+    ]
+    has_older = len(page) > DM_PAGE_SIZE
+    messages = page[:DM_PAGE_SIZE][::-1]
+    return render(
+        request,
+        "core/dm_chat.html",
+        {
+            "other_user": other_user,
+            "messages": messages,
+            "messages_html": await arender_direct_messages(messages, user),
+            "has_older": has_older,
+            "first_id": messages[0].id if messages else None,
+            "last_id": messages[-1].id if messages else None,
+        },
+    )
@@ -0,0 +1,103 @@
+"""
+ログインユーザーの読み込みの近道。
+
+AuthenticationMiddleware は毎リクエスト get_user でユーザーを読み、テンプレートは
+さらに user.profile を読む。プロフィール込みのユーザーを cache に置き、User・Profile
+が保存・削除されたら消す（セッション自体は SESSION_ENGINE = cached_db で cache から読む）。
+パスワードのハッシュは cache に置かない。
+"""
+
+import copy
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Profile
+
+User = get_user_model()
+
+
+def _user_key(user_id):
+    return f"auth:user:{user_id}"
+
+
+def _query(user_id):
+    # 保存直後に消したキャッシュを遅れたレプリカから作り直さないよう primary から読む
+    return (
+        User._default_manager.using(DEFAULT_DB_ALIAS)
+        .select_related("profile")
+        .filter(pk=user_id)
+    )
+
+
+def invalidate_cached_user(user_id):
+    # コミット前に別のリクエストが古い行を置き直すことがあるので、コミット後にも消す
+    cache.delete(_user_key(user_id))
+    transaction.on_commit(lambda: cache.delete(_user_key(user_id)))
+
+
+def _entry(user):
+    """cache に置く形。パスワードのハッシュは置かず、セッションの照合用の値だけを置く。"""
+    hashes = (user.get_session_auth_hash(), tuple(user.get_session_auth_fallback_hash()))
+    user = copy.copy(user)
+    # 置かなかった password は、読むと DB から読み直す（遅延読み込みのフィールド）
+    del user.__dict__["password"]
+    if getattr(user, "profile", None) is not None:
+        # プロフィールから元のユーザー（password 入り）をたどれないよう付け替える
+        user.profile = copy.copy(user.profile)
+    return user, hashes
+
+
+def _restore(entry):
+    user, (session_hash, fallback_hashes) = entry
+    # django.contrib.auth.get_user がセッションを照合するときに password を読まずに済むよう、
+    # 保存しておいた値を返す
+    # （lambda ではなく partial にして、ユーザーを pickle できるままにする）
+    user.get_session_auth_hash = partial(str, session_hash)
+    user.get_session_auth_fallback_hash = partial(iter, fallback_hashes)
+    return user
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        key = _user_key(user_id)
+        entry = cache.get(key)
+        if entry is None:
+            user = _query(user_id).first()
+            if user is None:
+                return None
+            entry = _entry(user)
+            cache.set(key, entry, settings.AUTH_USER_CACHE_TTL)
+        user = _restore(entry)
+        return user if self.user_can_authenticate(user) else None
+
+    async def aget_user(self, user_id):
+        key = _user_key(user_id)
+        entry = await cache.aget(key)
+        if entry is None:
+            user = await _query(user_id).afirst()
+            if user is None:
+                return None
+            entry = _entry(user)
+            await cache.aset(key, entry, settings.AUTH_USER_CACHE_TTL)
+        user = _restore(entry)
+        return user if self.user_can_authenticate(user) else None
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user(sender, instance, **kwargs):
+    # last_login の更新・パスワード変更もここを通る
+    invalidate_cached_user(instance.pk)
+
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def invalidate_profile(sender, instance, **kwargs):
+    invalidate_cached_user(instance.user_id)
@@ -0,0 +1,74 @@
+"""
+画面の条件付き GET（ETag / 304 Not Modified）。
+
+各画面について「内容が変わると変わる値」（最新のメッセージ ID など）を集計クエリ
+1 回で求めて ETag にし、ブラウザの If-None-Match と一致すれば本体のクエリも描画も
+せずに 304 を返す。
+"""
+
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control
+
+
+def make_etag(request, user, version):
+    # ページにはユーザーごとのリンクと CSRF トークンが入るので、それも含める
+    raw = "|".join(
+        str(part)
+        for part in (user.id, request.COOKIES.get(settings.CSRF_COOKIE_NAME, ""), *version)
+    )
+    return f'"{hashlib.md5(raw.encode(), usedforsecurity=False).hexdigest()}"'
+
+
+def _finish(response, etag):
+    if etag is not None and response.status_code in (200, 304):
+        response.headers.setdefault("ETag", etag)
+        # 共有キャッシュには置かせず、毎回ブラウザに確認させる
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
+
+# =====================
+# デコレーター
+# =====================
+def conditional_page(version_func):
+    """GET / HEAD に ETag を付け、変わっていなければ 304 を返す。
+
+    version_func(user, **view_kwargs) は画面の内容が変わると変わる値のタプル
+    （None なら条件付きにせず、いつも view に任せる）。login_required の内側に付ける。
+    """
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+
+            @wraps(view)
+            async def _wrapped(request, *args, **kwargs):
+                if request.method not in ("GET", "HEAD"):
+                    return await view(request, *args, **kwargs)
+                user = await request.auser()
+                version = await sync_to_async(version_func)(user, **kwargs)
+                etag = None if version is None else make_etag(request, user, version)
+                response = etag and get_conditional_response(request, etag=etag)
+                if not response:
+                    response = await view(request, *args, **kwargs)
+                return _finish(response, etag)
+
+        else:
+
+            @wraps(view)
+            def _wrapped(request, *args, **kwargs):
+                if request.method not in ("GET", "HEAD"):
+                    return view(request, *args, **kwargs)
+                version = version_func(request.user, **kwargs)
+                etag = None if version is None else make_etag(request, request.user, version)
+                response = etag and get_conditional_response(request, etag=etag)
+                if not response:
+                    response = view(request, *args, **kwargs)
+                return _finish(response, etag)
+
+        return _wrapped
+
+    return decorator
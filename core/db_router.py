@@ -0,0 +1,128 @@
+import logging
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections
+
+logger = logging.getLogger(__name__)
+
+# =====================
+# リクエストごとの状態（primary に固定するか・書き込んだか）
+# =====================
+_current = ContextVar("routing_state", default=None)
+# True のあいだの書き込みでは固定しない（変わったかどうかは呼び出し側が note_write で伝える）
+_quiet = ContextVar("quiet_writes", default=False)
+
+
+class RoutingState:
+    # sync_to_async のスレッド内での変更も見えるよう、値ではなくオブジェクトを置く
+    __slots__ = ("pinned", "wrote")
+
+    def __init__(self, pinned=False):
+        self.pinned = pinned
+        self.wrote = False
+
+
+def start_request(pinned=False):
+    return _current.set(RoutingState(pinned))
+
+
+def finish_request(token):
+    state = _current.get()
+    _current.reset(token)
+    return state
+
+
+@contextmanager
+def use_primary():
+    """このブロック内の読み取りを primary に固定する。"""
+    token = _current.set(RoutingState(pinned=True))
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+@contextmanager
+def quiet_writes():
+    """何も変えないことの多い UPDATE（既読にする等）で primary に固定しないようにする。
+
+    実際に行が変わったら、ブロックの後で note_write() を呼ぶ。
+    """
+    token = _quiet.set(True)
+    try:
+        yield
+    finally:
+        _quiet.reset(token)
+
+
+def note_write():
+    state = _current.get()
+    if state is not None:
+        state.wrote = True
+        state.pinned = True
+
+
+def _reads_from_primary():
+    state = _current.get()
+    if state is not None and state.pinned:
+        return True
+    # トランザクション中は自分の書き込みが見える primary から読む
+    return connections[DEFAULT_DB_ALIAS].in_atomic_block
+
+
+# =====================
+# レプリカの選択（接続できないものはしばらく外す）
+# =====================
+_down_until = {}
+
+
+def healthy_replica():
+    now = time.monotonic()
+    candidates = [
+        alias for alias in settings.DATABASE_REPLICAS if _down_until.get(alias, 0) <= now
+    ]
+    random.shuffle(candidates)
+    for alias in candidates:
+        try:
+            connections[alias].ensure_connection()
+        except DatabaseError:
+            logger.warning("Replica %s is unavailable, reading from primary", alias)
+            _down_until[alias] = now + settings.REPLICA_RETRY_SECONDS
+            continue
+        return alias
+    return None
+
+
+class PrimaryReplicaRouter:
+    """書き込みは default、読み取りはレプリカへ振り分ける。
+
+    書き込んだリクエストのそれ以降の読み取りと、ReadYourWritesMiddleware が
+    固定した直後のリクエストは default から読む。
+    """
+
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label not in settings.DATABASE_REPLICA_APPS:
+            return DEFAULT_DB_ALIAS
+        if _reads_from_primary():
+            return DEFAULT_DB_ALIAS
+        return healthy_replica() or DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        # レプリカから読まないアプリ（セッションなど）への書き込みでは固定しない
+        if model._meta.app_label in settings.DATABASE_REPLICA_APPS and not _quiet.get():
+            note_write()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # どの DB も同じデータなので関連は常に許可する
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # レプリカのスキーマは複製で揃える
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
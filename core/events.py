@@ -0,0 +1,110 @@
+import asyncio
+import json
+
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.http import Http404, JsonResponse, StreamingHttpResponse
+
+from .membership import acan_enter_room
+from .models import DirectMessage, Message, Room
+from .pubsub import get_broker
+from .rendering import render_direct_message, render_room_message
+
+# 接続維持のためのコメント送信間隔（秒）
+KEEPALIVE_SECONDS = 15
+
+
+def room_channel(room_id):
+    return f"room:{room_id}"
+
+
+def dm_channel(user_a_id, user_b_id):
+    low, high = sorted((user_a_id, user_b_id))
+    return f"dm:{low}:{high}"
+
+
+# =====================
+# 新着メッセージの配信
+# =====================
+@receiver(post_save, sender=Message)
+def publish_room_message(sender, instance, created, **kwargs):
+    if not created:
+        return
+    # 自分側・相手側の 2 種類の断片を一度だけ描画して配る
+    payload = {
+        "id": instance.id,
+        "user_id": instance.user_id,
+        "mine": render_room_message(instance, True),
+        "other": render_room_message(instance, False),
+    }
+    channel = room_channel(instance.room_id)
+    transaction.on_commit(lambda: get_broker().publish(channel, payload))
+
+
+@receiver(post_save, sender=DirectMessage)
+def publish_direct_message(sender, instance, created, **kwargs):
+    if not created:
+        return
+    payload = {
+        "id": instance.id,
+        "user_id": instance.sender_id,
+        "mine": render_direct_message(instance, True),
+        "other": render_direct_message(instance, False),
+    }
+    channel = dm_channel(instance.sender_id, instance.receiver_id)
+    transaction.on_commit(lambda: get_broker().publish(channel, payload))
+
+
+# =====================
+# Server-Sent Events
+# =====================
+async def _event_stream(channel, user_id):
+    async with get_broker().subscribe(channel) as queue:
+        yield ": connected\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), KEEPALIVE_SECONDS)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            if "mine" not in event:
+                # 断片を落として配信された（pubsub.LocalSocketBroker）。ブラウザが取りに行く
+                data = json.dumps({"id": event["id"], "fetch": True})
+            else:
+                html = event["mine"] if event["user_id"] == user_id else event["other"]
+                data = json.dumps({"id": event["id"], "html": html})
+            yield f"id: {event['id']}\ndata: {data}\n\n"
+
+
+def _event_response(channel, user_id):
+    response = StreamingHttpResponse(
+        _event_stream(channel, user_id), content_type="text/event-stream"
+    )
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+
+@login_required
+async def room_events(request, room_id):
+    user = await request.auser()
+    try:
+        room = await Room.objects.aget(id=room_id)
+    except Room.DoesNotExist:
+        raise Http404
+
+    if not await acan_enter_room(user, room.id):
+        return JsonResponse({"error": "forbidden"}, status=403)
+
+    return _event_response(room_channel(room.id), user.id)
+
+
+@login_required
+async def dm_events(request, user_id):
+    user = await request.auser()
+    if not await User.objects.filter(id=user_id).aexists():
+        raise Http404
+    return _event_response(dm_channel(user.id, user_id), user.id)
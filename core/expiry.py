@@ -0,0 +1,63 @@
+import time
+
+from django.utils import timezone
+
+from .media import collect_garbage
+from .models import (
+    Conversation,
+    DirectMessage,
+    MediaBlob,
+    Message,
+    Post,
+    RoomMessage,
+    SearchDocument,
+)
+from .partitions import PARTITIONED_MODELS, is_partitioned, rotate
+
+# expires_at を持ち、期限切れで削除するモデル
+EXPIRING_MODELS = [Message, DirectMessage, RoomMessage, Post, Conversation, SearchDocument]
+
+
+def purge_expired(model, now=None, batch_size=1000, sleep=0.0):
+    """期限切れの行を主キー順に batch_size 件ずつ削除し、削除件数を返す。
+
+    1 回の DELETE を小さく保つことでロック時間と undo ログを抑え、
+    バッチの間に sleep 秒待って他のクエリに道を譲る。
+    """
+    now = now or timezone.now()
+    total = 0
+    last_pk = 0
+
+    while True:
+        pks = list(
+            model.objects.filter(pk__gt=last_pk, expires_at__lte=now)
+            .order_by("pk")
+            .values_list("pk", flat=True)[:batch_size]
+        )
+        if not pks:
+            break
+
+        model.objects.filter(pk__in=pks).delete()
+        total += len(pks)
+        last_pk = pks[-1]
+
+        if len(pks) < batch_size:
+            break
+        if sleep:
+            time.sleep(sleep)
+
+    return total
+
+
+def purge_all(now=None, batch_size=1000, sleep=0.0):
+    now = now or timezone.now()
+    deleted = {}
+    for model in EXPIRING_MODELS:
+        if model in PARTITIONED_MODELS and is_partitioned(model):
+            # 1 時間ごとのパーティションを DROP する（件数は information_schema の概算）
+            deleted[model._meta.model_name] = rotate(model, now)
+        else:
+            deleted[model._meta.model_name] = purge_expired(model, now, batch_size, sleep)
+    # 期限切れの投稿・差し替えられたプロフィール画像で参照されなくなった実体
+    deleted[MediaBlob._meta.model_name] = collect_garbage(now)
+    return deleted
@@ -62,20 +62,14 @@ class ProfileForm(forms.ModelForm):
                 attrs={
                     "placeholder": "ひとこと入力",
                     "maxlength": "50",
-                    "style": """
-                        width:100%;
-                        padding:10px;
-                        font-size:14px;
-                        border-radius:8px;
-                        border:1px solid #ccc;
-                    """,
+                    "class": "bio-input",
                 }
             ),
 
             # 画像アップロード
             "profile_image": forms.ClearableFileInput(
                 attrs={
-                    "style": "margin-top:8px;",
+                    "class": "image-input",
                 }
             ),
         }
\ No newline at end of file
@@ -0,0 +1,116 @@
+import logging
+import posixpath
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from PIL import Image, ImageOps
+
+from .models import MediaBlob, Post, Profile
+from .timeline import invalidate_home_timeline
+
+logger = logging.getLogger(__name__)
+
+# 派生画像の種類: 名前 → (長辺 or 一辺の px, 正方形に切り抜くか)
+# 表示サイズの 2 倍（高解像度画面向け）で作る
+DERIVATIVES = {
+    Post: {
+        "thumb": (240, True),   # ホームのカード（120px）
+        "full": (1080, False),  # スマホでのカード幅いっぱい表示
+    },
+    Profile: {
+        "avatar": (96, True),   # チャット・DM 一覧のアイコン（38〜42px）
+        "large": (240, True),   # プロフィール画面（120px）
+    },
+}
+
+IMAGE_FIELDS = {Post: "image", Profile: "profile_image"}
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_DERIVATIVE_WORKERS, thread_name_prefix="derivatives"
+)
+
+
+def _resize(image, size, crop):
+    if crop:
+        return ImageOps.fit(image, (size, size), Image.LANCZOS)
+    image = image.copy()
+    image.thumbnail((size, size), Image.LANCZOS)
+    return image
+
+
+def generate_derivatives(instance):
+    """元画像から派生画像（WebP・EXIF なし）を作り、image_variants に記録する。"""
+    model = type(instance)
+    field = getattr(instance, IMAGE_FIELDS[model])
+    if not field:
+        variants = {}
+    else:
+        with field.open("rb") as f:
+            image = Image.open(f)
+            # 向きだけ反映して EXIF（位置情報など）は書き出さない
+            image = ImageOps.exif_transpose(image)
+            image = image.convert("RGBA" if "A" in image.getbands() else "RGB")
+
+        stem = posixpath.splitext(posixpath.basename(field.name))[0]
+        directory = posixpath.join(posixpath.dirname(field.name), "derived")
+        variants = {"source": field.name}
+        for name, (size, crop) in DERIVATIVES[model].items():
+            buffer = BytesIO()
+            _resize(image, size, crop).save(buffer, "WEBP", quality=80, method=4)
+            path = posixpath.join(directory, f"{stem}_{name}.webp")
+            variants[name] = field.storage.save(path, ContentFile(buffer.getvalue()))
+
+    # 処理中に画像が差し替えられていたら記録しない（次の処理に任せる）
+    if field.name:
+        current = Q(**{IMAGE_FIELDS[model]: field.name})
+    else:
+        current = Q(**{IMAGE_FIELDS[model]: ""}) | Q(**{f"{IMAGE_FIELDS[model]}__isnull": True})
+    updated = model.objects.filter(current, pk=instance.pk).update(image_variants=variants)
+    if updated:
+        # 古い派生画像の参照を外し、新しい派生画像を参照する（core.media）
+        previous = instance.media_refs()
+        instance.image_variants = variants
+        MediaBlob.update_refs(previous, instance.media_refs())
+    if model is Post:
+        invalidate_home_timeline()
+    elif updated:
+        # アイコンの URL が派生画像に変わったのでメッセージ断片を作り直させる
+        instance.bump_display_version()
+    return variants
+
+
+def _process(model, pk):
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        if instance is not None:
+            generate_derivatives(instance)
+    except Exception:
+        logger.exception("Failed to build image derivatives for %s %s", model.__name__, pk)
+    finally:
+        close_old_connections()
+
+
+def schedule_derivatives(instance):
+    model, pk = type(instance), instance.pk
+    transaction.on_commit(lambda: _executor.submit(_process, model, pk))
+
+
+def _needs_derivatives(instance):
+    field = getattr(instance, IMAGE_FIELDS[type(instance)])
+    return (field.name or None) != instance.image_variants.get("source")
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Profile)
+def build_derivatives_on_upload(sender, instance, **kwargs):
+    if _needs_derivatives(instance):
+        if sender is Profile:
+            # 画像が差し替えられた（派生画像ができるまでは元画像を表示する）
+            instance.bump_display_version()
+        schedule_derivatives(instance)
@@ -0,0 +1,196 @@
+import asyncio
+import io
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from types import ModuleType
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIHandler
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test import Client, override_settings
+from django.urls import include, path, reverse
+
+from core import async_views, views
+
+from .bench_views import pick_subjects
+
+# 同期版 / 非同期版を持つビュー
+CHAT_VIEWS = ["home", "room_detail", "dm_list", "dm_chat"]
+
+
+def chat_urlconf(module):
+    # ASYNC_VIEWS の設定に関係なく、ホーム・ルーム・DM を指定した版にした URLconf
+    urlconf = ModuleType(f"{module.__name__}_urls")
+    urlconf.urlpatterns = [
+        path("home/", module.home, name="home"),
+        path("rooms/<int:room_id>/", module.room_detail, name="room_detail"),
+        path("dm/", module.dm_list, name="dm_list"),
+        path("dm/<int:user_id>/", module.dm_chat, name="dm_chat"),
+        path("", include("config.urls")),
+    ]
+    return urlconf
+
+
+# =====================
+# WSGI: 接続ごとにスレッドを 1 本使う（gunicorn --threads 相当）
+# =====================
+def _wsgi_get(app, url, cookie):
+    environ = {
+        "REQUEST_METHOD": "GET",
+        "PATH_INFO": url,
+        "QUERY_STRING": "",
+        "SERVER_NAME": "localhost",
+        "SERVER_PORT": "80",
+        "SERVER_PROTOCOL": "HTTP/1.1",
+        "HTTP_HOST": "localhost",
+        "HTTP_COOKIE": cookie,
+        "wsgi.input": io.BytesIO(),
+        "wsgi.errors": io.StringIO(),
+        "wsgi.url_scheme": "http",
+        "wsgi.version": (1, 0),
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    statuses = []
+    response = app(environ, lambda status, headers, exc_info=None: statuses.append(status))
+    try:
+        for _ in response:
+            pass
+    finally:
+        response.close()
+    return int(statuses[0].split()[0])
+
+
+def run_wsgi(urls, cookie, concurrency, total):
+    app = WSGIHandler()
+    per_connection = total // concurrency
+
+    def connection():
+        try:
+            return [_wsgi_get(app, urls[i % len(urls)], cookie) for i in range(per_connection)]
+        finally:
+            connections.close_all()
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        futures = [pool.submit(connection) for _ in range(concurrency)]
+        return [status for future in futures for status in future.result()]
+
+
+# =====================
+# ASGI: 接続ごとにコルーチンを 1 つ使う（uvicorn 相当、ワーカー 1 つ）
+# =====================
+async def _asgi_get(app, url, cookie):
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "http",
+        "path": url,
+        "raw_path": url.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"host", b"localhost"), (b"cookie", cookie.encode())],
+        "client": ("127.0.0.1", 0),
+        "server": ("localhost", 80),
+    }
+    disconnected = asyncio.get_running_loop().create_future()
+    sent = {"body": False}
+
+    async def receive():
+        if not sent["body"]:
+            sent["body"] = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # クライアントは切断しない（応答を返し終えると Django がこの待ちを止める）
+        return await disconnected
+
+    statuses = []
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            statuses.append(message["status"])
+
+    await app(scope, receive, send)
+    return statuses[0]
+
+
+def run_asgi(urls, cookie, concurrency, total):
+    app = ASGIHandler()
+    per_connection = total // concurrency
+
+    async def connection():
+        return [await _asgi_get(app, urls[i % len(urls)], cookie) for i in range(per_connection)]
+
+    async def main():
+        results = await asyncio.gather(*(connection() for _ in range(concurrency)))
+        return [status for statuses in results for status in statuses]
+
+    return asyncio.run(main())
+
+
+MODES = {
+    "wsgi": (run_wsgi, views),
+    "asgi": (run_asgi, async_views),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare throughput and memory per concurrent connection of the home, room "
+        "and DM views under WSGI (sync views, one thread per connection) and ASGI "
+        "(async views, one coroutine per connection)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50])
+        parser.add_argument("--requests", type=int, default=200, help="Requests per run")
+        parser.add_argument("--views", nargs="+", choices=CHAT_VIEWS, default=CHAT_VIEWS)
+        parser.add_argument("--modes", nargs="+", choices=list(MODES), default=list(MODES))
+
+    def handle(self, *args, **options):
+        user, room, partner = pick_subjects()
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+        cookie = f"{settings.SESSION_COOKIE_NAME}={client.cookies[settings.SESSION_COOKIE_NAME].value}"
+        kwargs_for = {
+            "room_detail": {"room_id": room.id},
+            "dm_chat": {"user_id": partner.id},
+        }
+
+        self.stdout.write(
+            f"{'mode':<5} {'conns':>5} {'requests':>8} {'errors':>6} {'req/s':>8} {'KB/conn':>8}"
+        )
+        for mode in options["modes"]:
+            runner, module = MODES[mode]
+            with override_settings(ROOT_URLCONF=chat_urlconf(module)):
+                urls = [reverse(name, kwargs=kwargs_for.get(name)) for name in options["views"]]
+                # テンプレートやキャッシュを温めておく
+                runner(urls, cookie, 1, len(urls))
+                for concurrency in options["concurrency"]:
+                    self.stdout.write(
+                        self.measure(runner, urls, cookie, concurrency, options["requests"], mode)
+                    )
+
+    def measure(self, runner, urls, cookie, concurrency, requests, mode):
+        total = max(requests, concurrency) // concurrency * concurrency
+        start = time.perf_counter()
+        statuses = runner(urls, cookie, concurrency, total)
+        elapsed = time.perf_counter() - start
+        errors = sum(1 for status in statuses if status != 200)
+
+        # tracemalloc は遅くなるので別の回で、全接続が 1 周する間の最大使用量を測る
+        tracemalloc.start()
+        try:
+            runner(urls, cookie, concurrency, concurrency * len(urls))
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return (
+            f"{mode:<5} {concurrency:>5} {len(statuses):>8} {errors:>6} "
+            f"{len(statuses) / elapsed:>8.1f} {peak / 1024 / concurrency:>8.1f}"
+        )
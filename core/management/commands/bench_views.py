@@ -0,0 +1,173 @@
+import json
+import re
+import time
+import tracemalloc
+from statistics import quantiles
+from urllib.parse import urlencode
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count, Q
+from django.test import Client
+from django.urls import reverse
+
+from core.models import DirectMessage, Message, Room
+from core.urls import urlpatterns
+
+# 書き込みを伴うもの・ストリーミングするものは計測しない
+SKIP = {"logout", "send_request", "approve_request", "room_events", "dm_events"}
+
+# URL ごとに付けるクエリ文字列
+QUERY_PARAMS = {"search": {"q": "ラーメン"}}
+
+# PerformanceMiddleware の Server-Timing ヘッダから SQL 件数を読む
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(values, q):
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def pick_subjects():
+    # 一番メッセージの多いルーム、そのホスト、ホストと一番 DM している相手
+    room = (
+        Room.objects.annotate(n=Count("message"))
+        .select_related("host")
+        .order_by("-n")
+        .first()
+    )
+    if room is None:
+        raise CommandError("No rooms found. Run seed_load first.")
+    user = room.host
+    partners = (
+        DirectMessage.objects.filter(Q(sender=user) | Q(receiver=user))
+        .values_list("sender_id", "receiver_id")
+    )
+    counts = {}
+    for sender_id, receiver_id in partners.iterator():
+        other = receiver_id if sender_id == user.id else sender_id
+        counts[other] = counts.get(other, 0) + 1
+    partner_id = max(counts, key=counts.get) if counts else (
+        Message.objects.filter(room=room).exclude(user=user).values_list("user_id", flat=True).first()
+    )
+    partner = User.objects.get(id=partner_id) if partner_id else user
+    return user, room, partner
+
+
+class Command(BaseCommand):
+    help = "Benchmark every named URL in core.urls with the test client"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20)
+        parser.add_argument("--warmup", type=int, default=2)
+        parser.add_argument("--only", nargs="*", help="URL names to run")
+        parser.add_argument("--baseline", help="Compare against this JSON file")
+        parser.add_argument("--save-baseline", help="Write results to this JSON file")
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Allowed p95 latency / peak memory increase (0.2 = +20%%)",
+        )
+        parser.add_argument("--fail-on-regression", action="store_true")
+
+    def handle(self, *args, **options):
+        user, room, partner = pick_subjects()
+        kwargs_for = {"room_id": room.id, "user_id": partner.id}
+        client = Client(HTTP_HOST="localhost")
+        client.force_login(user)
+        self.stdout.write(
+            f"user={user.username} room={room.id} dm_partner={partner.username}"
+        )
+
+        results = {}
+        for pattern in urlpatterns:
+            name = getattr(pattern, "name", None)
+            if not name or name in SKIP or (options["only"] and name not in options["only"]):
+                continue
+            params = {key: kwargs_for[key] for key in pattern.pattern.converters}
+            # 自分のプロフィール編集は自分の ID で開く
+            if name == "edit_profile":
+                params["user_id"] = user.id
+            url = reverse(name, kwargs=params)
+            if name in QUERY_PARAMS:
+                url += "?" + urlencode(QUERY_PARAMS[name])
+            results[name] = self.measure(client, url, options["iterations"], options["warmup"])
+
+        self.print_table(results)
+
+        if options["save_baseline"]:
+            with open(options["save_baseline"], "w") as f:
+                json.dump(results, f, indent=2, sort_keys=True)
+            self.stdout.write(f"Saved baseline to {options['save_baseline']}")
+
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)
+            regressions = self.compare(results, baseline, options["tolerance"])
+            if regressions and options["fail_on_regression"]:
+                raise CommandError(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+
+    def measure(self, client, url, iterations, warmup):
+        for _ in range(warmup):
+            client.get(url)
+
+        latencies = []
+        queries = 0
+        for _ in range(iterations):
+            start = time.perf_counter()
+            response = client.get(url)
+            latencies.append((time.perf_counter() - start) * 1000)
+            match = QUERIES_RE.search(response.get("Server-Timing", ""))
+            if match:
+                queries = max(queries, int(match.group(1)))
+
+        # tracemalloc は遅くなるので計測の回とは分ける
+        tracemalloc.start()
+        try:
+            client.get(url)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            "url": url,
+            "status": response.status_code,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "queries": queries,
+            "peak_kb": round(peak / 1024, 1),
+        }
+
+    def print_table(self, results):
+        header = f"{'view':<16} {'status':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'queries':>7} {'peak KB':>9}"
+        self.stdout.write(header)
+        self.stdout.write("-" * len(header))
+        for name, r in results.items():
+            self.stdout.write(
+                f"{name:<16} {r['status']:>6} {r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} "
+                f"{r['p99_ms']:>9.2f} {r['queries']:>7} {r['peak_kb']:>9.1f}"
+            )
+
+    def compare(self, results, baseline, tolerance):
+        regressions = []
+        for name, r in results.items():
+            base = baseline.get(name)
+            if base is None:
+                continue
+            problems = []
+            if r["queries"] > base["queries"]:
+                problems.append(f"queries {base['queries']} -> {r['queries']}")
+            if r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+                problems.append(f"p95 {base['p95_ms']:.2f} -> {r['p95_ms']:.2f} ms")
+            if r["peak_kb"] > base["peak_kb"] * (1 + tolerance):
+                problems.append(f"peak {base['peak_kb']:.1f} -> {r['peak_kb']:.1f} KB")
+            if problems:
+                regressions.append(name)
+                self.stdout.write(self.style.ERROR(f"REGRESSION {name}: {'; '.join(problems)}"))
+        if not regressions:
+            self.stdout.write(self.style.SUCCESS("No regressions against baseline"))
+        return regressions
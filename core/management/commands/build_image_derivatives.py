@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from core.images import IMAGE_FIELDS, generate_derivatives
+
+
+class Command(BaseCommand):
+    help = "Build resized, EXIF-free derivatives for existing post and profile images"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Rebuild derivatives that already exist",
+        )
+
+    def handle(self, *args, **options):
+        built = 0
+        for model, field_name in IMAGE_FIELDS.items():
+            qs = model.objects.exclude(**{field_name: ""}).exclude(
+                **{f"{field_name}__isnull": True}
+            )
+            for instance in qs.iterator():
+                source = getattr(instance, field_name).name
+                if not options["force"] and instance.image_variants.get("source") == source:
+                    continue
+                try:
+                    generate_derivatives(instance)
+                except Exception as exc:
+                    self.stderr.write(f"{model.__name__} {instance.pk}: {exc}")
+                    continue
+                built += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Built derivatives for {built} images"))
@@ -0,0 +1,54 @@
+from django.core.files import File
+from django.core.management.base import BaseCommand
+
+from core.images import IMAGE_FIELDS
+from core.models import MediaBlob
+from core.storage import BLOB_PREFIX, media_storage
+
+
+class Command(BaseCommand):
+    help = (
+        "Move images uploaded before content-addressed storage into shared blobs "
+        "(run build_image_derivatives afterwards)"
+    )
+
+    def handle(self, *args, **options):
+        storage = media_storage()
+        moved = {}  # 旧ファイル名 → blob 名
+        rows = 0
+
+        for model, field_name in IMAGE_FIELDS.items():
+            qs = (
+                model.objects.exclude(**{field_name: ""})
+                .exclude(**{f"{field_name}__isnull": True})
+                .exclude(**{f"{field_name}__startswith": BLOB_PREFIX})
+            )
+            for instance in qs.iterator():
+                old = getattr(instance, field_name).name
+                if old not in moved:
+                    if not storage.exists(old):
+                        self.stderr.write(f"{model.__name__} {instance.pk}: missing {old}")
+                        continue
+                    with storage.open(old, "rb") as f:
+                        moved[old] = storage.save(old, File(f))
+
+                # 派生画像は blob から作り直すので外しておく（シグナルは通さず参照数だけ数える）
+                previous = instance.media_refs()
+                model.objects.filter(pk=instance.pk).update(
+                    **{field_name: moved[old]}, image_variants={}
+                )
+                MediaBlob.update_refs(set(), {moved[old]})
+                for name in previous - {old}:
+                    if not name.startswith(BLOB_PREFIX):
+                        storage.delete(name)
+                rows += 1
+
+        for old in moved:
+            storage.delete(old)
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Moved {len(moved)} files into blobs for {rows} images; "
+                "run build_image_derivatives to rebuild derivatives"
+            )
+        )
@@ -1,25 +1,54 @@
-from django.core.management.base import BaseCommand
-from django.utils import timezone
-from datetime import timedelta
-from core.models import Message, DirectMessage
+import time
 
+from django.core.management.base import BaseCommand
 
-class Command(BaseCommand):
-    help = "Delete messages older than 24 hours"
+from core.expiry import purge_all
 
-    def handle(self, *args, **options):
-        threshold = timezone.now() - timedelta(hours=24)
 
-        # ルーム内メッセージ削除
-        room_qs = Message.objects.filter(created_at__lt=threshold)
-        room_deleted, _ = room_qs.delete()
+class Command(BaseCommand):
+    help = (
+        "Delete expired posts and messages in bounded primary-key chunks "
+        "(on MySQL, drop expired hourly message partitions instead), "
+        "then remove image blobs no longer referenced"
+    )
 
-        # DM削除
-        dm_qs = DirectMessage.objects.filter(
-            created_at__lt=threshold
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Rows deleted per DELETE statement",
         )
-        dm_deleted, _ = dm_qs.delete()
-
-        self.stdout.write(
-            self.style.SUCCESS(f"Deleted {room_deleted + dm_deleted} messages")
+        parser.add_argument(
+            "--sleep",
+            type=float,
+            default=0.05,
+            help="Seconds to wait between batches",
         )
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running as a worker instead of exiting after one pass",
+        )
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=60,
+            help="Seconds between passes in --loop mode",
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            deleted = purge_all(
+                batch_size=options["batch_size"], sleep=options["sleep"]
+            )
+            summary = ", ".join(f"{name}={count}" for name, count in deleted.items())
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"Deleted {sum(deleted.values())} expired rows ({summary})"
+                )
+            )
+
+            if not options["loop"]:
+                break
+            time.sleep(options["interval"])
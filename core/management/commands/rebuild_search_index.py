@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from core.models import SearchDocument
+from core.search import SOURCES, index_queryset
+
+
+class Command(BaseCommand):
+    help = "Rebuild the search index from posts, room messages and rooms"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+
+        # 既存の文書を主キー順に少しずつ消す（全件をメモリに載せない）
+        while True:
+            pks = list(
+                SearchDocument.objects.order_by("pk").values_list("pk", flat=True)[:batch_size]
+            )
+            if not pks:
+                break
+            SearchDocument.objects.filter(pk__in=pks).delete()
+
+        for model in SOURCES:
+            qs = model.objects.all()
+            if hasattr(qs, "live"):
+                qs = qs.live()
+            count = index_queryset(qs.order_by("pk"), batch_size)
+            self.stdout.write(f"  {model.__name__}: {count}")
+
+        self.stdout.write(self.style.SUCCESS("Rebuilt search index"))
@@ -0,0 +1,272 @@
+import random
+import time
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import accumulate
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import (
+    Conversation,
+    DirectMessage,
+    Message,
+    Post,
+    Profile,
+    Room,
+    RoomMembership,
+    RoomMessage,
+)
+from core.text import normalize
+
+WORDS = [
+    "おはよう", "こんにちは", "ありがとう", "今日は", "明日", "ラーメン", "カフェ",
+    "勉強", "バイト", "ゲーム", "映画", "部活", "テスト", "週末", "旅行", "雨",
+    "hello", "lol", "www", "了解", "またね", "なるほど", "それな", "草",
+]
+
+
+def zipf_weights(n, s=1.1):
+    # 順位 k の重みが 1/k^s（少数のルーム・ユーザーに書き込みが集中する）
+    return list(accumulate(1 / (k ** s) for k in range(1, n + 1)))
+
+
+@contextmanager
+def explicit_timestamps(*models):
+    # auto_now_add を一時的に外し、過去 24 時間に散らばった created_at を入れる
+    fields = [model._meta.get_field("created_at") for model in models]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = "Bulk-load synthetic users, rooms, posts and messages for load testing"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=10000)
+        parser.add_argument("--rooms", type=int, default=500)
+        parser.add_argument("--requests", type=int, default=20000)
+        parser.add_argument("--posts", type=int, default=50000)
+        parser.add_argument("--messages", type=int, default=500000)
+        parser.add_argument("--room-messages", type=int, default=100000)
+        parser.add_argument("--dms", type=int, default=500000)
+        parser.add_argument("--batch-size", type=int, default=5000)
+        parser.add_argument("--prefix", default="load", help="Username prefix")
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options["seed"])
+        self.batch_size = options["batch_size"]
+        self.now = timezone.now()
+        started = time.perf_counter()
+
+        with explicit_timestamps(Post, Room, RoomMembership, Message, RoomMessage, DirectMessage):
+            users = self.seed_users(options["users"], options["prefix"])
+            rooms = self.seed_rooms(users, options["rooms"])
+            self.seed_memberships(users, rooms, options["requests"])
+            self.seed_posts(users, options["posts"])
+            self.seed_room_messages(Message, users, rooms, options["messages"])
+            self.seed_room_messages(RoomMessage, users, rooms, options["room_messages"])
+            self.seed_dms(users, options["dms"])
+
+        # bulk_create ではシグナルが飛ばないので検索インデックスは作り直す
+        call_command("rebuild_search_index", stdout=self.stdout)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Seeded in {time.perf_counter() - started:.1f}s")
+        )
+
+    # ---------------------
+    # 共通
+    # ---------------------
+    def created_at(self):
+        return self.now - timedelta(seconds=self.random.uniform(0, 24 * 3600))
+
+    def text(self):
+        return " ".join(self.random.choices(WORDS, k=self.random.randint(1, 8)))
+
+    def bulk(self, model, rows, total):
+        # 生成しながら batch_size 件ずつ INSERT する（全件をメモリに載せない）
+        created = 0
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.batch_size:
+                model.objects.bulk_create(batch)
+                created += len(batch)
+                batch = []
+        if batch:
+            model.objects.bulk_create(batch)
+            created += len(batch)
+        self.stdout.write(f"  {model.__name__}: {created}/{total}")
+
+    # ---------------------
+    # 各テーブル
+    # ---------------------
+    def seed_users(self, count, prefix):
+        before = User.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        password = make_password("password")
+        self.bulk(
+            User,
+            (
+                User(username=f"{prefix}_{before + i}", password=password)
+                for i in range(count)
+            ),
+            count,
+        )
+        users = list(User.objects.filter(id__gt=before).values_list("id", "username"))
+        # bulk_create ではシグナルが飛ばないので Profile も作る
+        self.bulk(
+            Profile,
+            (
+                Profile(user_id=user_id, search_name=normalize(username))
+                for user_id, username in users
+            ),
+            count,
+        )
+        return [user_id for user_id, _ in users]
+
+    def seed_rooms(self, users, count):
+        before = Room.objects.order_by("-id").values_list("id", flat=True).first() or 0
+        self.bulk(
+            Room,
+            (
+                Room(
+                    name=f"room {i}",
+                    description=self.text(),
+                    host_id=self.random.choice(users),
+                    created_at=self.created_at(),
+                )
+                for i in range(count)
+            ),
+            count,
+        )
+        return list(Room.objects.filter(id__gt=before).values_list("id", "host_id"))
+
+    def seed_memberships(self, users, rooms, count):
+        # bulk_create ではシグナルが飛ばないので作成者の行もここで作る
+        self.bulk(
+            RoomMembership,
+            (
+                RoomMembership(
+                    user_id=host_id,
+                    room_id=room_id,
+                    status=RoomMembership.Status.HOST,
+                    created_at=self.created_at(),
+                )
+                for room_id, host_id in rooms
+            ),
+            len(rooms),
+        )
+        weights = zipf_weights(len(rooms))
+        pairs = set()
+        for _ in range(count * 2):
+            if len(pairs) >= count:
+                break
+            room_id, host_id = self.random.choices(rooms, cum_weights=weights)[0]
+            user_id = self.random.choice(users)
+            if user_id != host_id:
+                pairs.add((user_id, room_id))
+        self.bulk(
+            RoomMembership,
+            (
+                RoomMembership(
+                    user_id=user_id,
+                    room_id=room_id,
+                    status=(
+                        RoomMembership.Status.APPROVED
+                        if self.random.random() < 0.8
+                        else RoomMembership.Status.PENDING
+                    ),
+                    created_at=self.created_at(),
+                )
+                for user_id, room_id in pairs
+            ),
+            count,
+        )
+
+    def seed_posts(self, users, count):
+        weights = zipf_weights(len(users))
+
+        def rows():
+            for _ in range(count):
+                created_at = self.created_at()
+                yield Post(
+                    user_id=self.random.choices(users, cum_weights=weights)[0],
+                    text=self.text(),
+                    created_at=created_at,
+                    expires_at=created_at + settings.CONTENT_TTL,
+                )
+
+        self.bulk(Post, rows(), count)
+
+    def seed_room_messages(self, model, users, rooms, count):
+        room_weights = zipf_weights(len(rooms))
+        user_weights = zipf_weights(len(users))
+
+        def rows():
+            for _ in range(count):
+                created_at = self.created_at()
+                yield model(
+                    room_id=self.random.choices(rooms, cum_weights=room_weights)[0][0],
+                    user_id=self.random.choices(users, cum_weights=user_weights)[0],
+                    text=self.text(),
+                    created_at=created_at,
+                    expires_at=created_at + settings.CONTENT_TTL,
+                )
+
+        self.bulk(model, rows(), count)
+
+    def seed_dms(self, users, count):
+        # 少数の組に会話が集中するよう、組そのものを Zipf で選ぶ
+        pairs = [tuple(self.random.sample(users, 2)) for _ in range(min(count, len(users) * 5))]
+        weights = zipf_weights(len(pairs))
+        latest = {}
+
+        def rows():
+            for _ in range(count):
+                sender_id, receiver_id = self.random.choices(pairs, cum_weights=weights)[0]
+                if self.random.random() < 0.5:
+                    sender_id, receiver_id = receiver_id, sender_id
+                created_at = self.created_at()
+                dm = DirectMessage(
+                    sender_id=sender_id,
+                    receiver_id=receiver_id,
+                    text=self.text(),
+                    created_at=created_at,
+                    expires_at=created_at + settings.CONTENT_TTL,
+                )
+                dm.assign_pair()
+                for key in ((sender_id, receiver_id), (receiver_id, sender_id)):
+                    if key not in latest or latest[key].created_at < created_at:
+                        latest[key] = dm
+                yield dm
+
+        self.bulk(DirectMessage, rows(), count)
+
+        # DM 一覧用の会話行もまとめて作る（新しく作ったユーザー同士なので既存の行は無い）
+        self.bulk(
+            Conversation,
+            (
+                Conversation(
+                    owner_id=owner_id,
+                    other_id=other_id,
+                    last_message_at=dm.created_at,
+                    last_message_text=dm.text[:100],
+                    last_sender_id=dm.sender_id,
+                    unread_count=0 if dm.sender_id == owner_id else 1,
+                    expires_at=dm.expires_at,
+                )
+                for (owner_id, other_id), dm in latest.items()
+            ),
+            len(latest),
+        )
@@ -0,0 +1,26 @@
+import sqlite3
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS
+
+
+class Command(BaseCommand):
+    help = "Copy the SQLite primary into the SQLite replicas (config.settings_sqlite)"
+
+    def handle(self, *args, **options):
+        primary = settings.DATABASES[DEFAULT_DB_ALIAS]
+        if not primary["ENGINE"].endswith("sqlite3"):
+            raise CommandError("Only for SQLite primaries; real replicas replicate themselves.")
+
+        source = sqlite3.connect(primary["NAME"])
+        try:
+            for alias in settings.DATABASE_REPLICAS:
+                target = sqlite3.connect(settings.DATABASES[alias]["NAME"])
+                try:
+                    source.backup(target)
+                finally:
+                    target.close()
+                self.stdout.write(f"  {alias}: synced")
+        finally:
+            source.close()
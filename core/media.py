@@ -0,0 +1,68 @@
+"""
+アップロード画像の実体（MediaBlob）の参照数を数え、参照されなくなったものを消す。
+
+実体は core.storage.ContentAddressedStorage が内容のハッシュごとに 1 つだけ保存する。
+Post・Profile の保存・削除のたびに、参照している名前（元画像と派生画像）の
+差分だけ参照数を増減する。派生画像の差し替えは core.images が同じように数える。
+"""
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import MediaBlob, Post, Profile
+from .storage import media_storage
+
+
+# =====================
+# 参照数
+# =====================
+@receiver(pre_save, sender=Post)
+@receiver(pre_save, sender=Profile)
+def remember_media_refs(sender, instance, using, **kwargs):
+    # 保存前に DB 上で参照していた名前（新規なら空）
+    previous = None
+    if not instance._state.adding:
+        previous = sender.objects.using(using).filter(pk=instance.pk).first()
+    instance._previous_media_refs = previous.media_refs() if previous else set()
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Profile)
+def count_media_refs(sender, instance, **kwargs):
+    previous = instance.__dict__.pop("_previous_media_refs", set())
+    MediaBlob.update_refs(previous, instance.media_refs())
+
+
+@receiver(post_delete, sender=Post)
+@receiver(post_delete, sender=Profile)
+def release_media_refs(sender, instance, **kwargs):
+    # 期限切れの投稿の削除（core.expiry）もここを通る
+    MediaBlob.update_refs(instance.media_refs(), set())
+
+
+# =====================
+# GC
+# =====================
+def collect_garbage(now=None):
+    """参照数が 0 のまま MEDIA_GC_GRACE たった実体を削除し、削除した数を返す。"""
+    now = now or timezone.now()
+    cutoff = now - settings.MEDIA_GC_GRACE
+    storage = media_storage()
+    deleted = 0
+
+    orphans = MediaBlob.objects.filter(refcount=0, touched_at__lt=cutoff)
+    for pk in orphans.values_list("pk", flat=True).iterator():
+        with transaction.atomic():
+            # 行をロックして調べ直す（調べている間に参照・保存されたものは残す）
+            # 同じ内容を保存する _save（core.storage）はこの行の update_or_create で待つので、
+            # ファイルを消してから行を消すまでのあいだに新しいファイルが置かれることはない
+            blob = orphans.select_for_update().filter(pk=pk).first()
+            if blob is None:
+                continue
+            storage.delete(blob.name)
+            blob.delete()
+        deleted += 1
+    return deleted
@@ -0,0 +1,106 @@
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import Case, Count, OuterRef, Subquery, Value, When
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import RoomMembership
+
+# 承認・申請のたびに消すので長めでよい
+MEMBERSHIP_TIMEOUT = 60 * 60
+
+
+def _key(user_id):
+    return f"membership:{user_id}"
+
+
+# =====================
+# ユーザーごとの参加状況（ルーム ID → 状態、未承認リクエスト数）
+# =====================
+def _rows(user_id):
+    # 作成者の行にだけ、そのルームへの未承認リクエスト数を付ける（1 クエリ）
+    # 承認直後に消したキャッシュを遅れたレプリカから作り直さないよう primary から読む
+    pending = (
+        RoomMembership.objects.filter(
+            room_id=OuterRef("room_id"), status=RoomMembership.Status.PENDING
+        )
+        .values("room_id")
+        .annotate(count=Count("id"))
+        .values("count")
+    )
+    return (
+        RoomMembership.objects.using(DEFAULT_DB_ALIAS)
+        .filter(user_id=user_id)
+        .annotate(
+            pending=Case(
+                When(status=RoomMembership.Status.HOST, then=Subquery(pending)),
+                default=Value(0),
+            )
+        )
+        .values_list("room_id", "status", "pending")
+    )
+
+
+def _summarize(rows):
+    rooms = {}
+    total = 0
+    for room_id, status, count in rows:
+        rooms[room_id] = status
+        total += count or 0
+    return {"rooms": rooms, "pending": total}
+
+
+def get_memberships(user):
+    key = _key(user.id)
+    data = cache.get(key)
+    if data is None:
+        data = _summarize(_rows(user.id))
+        cache.set(key, data, MEMBERSHIP_TIMEOUT)
+    return data
+
+
+async def aget_memberships(user):
+    # ASGI の非同期ビュー用（キャッシュも ORM もイベントループから直接使う）
+    key = _key(user.id)
+    data = await cache.aget(key)
+    if data is None:
+        data = _summarize([row async for row in _rows(user.id)])
+        await cache.aset(key, data, MEMBERSHIP_TIMEOUT)
+    return data
+
+
+def room_statuses(user):
+    return get_memberships(user)["rooms"]
+
+
+def can_enter_room(user, room_id):
+    return room_statuses(user).get(room_id) in RoomMembership.MEMBER_STATUSES
+
+
+async def acan_enter_room(user, room_id):
+    rooms = (await aget_memberships(user))["rooms"]
+    return rooms.get(room_id) in RoomMembership.MEMBER_STATUSES
+
+
+def hosted_room_ids(user):
+    return [
+        room_id
+        for room_id, status in room_statuses(user).items()
+        if status == RoomMembership.Status.HOST
+    ]
+
+
+def pending_request_count(user):
+    return get_memberships(user)["pending"]
+
+
+def invalidate_memberships(*user_ids):
+    cache.delete_many([_key(user_id) for user_id in user_ids])
+
+
+# 申請したユーザーと、未承認数が変わるルーム作成者の両方を消す
+@receiver(post_save, sender=RoomMembership)
+@receiver(post_delete, sender=RoomMembership)
+def membership_changed(sender, instance, **kwargs):
+    user_ids = {instance.user_id, instance.room.host_id}
+    transaction.on_commit(lambda: invalidate_memberships(*user_ids))
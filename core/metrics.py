@@ -0,0 +1,175 @@
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+# =====================
+# リクエストごとの計測値
+# =====================
+_current = ContextVar("request_timings", default=None)
+
+
+class RequestTimings:
+    __slots__ = ("db_count", "db_ms", "template_ms")
+
+    def __init__(self):
+        self.db_count = 0
+        self.db_ms = 0.0
+        self.template_ms = 0.0
+
+
+def start_request():
+    return _current.set(RequestTimings())
+
+
+def finish_request(token):
+    timings = _current.get()
+    _current.reset(token)
+    return timings
+
+
+def record_sql(execute, sql, params, many, context):
+    """connection.execute_wrappers に登録する SQL 計測用ラッパー。"""
+    timings = _current.get()
+    if timings is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timings.db_count += 1
+        timings.db_ms += (time.perf_counter() - start) * 1000
+
+
+def install_sql_timer(sender, connection, **kwargs):
+    if record_sql not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_sql)
+
+
+def record_template(ms):
+    timings = _current.get()
+    if timings is not None:
+        timings.template_ms += ms
+
+
+# =====================
+# ヒストグラム（プロセス内で集計）
+# =====================
+def _bounds(low, high, factor):
+    bounds = []
+    value = low
+    while value < high:
+        bounds.append(value)
+        value *= factor
+    bounds.append(high)
+    return bounds
+
+
+class Histogram:
+    """対数間隔のバケットに値を数え、バケット内の線形補間で分位点を返す。"""
+
+    def __init__(self, low=0.05, high=60000.0, factor=1.2):
+        self.bounds = _bounds(low, high, factor)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.total += value
+
+    def quantile(self, q):
+        with self._lock:
+            counts = list(self.counts)
+            count = self.count
+        if not count:
+            return 0.0
+        rank = q * count
+        seen = 0
+        for index, bucket in enumerate(counts):
+            if seen + bucket >= rank and bucket:
+                lower = self.bounds[index - 1] if index else 0.0
+                upper = self.bounds[index] if index < len(self.bounds) else self.bounds[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket
+            seen += bucket
+        return self.bounds[-1]
+
+
+class ViewMetrics:
+    def __init__(self):
+        self.latency_ms = Histogram()
+        self.db_ms = Histogram()
+        self.db_queries = Histogram(low=1, high=10000, factor=1.5)
+        self.template_ms = Histogram()
+
+
+class MovingAverage:
+    """直近の値を重く見る指数移動平均（負荷の判定用）。"""
+
+    def __init__(self, alpha=0.05):
+        self.alpha = alpha
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.value += self.alpha * (value - self.value)
+
+
+_views = {}
+_views_lock = threading.Lock()
+
+# 全 view の応答時間の移動平均（core.ratelimit の負荷制限が見る）
+recent_latency_ms = MovingAverage()
+
+
+def observe(view_name, total_ms, timings):
+    metrics = _views.get(view_name)
+    if metrics is None:
+        with _views_lock:
+            metrics = _views.setdefault(view_name, ViewMetrics())
+    metrics.latency_ms.observe(total_ms)
+    recent_latency_ms.observe(total_ms)
+    metrics.db_ms.observe(timings.db_ms)
+    metrics.db_queries.observe(timings.db_count)
+    metrics.template_ms.observe(timings.template_ms)
+
+
+def reset():
+    with _views_lock:
+        _views.clear()
+    recent_latency_ms.value = 0.0
+
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+# (メトリクス名, ViewMetrics の属性, 単位変換, 説明)
+SUMMARIES = [
+    ("sns_request_duration_seconds", "latency_ms", 1000, "Total request latency"),
+    ("sns_db_duration_seconds", "db_ms", 1000, "Time spent in SQL per request"),
+    ("sns_db_queries", "db_queries", 1, "SQL queries per request"),
+    ("sns_template_duration_seconds", "template_ms", 1000, "Template render time per request"),
+]
+
+
+def render_prometheus():
+    """Prometheus のテキスト形式（summary）で view ごとの分位点を返す。"""
+    with _views_lock:
+        views = sorted(_views.items())
+    lines = []
+    for name, attr, divisor, help_text in SUMMARIES:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} summary")
+        for view_name, metrics in views:
+            histogram = getattr(metrics, attr)
+            label = f'view="{view_name}"'
+            for q in QUANTILES:
+                value = histogram.quantile(q) / divisor
+                lines.append(f'{name}{{{label},quantile="{q}"}} {value:.6g}')
+            lines.append(f"{name}_sum{{{label}}} {histogram.total / divisor:.6g}")
+            lines.append(f"{name}_count{{{label}}} {histogram.count}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,117 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.middleware.gzip import GZipMiddleware
+
+from . import db_router, metrics
+
+
+class PerformanceMiddleware:
+    """view ごとに SQL 件数・時間、テンプレート時間、全体時間を計測する。
+
+    計測値は Server-Timing ヘッダで返し、プロセス内のヒストグラムに
+    集計する（/metrics/ で参照できる）。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        token = metrics.start_request()
+        try:
+            response = self.get_response(request)
+        finally:
+            timings = metrics.finish_request(token)
+        return self._finish(request, response, start, timings)
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        token = metrics.start_request()
+        try:
+            response = await self.get_response(request)
+        finally:
+            timings = metrics.finish_request(token)
+        return self._finish(request, response, start, timings)
+
+    def _finish(self, request, response, start, timings):
+        total_ms = (time.perf_counter() - start) * 1000
+        match = getattr(request, "resolver_match", None)
+        view_name = (match.url_name if match else None) or "unresolved"
+
+        metrics.observe(view_name, total_ms, timings)
+        response["Server-Timing"] = (
+            f'db;dur={timings.db_ms:.1f};desc="{timings.db_count} queries", '
+            f"tpl;dur={timings.template_ms:.1f}, "
+            f"total;dur={total_ms:.1f}"
+        )
+        return response
+
+
+class ReadYourWritesMiddleware:
+    """書き込んだユーザーの読み取りをしばらく primary に固定する。
+
+    リクエスト中に書き込みがあれば Cookie を付け、READ_YOUR_WRITES_SECONDS
+    の間はそのユーザーのリクエストを primary から読ませる（レプリカの遅延で
+    自分の投稿が見えない、を防ぐ）。
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    cookie_name = "primary_pin"
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        token = db_router.start_request(pinned=self.cookie_name in request.COOKIES)
+        try:
+            response = self.get_response(request)
+        finally:
+            state = db_router.finish_request(token)
+        return self._finish(response, state)
+
+    async def __acall__(self, request):
+        token = db_router.start_request(pinned=self.cookie_name in request.COOKIES)
+        try:
+            response = await self.get_response(request)
+        finally:
+            state = db_router.finish_request(token)
+        return self._finish(response, state)
+
+    def _finish(self, response, state):
+        if state.wrote:
+            response.set_cookie(
+                self.cookie_name,
+                "1",
+                max_age=settings.READ_YOUR_WRITES_SECONDS,
+                httponly=True,
+                samesite="Lax",
+            )
+        return response
+
+
+class CompressionMiddleware(GZipMiddleware):
+    """HTML・JSON のレスポンスを gzip で返す。
+
+    GZIP_MIN_LENGTH 未満の小さいレスポンスと、ストリーミング（SSE・静的ファイル）は
+    そのまま返す。静的ファイルは collectstatic で事前に圧縮してある（core.storage）。
+    """
+
+    def process_response(self, request, response):
+        if response.streaming or len(response.content) < settings.GZIP_MIN_LENGTH:
+            return response
+        return super().process_response(request, response)
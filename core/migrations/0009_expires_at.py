@@ -0,0 +1,66 @@
+# Generated by Django 6.0 on 2026-10-18 10:12
+
+import core.models
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import F
+
+
+def backfill_expires_at(apps, schema_editor):
+    # 既存の行は created_at + CONTENT_TTL を期限とする
+    for name in ["Post", "Message", "DirectMessage", "RoomMessage"]:
+        model = apps.get_model("core", name)
+        model.objects.using(schema_editor.connection.alias).update(
+            expires_at=F("created_at") + settings.CONTENT_TTL
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_roommessage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='post',
+            name='expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='message',
+            name='expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='directmessage',
+            name='expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.AddField(
+            model_name='roommessage',
+            name='expires_at',
+            field=models.DateTimeField(null=True),
+        ),
+        migrations.RunPython(backfill_expires_at, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='post',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, default=core.models.default_expires_at),
+        ),
+        migrations.AlterField(
+            model_name='message',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, default=core.models.default_expires_at),
+        ),
+        migrations.AlterField(
+            model_name='directmessage',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, default=core.models.default_expires_at),
+        ),
+        migrations.AlterField(
+            model_name='roommessage',
+            name='expires_at',
+            field=models.DateTimeField(db_index=True, default=core.models.default_expires_at),
+        ),
+    ]
@@ -0,0 +1,45 @@
+# Generated by Django 6.0 on 2026-10-18 13:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def remove_duplicate_requests(apps, schema_editor):
+    # 一意制約を付ける前に、重複した申請を 1 件にまとめる（承認済みを優先）
+    RoomRequest = apps.get_model("core", "RoomRequest")
+    db = schema_editor.connection.alias
+    seen = set()
+    for req in RoomRequest.objects.using(db).order_by("-approved", "id"):
+        key = (req.user_id, req.room_id)
+        if key in seen:
+            req.delete()
+        else:
+            seen.add(key)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_expires_at'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='directmessage',
+            index=models.Index(fields=['sender', 'receiver', 'created_at'], name='dm_pair_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='room',
+            index=models.Index(fields=['-created_at'], name='room_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='roomrequest',
+            index=models.Index(fields=['room', 'approved'], name='roomrequest_room_approved_idx'),
+        ),
+        migrations.RunPython(remove_duplicate_requests, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='roomrequest',
+            constraint=models.UniqueConstraint(fields=('user', 'room'), name='unique_room_request'),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 6.0 on 2026-10-18 13:09
+
+import core.models
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_conversations(apps, schema_editor):
+    # 既存の DM から参加者ごとの会話行を作る（既読管理は無かったので未読は 0）
+    DirectMessage = apps.get_model("core", "DirectMessage")
+    Conversation = apps.get_model("core", "Conversation")
+    db = schema_editor.connection.alias
+
+    latest = {}
+    for dm in DirectMessage.objects.using(db).order_by("created_at", "id").iterator():
+        latest[(dm.sender_id, dm.receiver_id)] = dm
+        latest[(dm.receiver_id, dm.sender_id)] = dm
+
+    Conversation.objects.using(db).bulk_create(
+        [
+            Conversation(
+                owner_id=owner_id,
+                other_id=other_id,
+                last_message_at=dm.created_at,
+                last_message_text=dm.text[:100],
+                last_sender_id=dm.sender_id,
+                expires_at=dm.expires_at,
+            )
+            for (owner_id, other_id), dm in latest.items()
+        ],
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Conversation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('last_message_at', models.DateTimeField()),
+                ('last_message_text', models.CharField(max_length=100)),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('last_read_at', models.DateTimeField(blank=True, null=True)),
+                ('expires_at', models.DateTimeField(db_index=True, default=core.models.default_expires_at)),
+                ('last_sender', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('other', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('owner', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='conversations', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['owner', '-last_message_at'], name='conversation_owner_last_idx')],
+                'constraints': [models.UniqueConstraint(fields=('owner', 'other'), name='unique_conversation')],
+            },
+        ),
+        migrations.RunPython(backfill_conversations, migrations.RunPython.noop),
+    ]
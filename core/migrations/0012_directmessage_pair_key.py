@@ -0,0 +1,54 @@
+# Generated by Django 6.0 on 2026-10-18 13:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Greatest, Least
+
+
+def backfill_pair_key(apps, schema_editor):
+    DirectMessage = apps.get_model("core", "DirectMessage")
+    DirectMessage.objects.using(schema_editor.connection.alias).update(
+        low_user=Least("sender", "receiver"),
+        high_user=Greatest("sender", "receiver"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_conversation'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='directmessage',
+            name='dm_pair_created_idx',
+        ),
+        migrations.AddField(
+            model_name='directmessage',
+            name='low_user',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='directmessage',
+            name='high_user',
+            field=models.ForeignKey(editable=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.RunPython(backfill_pair_key, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='directmessage',
+            name='low_user',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterField(
+            model_name='directmessage',
+            name='high_user',
+            field=models.ForeignKey(editable=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddIndex(
+            model_name='directmessage',
+            index=models.Index(fields=['low_user', 'high_user', 'created_at', 'id'], name='dm_pair_key_idx'),
+        ),
+    ]
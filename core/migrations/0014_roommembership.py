@@ -0,0 +1,77 @@
+# Generated by Django 6.0 on 2026-10-18 16:20
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_memberships(apps, schema_editor):
+    # 作成者の行と、既存の参加リクエスト（承認済み・承認待ち）を移す
+    Room = apps.get_model("core", "Room")
+    RoomRequest = apps.get_model("core", "RoomRequest")
+    RoomMembership = apps.get_model("core", "RoomMembership")
+    db = schema_editor.connection.alias
+    # 申請日時はそのまま引き継ぐ（履歴モデルなので書き換えても影響はない）
+    RoomMembership._meta.get_field("created_at").auto_now_add = False
+
+    hosts = dict(Room.objects.using(db).values_list("id", "host_id"))
+    RoomMembership.objects.using(db).bulk_create(
+        [
+            RoomMembership(
+                user_id=room.host_id,
+                room_id=room.id,
+                status="host",
+                created_at=room.created_at,
+            )
+            for room in Room.objects.using(db).only("id", "host_id", "created_at").iterator()
+        ],
+        batch_size=1000,
+    )
+
+    def rows():
+        for req in RoomRequest.objects.using(db).iterator():
+            if hosts.get(req.room_id) == req.user_id:
+                continue
+            yield RoomMembership(
+                user_id=req.user_id,
+                room_id=req.room_id,
+                status="approved" if req.approved else "pending",
+                created_at=req.created_at,
+            )
+
+    batch = []
+    for row in rows():
+        batch.append(row)
+        if len(batch) >= 1000:
+            RoomMembership.objects.using(db).bulk_create(batch)
+            batch = []
+    RoomMembership.objects.using(db).bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0013_image_variants'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoomMembership',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('host', '作成者'), ('pending', '承認待ち'), ('approved', '参加中')], default='pending', max_length=10)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('room', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='memberships', to='core.room')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='room_memberships', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['room', 'status'], name='membership_room_status_idx')],
+                'constraints': [models.UniqueConstraint(fields=('user', 'room'), name='unique_room_membership')],
+            },
+        ),
+        migrations.RunPython(backfill_memberships, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='RoomRequest',
+        ),
+    ]
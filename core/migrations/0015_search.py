@@ -0,0 +1,98 @@
+# Generated by Django 6.0 on 2026-10-18 17:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+TABLE = "core_searchdocument"
+
+SQLITE_FTS5 = [
+    # tokens（空白区切りの 2-gram）を外部コンテンツとして持つ FTS5 テーブル
+    f"""CREATE VIRTUAL TABLE {TABLE}_fts USING fts5(
+        tokens, content='{TABLE}', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 0'
+    )""",
+    f"""CREATE TRIGGER {TABLE}_ai AFTER INSERT ON {TABLE} BEGIN
+        INSERT INTO {TABLE}_fts(rowid, tokens) VALUES (new.id, new.tokens);
+    END""",
+    f"""CREATE TRIGGER {TABLE}_ad AFTER DELETE ON {TABLE} BEGIN
+        INSERT INTO {TABLE}_fts({TABLE}_fts, rowid, tokens)
+        VALUES ('delete', old.id, old.tokens);
+    END""",
+    f"""CREATE TRIGGER {TABLE}_au AFTER UPDATE OF tokens ON {TABLE} BEGIN
+        INSERT INTO {TABLE}_fts({TABLE}_fts, rowid, tokens)
+        VALUES ('delete', old.id, old.tokens);
+        INSERT INTO {TABLE}_fts(rowid, tokens) VALUES (new.id, new.tokens);
+    END""",
+]
+
+SQLITE_FTS5_DROP = [
+    f"DROP TRIGGER IF EXISTS {TABLE}_au",
+    f"DROP TRIGGER IF EXISTS {TABLE}_ad",
+    f"DROP TRIGGER IF EXISTS {TABLE}_ai",
+    f"DROP TABLE IF EXISTS {TABLE}_fts",
+]
+
+
+def _has_fts5(connection):
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        return any("FTS5" in row[0] for row in cursor.fetchall())
+
+
+def create_fulltext_index(apps, schema_editor):
+    # DB ごとの全文インデックス。どちらも無ければ SearchTerm を使う（core.search）
+    connection = schema_editor.connection
+    if connection.vendor == "mysql":
+        schema_editor.execute(
+            f"ALTER TABLE {TABLE} ADD FULLTEXT INDEX searchdoc_body_ft (body) WITH PARSER ngram"
+        )
+    elif connection.vendor == "sqlite" and _has_fts5(connection):
+        for sql in SQLITE_FTS5:
+            schema_editor.execute(sql)
+
+
+def drop_fulltext_index(apps, schema_editor):
+    connection = schema_editor.connection
+    if connection.vendor == "mysql":
+        schema_editor.execute(f"ALTER TABLE {TABLE} DROP INDEX searchdoc_body_ft")
+    elif connection.vendor == "sqlite":
+        for sql in SQLITE_FTS5_DROP:
+            schema_editor.execute(sql)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_roommembership'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SearchDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('post', '投稿'), ('message', 'メッセージ'), ('room_message', 'ルームメッセージ'), ('room', 'ルーム')], max_length=20)),
+                ('object_id', models.PositiveBigIntegerField()),
+                ('body', models.TextField()),
+                ('tokens', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, null=True)),
+                ('room', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.room')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_search_document')],
+            },
+        ),
+        migrations.CreateModel(
+            name='SearchTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('token', models.CharField(max_length=8)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='terms', to='core.searchdocument')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['token', 'document'], name='searchterm_token_idx')],
+            },
+        ),
+        migrations.RunPython(create_fulltext_index, drop_fulltext_index),
+    ]
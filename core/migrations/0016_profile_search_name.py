@@ -0,0 +1,39 @@
+# Generated by Django 6.0 on 2026-10-18 17:40
+
+from django.db import migrations, models
+
+from core.text import normalize
+
+
+def backfill_search_names(apps, schema_editor):
+    Profile = apps.get_model("core", "Profile")
+    db = schema_editor.connection.alias
+
+    batch = []
+    for profile in Profile.objects.using(db).select_related("user").iterator(chunk_size=1000):
+        profile.search_name = normalize(profile.user.username)
+        batch.append(profile)
+        if len(batch) >= 1000:
+            Profile.objects.using(db).bulk_update(batch, ["search_name"])
+            batch = []
+    Profile.objects.using(db).bulk_update(batch, ["search_name"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='search_name',
+            field=models.CharField(default='', editable=False, max_length=150),
+        ),
+        migrations.RunPython(backfill_search_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='profile',
+            index=models.Index(fields=['search_name', 'user'], name='profile_search_name_idx'),
+        ),
+    ]
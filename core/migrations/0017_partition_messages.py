@@ -0,0 +1,73 @@
+# Generated by Django 6.0 on 2026-10-18 19:10
+
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import migrations
+from django.utils import timezone
+
+TABLES = ["core_message", "core_roommessage", "core_directmessage"]
+
+# 作成時に用意する 1 時間ごとのパーティション数（先の分は core.partitions.rotate が足す）
+INITIAL_HOURS = 31
+
+
+def _partition(bound):
+    return (
+        f"PARTITION {bound.strftime('p%Y%m%d%H')} VALUES LESS THAN "
+        f"(TO_SECONDS('{bound.strftime('%Y-%m-%d %H:%M:%S')}'))"
+    )
+
+
+def partition_tables(apps, schema_editor):
+    # MySQL だけ expires_at で RANGE パーティション分割する（期限切れは DROP PARTITION）
+    connection = schema_editor.connection
+    if connection.vendor != "mysql":
+        return
+
+    start = timezone.now().astimezone(dt_timezone.utc).replace(
+        minute=0, second=0, microsecond=0
+    )
+    clauses = [_partition(start + timedelta(hours=i)) for i in range(INITIAL_HOURS + 1)]
+    clauses.append("PARTITION p_future VALUES LESS THAN MAXVALUE")
+
+    with connection.cursor() as cursor:
+        for table in TABLES:
+            # パーティション分割したテーブルは外部キーを持てない（関連の削除は ORM の CASCADE）
+            cursor.execute(
+                "SELECT CONSTRAINT_NAME FROM information_schema.REFERENTIAL_CONSTRAINTS "
+                "WHERE CONSTRAINT_SCHEMA = DATABASE() AND TABLE_NAME = %s",
+                [table],
+            )
+            for (name,) in cursor.fetchall():
+                schema_editor.execute(f"ALTER TABLE {table} DROP FOREIGN KEY {name}")
+            # 一意キーにはパーティションキーを含める必要がある
+            schema_editor.execute(
+                f"ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY (id, expires_at)"
+            )
+            schema_editor.execute(
+                f"ALTER TABLE {table} PARTITION BY RANGE (TO_SECONDS(expires_at)) "
+                f"({', '.join(clauses)})"
+            )
+
+
+def unpartition_tables(apps, schema_editor):
+    # 外部キーは戻さない
+    connection = schema_editor.connection
+    if connection.vendor != "mysql":
+        return
+    for table in TABLES:
+        schema_editor.execute(f"ALTER TABLE {table} REMOVE PARTITIONING")
+        schema_editor.execute(
+            f"ALTER TABLE {table} DROP PRIMARY KEY, ADD PRIMARY KEY (id)"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_profile_search_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tables, unpartition_tables),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 20:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_partition_messages'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='avatar_version',
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
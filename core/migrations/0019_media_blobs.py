@@ -0,0 +1,38 @@
+# Generated by Django 6.0 on 2026-10-18 20:40
+
+import core.storage
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_profile_avatar_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MediaBlob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=255, unique=True)),
+                ('size', models.PositiveBigIntegerField()),
+                ('refcount', models.PositiveIntegerField(default=0)),
+                ('touched_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['refcount', 'touched_at'], name='mediablob_gc_idx')],
+            },
+        ),
+        migrations.AlterField(
+            model_name='post',
+            name='image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.media_storage, upload_to='posts/'),
+        ),
+        migrations.AlterField(
+            model_name='profile',
+            name='profile_image',
+            field=models.ImageField(blank=True, null=True, storage=core.storage.media_storage, upload_to='profile_images/'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0 on 2026-10-18 22:10
+
+from django.db import migrations
+
+
+def use_binary_collation(apps, schema_editor):
+    # MySQL の既定（utf8mb4_0900_ai_ci）は「か」と「が」を同じ文字として比べるので、
+    # 前方一致の範囲 [か, が) が空になる。コードポイント順で比べる照合順序にする
+    if schema_editor.connection.vendor != "mysql":
+        return
+    schema_editor.execute(
+        "ALTER TABLE core_profile MODIFY search_name varchar(150) "
+        "CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL"
+    )
+
+
+def use_default_collation(apps, schema_editor):
+    if schema_editor.connection.vendor != "mysql":
+        return
+    schema_editor.execute(
+        "ALTER TABLE core_profile MODIFY search_name varchar(150) "
+        "CHARACTER SET utf8mb4 NOT NULL"
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_media_blobs'),
+    ]
+
+    operations = [
+        migrations.RunPython(use_binary_collation, use_default_collation),
+    ]
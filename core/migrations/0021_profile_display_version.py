@@ -0,0 +1,18 @@
+# Generated by Django 6.0 on 2026-10-18 23:05
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_profile_search_name_binary'),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name='profile',
+            old_name='avatar_version',
+            new_name='display_version',
+        ),
+    ]
@@ -1,19 +1,79 @@
-from django.db import models
+import uuid
+
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Min
+from django.conf import settings
+from django.core.cache import cache
 from django.contrib.auth.models import User
+from django.utils import timezone
+from django.utils.text import Truncator
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django import forms
 
+from . import db_router
+from .storage import media_storage
+from .text import normalize
+
+
+def default_expires_at():
+    return timezone.now() + settings.CONTENT_TTL
+
+
+class ExpiringQuerySet(models.QuerySet):
+    # 期限切れの行はここで除外する（削除は delete_old_messages が行う）
+    def live(self, now=None):
+        return self.filter(expires_at__gt=now or timezone.now())
+
 
-class Post(models.Model):
+class ImageVariantsMixin:
+    # core.images が作った派生画像（サイズ別・EXIF なし）の URL を返す
+    def variant_url(self, name):
+        path = self.image_variants.get(name)
+        if path:
+            return self.image_variant_storage.url(path)
+        return None
+
+    @property
+    def image_variant_storage(self):
+        return self.image_file.storage
+
+    def media_refs(self):
+        # 参照している MediaBlob の名前（元画像と派生画像。"source" は作った時の元画像の記録）
+        names = {v for k, v in self.image_variants.items() if k != "source"}
+        names.add(self.image_file.name)
+        return {name for name in names if name}
+
+
+class Post(ImageVariantsMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
-    image = models.ImageField(upload_to="posts/", blank=True, null=True)
+    image = models.ImageField(
+        upload_to="posts/", storage=media_storage, blank=True, null=True
+    )
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(default=default_expires_at, db_index=True)
+
+    objects = ExpiringQuerySet.as_manager()
 
     def __str__(self):
         return self.text[:20]
 
+    @property
+    def image_file(self):
+        return self.image
+
+    @property
+    def thumb_url(self):
+        return self.variant_url("thumb") or self.image.url
+
+    @property
+    def image_srcset(self):
+        if not self.image_variants:
+            return ""
+        return f"{self.variant_url('thumb')} 240w, {self.variant_url('full')} 1080w"
+
 
 class Room(models.Model):
     name = models.CharField(max_length=100)
@@ -21,18 +81,50 @@ class Room(models.Model):
     host = models.ForeignKey(User, on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            # ルーム一覧（新しい順）
+            models.Index(fields=["-created_at"], name="room_created_idx"),
+        ]
+
     def __str__(self):
         return self.name
 
 
-class RoomRequest(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE)
-    room = models.ForeignKey(Room, on_delete=models.CASCADE)
+class RoomMembership(models.Model):
+    """ルームとユーザーの関係（作成者・承認待ち・参加中）。"""
+
+    class Status(models.TextChoices):
+        HOST = "host", "作成者"
+        PENDING = "pending", "承認待ち"
+        APPROVED = "approved", "参加中"
+
+    user = models.ForeignKey(
+        User, on_delete=models.CASCADE, related_name="room_memberships"
+    )
+    room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name="memberships")
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
     created_at = models.DateTimeField(auto_now_add=True)
-    approved = models.BooleanField(default=False)
+
+    # 入室できる状態
+    MEMBER_STATUSES = (Status.HOST, Status.APPROVED)
+
+    class Meta:
+        constraints = [
+            # 1 ユーザー 1 ルームにつき 1 行
+            models.UniqueConstraint(
+                fields=["user", "room"], name="unique_room_membership"
+            ),
+        ]
+        indexes = [
+            # 作成者向けの未承認リクエスト一覧・件数
+            models.Index(fields=["room", "status"], name="membership_room_status_idx"),
+        ]
 
     def __str__(self):
-        return f"{self.user.username} → {self.room.name}"
+        return f"{self.user.username} → {self.room.name} ({self.status})"
 
 
 class Message(models.Model):
@@ -40,11 +132,20 @@ class Message(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(default=default_expires_at, db_index=True)
+
+    objects = ExpiringQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.user.username}: {self.text[:20]}"
 
 
+class DirectMessageQuerySet(ExpiringQuerySet):
+    def between(self, user_a, user_b):
+        low, high = sorted((user_a.id, user_b.id))
+        return self.filter(low_user_id=low, high_user_id=high)
+
+
 class DirectMessage(models.Model):
     sender = models.ForeignKey(
         User,
@@ -56,33 +157,271 @@ class DirectMessage(models.Model):
         related_name="dm_receiver",
         on_delete=models.CASCADE,
     )
+    # 会話キー：2 人のユーザー ID を小さい順に並べたもの（送受信の向きに依らない）
+    low_user = models.ForeignKey(
+        User, related_name="+", on_delete=models.CASCADE, editable=False
+    )
+    high_user = models.ForeignKey(
+        User, related_name="+", on_delete=models.CASCADE, editable=False
+    )
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(default=default_expires_at, db_index=True)
+
+    objects = DirectMessageQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # 会話ごとに時刻順で読む（カーソルによるページング）
+            models.Index(
+                fields=["low_user", "high_user", "created_at", "id"],
+                name="dm_pair_key_idx",
+            ),
+        ]
 
     def __str__(self):
         return f"{self.sender.username} → {self.receiver.username}"
-    
 
-class Profile(models.Model):
+    def assign_pair(self):
+        self.low_user_id, self.high_user_id = sorted((self.sender_id, self.receiver_id))
+
+    def save(self, *args, **kwargs):
+        self.assign_pair()
+        super().save(*args, **kwargs)
+
+
+class Conversation(models.Model):
+    """DM 一覧用の会話。1 組のユーザーにつき参加者ごとに 1 行ずつ持つ。
+
+    DirectMessage の保存時に更新されるので、DM 一覧は owner の行を
+    新しい順に読むだけで済む。DM 一覧の ETag は owner ごとの版（list_version）。
+    """
+
+    LIST_VERSION_KEY = "dm-list:version:{}"
+
+    owner = models.ForeignKey(
+        User, related_name="conversations", on_delete=models.CASCADE
+    )
+    other = models.ForeignKey(User, related_name="+", on_delete=models.CASCADE)
+    last_message_at = models.DateTimeField()
+    last_message_text = models.CharField(max_length=100)
+    last_sender = models.ForeignKey(
+        User, related_name="+", null=True, on_delete=models.SET_NULL
+    )
+    unread_count = models.PositiveIntegerField(default=0)
+    last_read_at = models.DateTimeField(null=True, blank=True)
+    expires_at = models.DateTimeField(default=default_expires_at, db_index=True)
+
+    objects = ExpiringQuerySet.as_manager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["owner", "other"], name="unique_conversation"
+            ),
+        ]
+        indexes = [
+            models.Index(
+                fields=["owner", "-last_message_at"],
+                name="conversation_owner_last_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.owner.username} ⇄ {self.other.username}"
+
+    @classmethod
+    def record_message(cls, dm):
+        cls._touch(dm.sender_id, dm.receiver_id, dm, unread=0)
+        if dm.receiver_id != dm.sender_id:
+            cls._touch(dm.receiver_id, dm.sender_id, dm, unread=1)
+
+    @classmethod
+    def _touch(cls, owner_id, other_id, dm, unread):
+        values = {
+            "last_message_at": dm.created_at,
+            "last_message_text": Truncator(dm.text).chars(100),
+            "last_sender_id": dm.sender_id,
+            "expires_at": dm.expires_at,
+        }
+        cls.invalidate_lists([owner_id])
+        rows = cls.objects.filter(owner_id=owner_id, other_id=other_id)
+        if rows.update(unread_count=F("unread_count") + unread, **values):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    owner_id=owner_id, other_id=other_id, unread_count=unread, **values
+                )
+        except IntegrityError:
+            # 同時に作られた行があれば、そちらを更新する
+            rows.update(unread_count=F("unread_count") + unread, **values)
+
+    @classmethod
+    def mark_read(cls, owner, other):
+        # DM 画面を開くたびに呼ばれる。未読がなければ書き込みとして数えない
+        with db_router.quiet_writes():
+            updated = cls.objects.filter(owner=owner, other=other, unread_count__gt=0).update(
+                unread_count=0, last_read_at=timezone.now()
+            )
+        if updated:
+            db_router.note_write()
+            cls.invalidate_lists([owner.id])
+
+    @classmethod
+    async def amark_read(cls, owner, other):
+        with db_router.quiet_writes():
+            updated = await cls.objects.filter(
+                owner=owner, other=other, unread_count__gt=0
+            ).aupdate(unread_count=0, last_read_at=timezone.now())
+        if updated:
+            db_router.note_write()
+            await cache.adelete(cls.LIST_VERSION_KEY.format(owner.id))
+
+    @classmethod
+    def list_version(cls, owner_id):
+        """owner の DM 一覧が変わると変わる値。
+
+        (版, 次に期限切れになる時刻)。版は会話が更新されるか相手のアイコン・名前が
+        変わると作り直され、期限切れの時刻を過ぎても作り直す。
+        """
+        key = cls.LIST_VERSION_KEY.format(owner_id)
+        now = timezone.now()
+        version = cache.get(key)
+        if version is None or (version[1] is not None and version[1] <= now):
+            next_expiry = (
+                cls.objects.live(now)
+                .filter(owner_id=owner_id)
+                .aggregate(Min("expires_at"))["expires_at__min"]
+            )
+            version = (uuid.uuid4().hex, next_expiry)
+            cache.set(key, version, int(settings.CONTENT_TTL.total_seconds()))
+        return version
+
+    @classmethod
+    def invalidate_lists(cls, owner_ids):
+        # コミット前に別のリクエストが古い版を置き直すことがあるので、コミット後にも消す
+        keys = [cls.LIST_VERSION_KEY.format(owner_id) for owner_id in owner_ids]
+        cache.delete_many(keys)
+        transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+@receiver(post_save, sender=DirectMessage)
+def update_conversations(sender, instance, created, **kwargs):
+    if created:
+        Conversation.record_message(instance)
+
+
+class MediaBlob(models.Model):
+    """アップロード画像の実体。同じ内容は 1 つだけ保存する（core.storage）。
+
+    Post・Profile の画像と派生画像から参照され、参照数が 0 のまま
+    MEDIA_GC_GRACE たったものは core.media.collect_garbage が削除する。
+    """
+
+    # 内容の SHA-256 から決まる保存先（blobs/ab/cd/<sha256>.png）
+    name = models.CharField(max_length=255, unique=True)
+    size = models.PositiveBigIntegerField()
+    refcount = models.PositiveIntegerField(default=0)
+    # 最後に保存・参照解除された時刻（GC の猶予の起点）
+    touched_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # 参照されていない実体を探す（GC）
+            models.Index(fields=["refcount", "touched_at"], name="mediablob_gc_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.name} ({self.refcount})"
+
+    @classmethod
+    def update_refs(cls, old, new):
+        """参照する名前の集合が old から new に変わった分だけ参照数を増減する。"""
+        if new - old:
+            cls.objects.filter(name__in=new - old).update(refcount=F("refcount") + 1)
+        if old - new:
+            cls.objects.filter(name__in=old - new, refcount__gt=0).update(
+                refcount=F("refcount") - 1, touched_at=timezone.now()
+            )
+
+
+class Profile(ImageVariantsMixin, models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     bio = models.TextField(blank=True, null=True)
     profile_image = models.ImageField(
-        upload_to="profile_images/", blank=True, null=True
+        upload_to="profile_images/", storage=media_storage, blank=True, null=True
     )
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
+    # ユーザー検索用に正規化したユーザー名（core.text.normalize）
+    # MySQL では utf8mb4_bin（migration 0020）。前方一致の範囲検索がコードポイント順を前提にする
+    search_name = models.CharField(max_length=150, default="", editable=False)
+    # アイコン・ユーザー名が変わるたびに上げる（キャッシュ済みのメッセージ断片のキーと ETag に使う）
+    display_version = models.PositiveIntegerField(default=0, editable=False)
+
+    class Meta:
+        indexes = [
+            # ユーザー一覧の前方一致・名前順のページング
+            models.Index(fields=["search_name", "user"], name="profile_search_name_idx"),
+        ]
 
     def __str__(self):
         return self.user.username
 
+    @property
+    def image_file(self):
+        return self.profile_image
+
+    # アイコン用（小）・プロフィール画面用（大）の URL。画像が無ければ None
+    @property
+    def avatar_url(self):
+        if not self.profile_image:
+            return None
+        return self.variant_url("avatar") or self.profile_image.url
+
+    @property
+    def large_url(self):
+        if not self.profile_image:
+            return None
+        return self.variant_url("large") or self.profile_image.url
+
+    def bump_display_version(self):
+        from .backends import invalidate_cached_user
+        from .timeline import invalidate_home_timeline
+
+        Profile.objects.filter(pk=self.pk).update(display_version=F("display_version") + 1)
+        self.refresh_from_db(fields=["display_version"])
+        # update() は post_save を通らないので、キャッシュしたログインユーザーもここで消す
+        invalidate_cached_user(self.user_id)
+        # 会話の行は参加者ごとにあるので、自分の行の相手が「自分が載っている DM 一覧」の持ち主
+        Conversation.invalidate_lists(
+            Conversation.objects.filter(owner_id=self.user_id).values_list("other_id", flat=True)
+        )
+        # ホームのタイムラインの断片にもユーザー名が入っている
+        transaction.on_commit(invalidate_home_timeline)
+
+
+@receiver(post_save, sender=Room)
+def create_host_membership(sender, instance, created, **kwargs):
+    if created:
+        # ルームを作ったユーザーは作成者として参加している
+        RoomMembership.objects.create(
+            user_id=instance.host_id, room=instance, status=RoomMembership.Status.HOST
+        )
+
 
 @receiver(post_save, sender=User)
-def create_or_update_user_profile(sender, instance, created, **kwargs):
+def create_or_update_user_profile(sender, instance, created, update_fields, **kwargs):
     if created:
         # ユーザーが新規作成されたとき → Profile を作る
-        Profile.objects.create(user=instance)
-    else:
-        # 既存ユーザー → プロフィールを保存（エラーにならない）
+        Profile.objects.create(user=instance, search_name=normalize(instance.username))
+    elif update_fields is None or "username" in update_fields:
+        # ユーザー名が変わったかもしれない → 検索用の名前を直し、名前入りの断片を作り直させる
+        # （ログイン時の last_login だけの保存では何もしない）
         if hasattr(instance, "profile"):
-            instance.profile.save()
+            instance.profile.search_name = normalize(instance.username)
+            instance.profile.save(update_fields=["search_name"])
+            instance.profile.bump_display_version()
 
 
 class RoomMessage(models.Model):
@@ -92,11 +431,62 @@ class RoomMessage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     text = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(default=default_expires_at, db_index=True)
+
+    objects = ExpiringQuerySet.as_manager()
 
     def __str__(self):
         return f"{self.user.username}: {self.text[:20]}"
 
 
+class SearchDocument(models.Model):
+    """検索対象 1 件分（正規化した本文と、その 2-gram）。
+
+    全文インデックスは DB ごとに core.search が張る（MySQL は FULLTEXT ngram、
+    SQLite は FTS5）。どちらも使えない DB では SearchTerm を転置インデックスにする。
+    """
+
+    class Kind(models.TextChoices):
+        POST = "post", "投稿"
+        MESSAGE = "message", "メッセージ"
+        ROOM_MESSAGE = "room_message", "ルームメッセージ"
+        ROOM = "room", "ルーム"
+
+    kind = models.CharField(max_length=20, choices=Kind.choices)
+    object_id = models.PositiveBigIntegerField()
+    # メッセージの閲覧範囲（ルームの参加者だけ）と、ルーム削除時の連鎖削除に使う
+    room = models.ForeignKey(
+        Room, on_delete=models.CASCADE, null=True, blank=True, related_name="+"
+    )
+    body = models.TextField()
+    tokens = models.TextField()
+    created_at = models.DateTimeField()
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["kind", "object_id"], name="unique_search_document"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.object_id}"
+
+
+class SearchTerm(models.Model):
+    # 全文インデックスの無い DB 用の転置インデックス（2-gram → 文書）
+    token = models.CharField(max_length=8)
+    document = models.ForeignKey(
+        SearchDocument, on_delete=models.CASCADE, related_name="terms"
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["token", "document"], name="searchterm_token_idx"),
+        ]
+
+
 class MessageForm(forms.ModelForm):
     class Meta:
         model = Message
@@ -0,0 +1,103 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connections, router
+
+from .models import DirectMessage, Message, RoomMessage
+
+# expires_at の 1 時間ごとに RANGE パーティションを切るモデル（MySQL のみ）
+PARTITIONED_MODELS = [Message, RoomMessage, DirectMessage]
+
+BUCKET = timedelta(hours=1)
+FUTURE = "p_future"
+
+
+# =====================
+# パーティション名 ⇄ 境界（UTC の「この時刻より前に期限が切れる」）
+# =====================
+def bucket_floor(dt):
+    return dt.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def partition_name(bound):
+    return bound.strftime("p%Y%m%d%H")
+
+
+def partition_bound(name):
+    return datetime.strptime(name, "p%Y%m%d%H").replace(tzinfo=dt_timezone.utc)
+
+
+def partition_clause(bound):
+    return (
+        f"PARTITION {partition_name(bound)} VALUES LESS THAN "
+        f"(TO_SECONDS('{bound.strftime('%Y-%m-%d %H:%M:%S')}'))"
+    )
+
+
+def horizon(now):
+    # 今から作られる行の期限（CONTENT_TTL 後）より先まで用意しておく
+    hours = settings.PARTITION_HOURS_AHEAD
+    return bucket_floor(now + settings.CONTENT_TTL) + hours * BUCKET
+
+
+# =====================
+# ローテーション
+# =====================
+def _connection(model):
+    return connections[router.db_for_write(model)]
+
+
+def partitions(model):
+    """[(名前, 行数の概算)] を境界順に返す。パーティション分割していなければ []。"""
+    connection = _connection(model)
+    if connection.vendor != "mysql":
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT PARTITION_NAME, TABLE_ROWS FROM information_schema.PARTITIONS "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s "
+            "ORDER BY PARTITION_ORDINAL_POSITION",
+            [model._meta.db_table],
+        )
+        return [(name, rows) for name, rows in cursor.fetchall() if name]
+
+
+def is_partitioned(model):
+    return bool(partitions(model))
+
+
+def rotate(model, now):
+    """期限切れのパーティションを DROP し、先のパーティションを足す。
+
+    DROP したパーティションの行数（概算）を返す。境界が now 以前のパーティションには
+    期限切れの行しか入っていないので、行ごとの DELETE をせずにまとめて捨てられる。
+    """
+    buckets = partitions(model)
+    table = model._meta.db_table
+    connection = _connection(model)
+
+    expired = [
+        (name, rows)
+        for name, rows in buckets
+        if name != FUTURE and partition_bound(name) <= now
+    ]
+    with connection.cursor() as cursor:
+        if expired:
+            names = ", ".join(name for name, _ in expired)
+            cursor.execute(f"ALTER TABLE {table} DROP PARTITION {names}")
+
+        # p_future は空のはずなので、分割し直しても行の移動はほぼ起きない
+        bounds = [partition_bound(name) for name, _ in buckets if name != FUTURE]
+        last = max(bounds) if bounds else bucket_floor(now)
+        end = horizon(now)
+        ahead = []
+        while last < end:
+            last += BUCKET
+            ahead.append(partition_clause(last))
+        if ahead:
+            cursor.execute(
+                f"ALTER TABLE {table} REORGANIZE PARTITION {FUTURE} INTO ("
+                + ", ".join(ahead)
+                + f", PARTITION {FUTURE} VALUES LESS THAN MAXVALUE)"
+            )
+    return sum(rows or 0 for _, rows in expired)
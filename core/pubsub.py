@@ -0,0 +1,158 @@
+import asyncio
+import json
+import logging
+import os
+import socket
+import threading
+import uuid
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+# 1 データグラムの上限（受信側の recv の大きさ）
+MAX_DATAGRAM = 65536
+# 上限を超えるイベントで残す項目（描画済みの断片は落とし、購読側に取りに行かせる）
+ESSENTIAL_KEYS = ("id", "user_id")
+
+
+# =====================
+# Pub/Sub バックエンド
+# =====================
+class BaseBroker:
+    """新着メッセージをチャンネル購読者へ配信するバックエンドの基底クラス。
+
+    publish() はビュー（同期スレッド）から呼ばれ、subscribe() は ASGI の
+    イベントループ上の非同期ビューから使われる。
+    """
+
+    def publish(self, channel, payload):
+        raise NotImplementedError
+
+    def subscribe(self, channel):
+        raise NotImplementedError
+
+
+class InProcessBroker(BaseBroker):
+    """1 プロセス内だけで配信する実装（単一ノード用）。"""
+
+    def __init__(self, queue_size=100):
+        self.queue_size = queue_size
+        self._lock = threading.Lock()
+        self._subscribers = {}
+
+    def publish(self, channel, payload):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(self._deliver, queue, payload)
+
+    @staticmethod
+    def _deliver(queue, payload):
+        # 受信が追いつかないクライアントには古いイベントを捨てる
+        # （再接続時に after_id で取りこぼしを補完する）
+        if queue.full():
+            queue.get_nowait()
+        queue.put_nowait(payload)
+
+    def subscribe(self, channel):
+        return Subscription(self, channel, asyncio.Queue(self.queue_size))
+
+    def _add(self, subscription):
+        entry = (asyncio.get_running_loop(), subscription.queue)
+        with self._lock:
+            self._subscribers.setdefault(subscription.channel, set()).add(entry)
+        return entry
+
+    def _remove(self, subscription, entry):
+        with self._lock:
+            subscribers = self._subscribers.get(subscription.channel)
+            if subscribers is not None:
+                subscribers.discard(entry)
+                if not subscribers:
+                    del self._subscribers[subscription.channel]
+
+
+class Subscription:
+    """`async with broker.subscribe(channel) as queue:` の形で使う購読。"""
+
+    def __init__(self, broker, channel, queue):
+        self.broker = broker
+        self.channel = channel
+        self.queue = queue
+        self._entry = None
+
+    async def __aenter__(self):
+        self._entry = self.broker._add(self)
+        return self.queue
+
+    async def __aexit__(self, *exc_info):
+        self.broker._remove(self, self._entry)
+
+
+class LocalSocketBroker(InProcessBroker):
+    """同一ホスト上の複数プロセス間で配信する実装（マルチプロセス用の代替）。
+
+    各プロセスが PUBSUB_SOCKET_DIR に Unix ドメインソケットを 1 つ作り、
+    publish() はディレクトリ内の全ソケットへデータグラムを送る。
+    受信したイベントは InProcessBroker と同じ仕組みでプロセス内に配る。
+    """
+
+    def __init__(self, socket_dir=None, queue_size=100):
+        super().__init__(queue_size=queue_size)
+        self.socket_dir = socket_dir or settings.PUBSUB_SOCKET_DIR
+        os.makedirs(self.socket_dir, exist_ok=True)
+        self.path = os.path.join(self.socket_dir, f"{uuid.uuid4().hex}.sock")
+        self._receiver = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._receiver.bind(self.path)
+        self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        threading.Thread(target=self._listen, daemon=True).start()
+
+    def publish(self, channel, payload):
+        data = json.dumps({"channel": channel, "payload": payload}).encode()
+        if len(data) > MAX_DATAGRAM:
+            logger.warning("Event on %s is %d bytes, sending ids only", channel, len(data))
+            payload = {key: payload[key] for key in ESSENTIAL_KEYS if key in payload}
+            data = json.dumps({"channel": channel, "payload": payload}).encode()
+        for name in os.listdir(self.socket_dir):
+            if not name.endswith(".sock"):
+                continue
+            path = os.path.join(self.socket_dir, name)
+            try:
+                # on_commit からリクエストのスレッドで呼ばれるので、受信側が詰まっていても待たない
+                self._sender.sendto(data, socket.MSG_DONTWAIT, path)
+            except BlockingIOError:
+                # 取りこぼした分はブラウザが再接続時に after_id で取りに来る
+                logger.warning("Dropped event on %s: %s is not receiving", channel, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 終了したプロセスのソケットは片付ける
+                if path != self.path:
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+            except OSError:
+                logger.warning("Failed to publish event on %s to %s", channel, path, exc_info=True)
+
+    def _listen(self):
+        while True:
+            data = self._receiver.recv(MAX_DATAGRAM)
+            try:
+                event = json.loads(data)
+            except ValueError:
+                continue
+            super().publish(event["channel"], event["payload"])
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(settings.PUBSUB_BACKEND)()
+    return _broker
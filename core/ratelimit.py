@@ -0,0 +1,197 @@
+import math
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse, JsonResponse
+
+from . import metrics
+
+RETRY_MESSAGES = {
+    429: "送信が多すぎます。少し待ってから送信してください。",
+    503: "混み合っています。少し待ってから送信してください。",
+}
+
+
+def retry_later(request, status, retry_after):
+    """429 / 503 を Retry-After 付きで返す（XHR には JSON）。"""
+    if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+        response = JsonResponse(
+            {"error": RETRY_MESSAGES[status], "retry_after": retry_after}, status=status
+        )
+    else:
+        response = HttpResponse(RETRY_MESSAGES[status], status=status)
+    response["Retry-After"] = str(retry_after)
+    return response
+
+
+# =====================
+# スライディングウィンドウ
+# =====================
+# settings.RATE_LIMITS の (回数, 秒): 直近「秒」のあいだに「回数」まで書ける。
+# 「秒」ごとの区切りの回数を cache.incr で数え、前の区切りの回数は経過した割合だけ
+# 減らして足す（区切りの直後にまとめて 2 倍使えず、予算は少しずつ戻る）。
+# 読み書きはすべて cache の add / incr / decr なので、ロックは使わない。
+
+
+def _buckets(user_id, scopes, view_kwargs):
+    for scope in scopes:
+        limit = settings.RATE_LIMITS.get(scope)
+        if not limit:
+            continue
+        if scope == "user":
+            ident = user_id
+        elif scope == "room":
+            ident = view_kwargs["room_id"]
+        else:
+            ident = "all"
+        yield f"ratelimit:{scope}:{ident}", limit
+
+
+def _windows(buckets, now):
+    """(今の区切りのキー, 前の区切りのキー, 回数, 秒, 今の区切りの経過秒数) を返す。"""
+    windows = []
+    for key, (capacity, period) in buckets:
+        slot, elapsed = divmod(now, period)
+        windows.append((f"{key}:{int(slot)}", f"{key}:{int(slot) - 1}", capacity, period, elapsed))
+    return windows
+
+
+def _wait(window, used, previous):
+    """今の区切りで used 回目を使うと上限を超えるなら待つ秒数、超えなければ None。"""
+    _, _, capacity, period, elapsed = window
+    if used + previous * (1 - elapsed / period) <= capacity:
+        return None
+    if used <= capacity:
+        # 前の区切りの分が減って収まるまで
+        seconds = (1 - (capacity - used) / previous) * period - elapsed
+    else:
+        # 今の区切りが終わり、その分が前の区切りとして減って収まるまで
+        seconds = period - elapsed + (1 - (capacity - 1) / (used - 1)) * period
+    return max(1, math.ceil(seconds))
+
+
+def _check(windows, counts, used):
+    waits = [
+        _wait(window, used[i], counts.get(window[1], 0)) for i, window in enumerate(windows)
+    ]
+    waits = [wait for wait in waits if wait is not None]
+    return max(waits) if waits else None
+
+
+def _timeout(period):
+    # 次の区切りでも「前の区切り」として読むので、2 区切り分は残す
+    return 2 * period + 1
+
+
+def take(user_id, scopes, view_kwargs):
+    """各区切りを 1 回ずつ使う。上限を超えるなら待つ秒数を、使えたら None を返す。"""
+    windows = _windows(list(_buckets(user_id, scopes, view_kwargs)), time.time())
+    if not windows:
+        return None
+    counts = cache.get_many([key for window in windows for key in window[:2]])
+    # どれか 1 つでも足りなければ、どの区切りも使わない
+    retry_after = _check(windows, counts, [counts.get(w[0], 0) + 1 for w in windows])
+    if retry_after is not None:
+        return retry_after
+
+    used = []
+    for key, _, _, period, _ in windows:
+        cache.add(key, 0, _timeout(period))
+        try:
+            used.append(cache.incr(key))
+        except ValueError:
+            # add と incr のあいだに追い出された
+            cache.add(key, 1, _timeout(period))
+            used.append(1)
+    # 読んでから増やすまでに他のリクエストが使っていたら、増やした分を戻して断る
+    retry_after = _check(windows, counts, used)
+    if retry_after is not None:
+        for key, *_ in windows:
+            try:
+                cache.decr(key)
+            except ValueError:
+                pass
+    return retry_after
+
+
+async def atake(user_id, scopes, view_kwargs):
+    windows = _windows(list(_buckets(user_id, scopes, view_kwargs)), time.time())
+    if not windows:
+        return None
+    counts = await cache.aget_many([key for window in windows for key in window[:2]])
+    retry_after = _check(windows, counts, [counts.get(w[0], 0) + 1 for w in windows])
+    if retry_after is not None:
+        return retry_after
+
+    used = []
+    for key, _, _, period, _ in windows:
+        await cache.aadd(key, 0, _timeout(period))
+        try:
+            used.append(await cache.aincr(key))
+        except ValueError:
+            await cache.aadd(key, 1, _timeout(period))
+            used.append(1)
+    retry_after = _check(windows, counts, used)
+    if retry_after is not None:
+        for key, *_ in windows:
+            try:
+                await cache.adecr(key)
+            except ValueError:
+                pass
+    return retry_after
+
+
+def shedding():
+    """view の直近の平均応答時間がしきい値を超えているか。"""
+    threshold = settings.LOAD_SHEDDING_LATENCY_MS
+    return threshold is not None and metrics.recent_latency_ms.value > threshold
+
+
+# =====================
+# デコレーター
+# =====================
+def rate_limit(*scopes, shed=False, when=None):
+    """POST に "user" / "room" / "global" の上限を適用する（全部に残りがあるときだけ使う）。
+
+    shed=True の書き込み（なくても困らないもの）は、負荷が高いあいだ 503 で断る。
+    when(user, **view_kwargs) が偽のリクエスト（入れないルームへの書き込みなど）は
+    数えずに view に任せる（async の view では when も async 関数）。
+    login_required の内側に付ける。
+    """
+
+    def decorator(view):
+        if iscoroutinefunction(view):
+
+            @wraps(view)
+            async def _wrapped(request, *args, **kwargs):
+                if request.method == "POST":
+                    user = await request.auser()
+                    if when is not None and not await when(user, **kwargs):
+                        return await view(request, *args, **kwargs)
+                    if shed and shedding():
+                        return retry_later(request, 503, settings.LOAD_SHEDDING_RETRY_SECONDS)
+                    retry_after = await atake(user.id, scopes, kwargs)
+                    if retry_after is not None:
+                        return retry_later(request, 429, retry_after)
+                return await view(request, *args, **kwargs)
+
+        else:
+
+            @wraps(view)
+            def _wrapped(request, *args, **kwargs):
+                if request.method == "POST":
+                    if when is not None and not when(request.user, **kwargs):
+                        return view(request, *args, **kwargs)
+                    if shed and shedding():
+                        return retry_later(request, 503, settings.LOAD_SHEDDING_RETRY_SECONDS)
+                    retry_after = take(request.user.id, scopes, kwargs)
+                    if retry_after is not None:
+                        return retry_later(request, 429, retry_after)
+                return view(request, *args, **kwargs)
+
+        return _wrapped
+
+    return decorator
@@ -0,0 +1,102 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+ROOM_MESSAGE_TEMPLATE = "core/partials/room_message.html"
+DIRECT_MESSAGE_TEMPLATE = "core/partials/direct_message.html"
+
+
+# =====================
+# チャットの 1 メッセージ分の HTML 断片
+# =====================
+def render_room_message(msg, mine):
+    return render_to_string(ROOM_MESSAGE_TEMPLATE, {"msg": msg, "mine": mine})
+
+
+def render_direct_message(msg, mine):
+    return render_to_string(DIRECT_MESSAGE_TEMPLATE, {"msg": msg, "mine": mine})
+
+
+# =====================
+# 画面・差分取得用のメッセージ一覧（断片をキャッシュしてつなぐ）
+# =====================
+# メッセージは編集されないので、断片は (id, 自分側か, 送信者のアイコン・名前の版) で決まる。
+# 描画済みの断片はメッセージの保存期間だけキャッシュし、描画するのは新しい分だけにする。
+def _fragment_key(prefix, msg, mine, author):
+    return f"fragment:{prefix}:{msg.id}:{int(mine)}:{author.profile.display_version}"
+
+
+def _keys(prefix, entries):
+    # entries: (メッセージ, 送信者, 自分側か)
+    return [_fragment_key(prefix, msg, mine, author) for msg, author, mine in entries]
+
+
+def _join(template, keys, entries, cached):
+    # キャッシュになかった断片だけ描画する。描画した分は呼び出し側が保存する
+    rendered = {}
+    parts = []
+    for key, (msg, author, mine) in zip(keys, entries):
+        html = cached.get(key)
+        if html is None:
+            html = rendered[key] = render_to_string(template, {"msg": msg, "mine": mine})
+        parts.append(html)
+    return mark_safe("".join(parts)), rendered
+
+
+def _timeout():
+    return int(settings.CONTENT_TTL.total_seconds())
+
+
+def _render_fragments(prefix, template, entries):
+    keys = _keys(prefix, entries)
+    html, rendered = _join(template, keys, entries, cache.get_many(keys))
+    if rendered:
+        cache.set_many(rendered, _timeout())
+    return html
+
+
+async def _arender_fragments(prefix, template, entries):
+    keys = _keys(prefix, entries)
+    html, rendered = _join(template, keys, entries, await cache.aget_many(keys))
+    if rendered:
+        await cache.aset_many(rendered, _timeout())
+    return html
+
+
+def _room_entries(messages, user):
+    return [(msg, msg.user, msg.user_id == user.id) for msg in messages]
+
+
+def _direct_entries(messages, user):
+    return [(msg, msg.sender, msg.sender_id == user.id) for msg in messages]
+
+
+def render_room_messages(messages, user):
+    return _render_fragments("room", ROOM_MESSAGE_TEMPLATE, _room_entries(messages, user))
+
+
+def render_direct_messages(messages, user):
+    return _render_fragments("dm", DIRECT_MESSAGE_TEMPLATE, _direct_entries(messages, user))
+
+
+async def arender_room_messages(messages, user):
+    return await _arender_fragments(
+        "room", ROOM_MESSAGE_TEMPLATE, _room_entries(messages, user)
+    )
+
+
+async def arender_direct_messages(messages, user):
+    return await _arender_fragments(
+        "dm", DIRECT_MESSAGE_TEMPLATE, _direct_entries(messages, user)
+    )
+
+
+# =====================
+# ユーザー一覧の 1 行分
+# =====================
+def render_user_rows(profiles):
+    return "".join(
+        render_to_string("core/partials/user_row.html", {"profile": profile})
+        for profile in profiles
+    )
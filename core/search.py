@@ -0,0 +1,350 @@
+from django.conf import settings
+from django.db import connection, connections, router, transaction
+from django.db.models import Count, Q
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .membership import room_statuses
+from .models import (
+    Message,
+    Post,
+    Room,
+    RoomMembership,
+    RoomMessage,
+    SearchDocument,
+    SearchTerm,
+)
+from .text import normalize, words
+
+# 1 ページの件数と、たどれるページ数の上限（深いページは順位付けのコストが大きい）
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGES = 50
+
+# 順位を付ける候補の上限（見てよい文書の新しい順にこの件数まで。よくある語でも一定時間で返す）
+SEARCH_CANDIDATES = 2000
+
+# 公開されている（ルームの参加者でなくても見える）種類
+PUBLIC_KINDS = (SearchDocument.Kind.POST, SearchDocument.Kind.ROOM)
+
+
+# =====================
+# 2-gram（正規化は core.text）
+# =====================
+def bigrams(word):
+    """語を 2 文字ずつずらして切り出す。
+
+    末尾の 1 文字も単独のトークンにしておくと、1 文字の検索語を
+    前方一致（「京」→「京た」「京」）だけで探せる。
+    """
+    if len(word) == 1:
+        return [word]
+    return [word[i:i + 2] for i in range(len(word) - 1)] + [word[-1]]
+
+
+def tokenize(normalized):
+    return [gram for word in words(normalized) for gram in bigrams(word)]
+
+
+# =====================
+# 検索バックエンド
+# =====================
+class BaseSearchBackend:
+    """SearchDocument の全文インデックスを引くバックエンドの基底クラス。"""
+
+    def index(self, documents):
+        # 全文インデックスを DB が自動で更新するバックエンドでは何もしない
+        pass
+
+    def search(self, terms, member_room_ids, now, offset, limit):
+        """terms（正規化済みの語のリスト）すべてを含む文書の ID を順位順に返す。"""
+        raise NotImplementedError
+
+    def _scope_sql(self, member_room_ids, now):
+        # 公開の種類か、参加中のルームのメッセージ。期限切れは除く
+        kinds = ", ".join("%s" for _ in PUBLIC_KINDS)
+        sql = f"(d.kind IN ({kinds})"
+        params = list(PUBLIC_KINDS)
+        if member_room_ids:
+            rooms = ", ".join("%s" for _ in member_room_ids)
+            sql += f" OR d.room_id IN ({rooms})"
+            params += list(member_room_ids)
+        sql += ") AND (d.expires_at IS NULL OR d.expires_at > %s)"
+        params.append(now)
+        return sql, params
+
+
+def _read_connection():
+    # 生 SQL も ORM と同じく読み取り用の DB（レプリカ）へ
+    return connections[router.db_for_read(SearchDocument)]
+
+
+class MySQLFulltextBackend(BaseSearchBackend):
+    """body の FULLTEXT INDEX（WITH PARSER ngram, ngram_token_size=2）を使う。"""
+
+    def search(self, terms, member_room_ids, now, offset, limit):
+        # 2 文字以上は語句の完全一致、1 文字は前方一致
+        query = " ".join(f'+"{term}"' if len(term) > 1 else f"+{term}*" for term in terms)
+        scope, params = self._scope_sql(member_room_ids, now)
+        table = SearchDocument._meta.db_table
+        # 見られない・期限切れの文書で候補の枠が埋まらないよう、絞り込んでから上限を掛ける
+        sql = (
+            f"SELECT f.id FROM ("
+            f"SELECT d.id, d.created_at, MATCH(d.body) AGAINST (%s IN BOOLEAN MODE) AS score "
+            f"FROM {table} d "
+            f"WHERE MATCH(d.body) AGAINST (%s IN BOOLEAN MODE) AND {scope} "
+            f"ORDER BY d.id DESC LIMIT %s"
+            f") f "
+            f"ORDER BY f.score DESC, f.created_at DESC LIMIT %s OFFSET %s"
+        )
+        with _read_connection().cursor() as cursor:
+            cursor.execute(sql, [query, query, *params, SEARCH_CANDIDATES, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class SQLiteFTS5Backend(BaseSearchBackend):
+    """tokens（空白区切りの 2-gram）を外部コンテンツにした FTS5 テーブルを使う。
+
+    FTS5 テーブルは SearchDocument への INSERT / UPDATE / DELETE を
+    トリガーで追いかける（マイグレーション 0015 で作成）。
+    """
+
+    def search(self, terms, member_room_ids, now, offset, limit):
+        # 語ごとに 2-gram の並び（フレーズ）で一致させる。1 文字は前方一致
+        query = " ".join(
+            f'"{" ".join(bigrams(term)[:-1])}"' if len(term) > 1 else f'"{term}"*'
+            for term in terms
+        )
+        scope, params = self._scope_sql(member_room_ids, now)
+        table = SearchDocument._meta.db_table
+        # FTS5 は rowid（≒作成順）の順なら全件を採点せずに読めるので、新しい候補だけ採点する
+        # 見られない・期限切れの文書で候補の枠が埋まらないよう、絞り込んでから上限を掛ける
+        sql = (
+            f"SELECT f.id FROM ("
+            f"SELECT d.id, d.created_at, bm25({table}_fts) AS score "
+            f"FROM {table}_fts JOIN {table} d ON d.id = {table}_fts.rowid "
+            f"WHERE {table}_fts MATCH %s AND {scope} "
+            f"ORDER BY {table}_fts.rowid DESC LIMIT %s"
+            f") f "
+            f"ORDER BY f.score, f.created_at DESC LIMIT %s OFFSET %s"
+        )
+        with _read_connection().cursor() as cursor:
+            cursor.execute(sql, [query, *params, SEARCH_CANDIDATES, limit, offset])
+            return [row[0] for row in cursor.fetchall()]
+
+
+class TermIndexBackend(BaseSearchBackend):
+    """全文インデックスの無い DB 用。SearchTerm を転置インデックスとして引く。"""
+
+    def index(self, documents):
+        documents = list(documents)
+        SearchTerm.objects.filter(document__in=documents).delete()
+        SearchTerm.objects.bulk_create(
+            [
+                SearchTerm(token=token, document=document)
+                for document in documents
+                for token in set(document.tokens.split())
+            ],
+            batch_size=1000,
+        )
+
+    def search(self, terms, member_room_ids, now, offset, limit):
+        qs = SearchDocument.objects.filter(
+            Q(kind__in=PUBLIC_KINDS) | Q(room_id__in=member_room_ids),
+            Q(expires_at__isnull=True) | Q(expires_at__gt=now),
+        )
+        for term in terms:
+            if len(term) == 1:
+                matched = SearchTerm.objects.filter(token__startswith=term)
+            else:
+                # すべての 2-gram を持つ文書に絞ってから、本文で並びを確かめる
+                grams = set(bigrams(term)[:-1])
+                matched = (
+                    SearchTerm.objects.filter(token__in=grams)
+                    .values("document_id")
+                    .annotate(hits=Count("id"))
+                    .filter(hits=len(grams))
+                )
+                qs = qs.filter(body__contains=term)
+            qs = qs.filter(id__in=matched.values("document_id"))
+        ids = qs.order_by("-created_at").values_list("id", flat=True)
+        return list(ids[offset:offset + limit])
+
+
+_backend = None
+
+
+def _detect_backend():
+    if connection.vendor == "mysql":
+        return MySQLFulltextBackend
+    if connection.vendor == "sqlite":
+        fts_table = f"{SearchDocument._meta.db_table}_fts"
+        with connection.cursor() as cursor:
+            if fts_table in connection.introspection.table_names(cursor):
+                return SQLiteFTS5Backend
+    return TermIndexBackend
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        backend = getattr(settings, "SEARCH_BACKEND", None)
+        _backend = import_string(backend)() if backend else _detect_backend()()
+    return _backend
+
+
+# =====================
+# インデックスの更新
+# =====================
+SOURCES = {
+    Post: SearchDocument.Kind.POST,
+    Message: SearchDocument.Kind.MESSAGE,
+    RoomMessage: SearchDocument.Kind.ROOM_MESSAGE,
+    Room: SearchDocument.Kind.ROOM,
+}
+
+
+def document_for(instance):
+    """検索対象のオブジェクトから（未保存の）SearchDocument を作る。"""
+    if isinstance(instance, Room):
+        kind = SearchDocument.Kind.ROOM
+        text = f"{instance.name}\n{instance.description}"
+        room_id = instance.id
+        expires_at = None
+    else:
+        kind = SOURCES[type(instance)]
+        text = instance.text
+        room_id = getattr(instance, "room_id", None)
+        expires_at = instance.expires_at
+
+    body = normalize(text)
+    return SearchDocument(
+        kind=kind,
+        object_id=instance.pk,
+        room_id=room_id,
+        body=body,
+        tokens=" ".join(tokenize(body)),
+        created_at=instance.created_at,
+        expires_at=expires_at,
+    )
+
+
+def index_object(instance, created=False):
+    document = document_for(instance)
+    if created:
+        document.save()
+    else:
+        document, _ = SearchDocument.objects.update_or_create(
+            kind=document.kind,
+            object_id=document.object_id,
+            defaults={
+                field: getattr(document, field)
+                for field in ("room_id", "body", "tokens", "created_at", "expires_at")
+            },
+        )
+    get_backend().index([document])
+
+
+def index_queryset(queryset, batch_size=1000):
+    """既存の行をまとめて索引に入れる（rebuild_search_index 用）。件数を返す。"""
+    total = 0
+    batch = []
+    for instance in queryset.iterator(chunk_size=batch_size):
+        batch.append(document_for(instance))
+        if len(batch) >= batch_size:
+            total += _bulk_index(batch)
+            batch = []
+    if batch:
+        total += _bulk_index(batch)
+    return total
+
+
+def _bulk_index(documents):
+    documents = SearchDocument.objects.bulk_create(documents)
+    if any(document.pk is None for document in documents):
+        # 主キーを返さない DB（MySQL）では読み直す
+        lookup = Q()
+        for document in documents:
+            lookup |= Q(kind=document.kind, object_id=document.object_id)
+        documents = list(SearchDocument.objects.filter(lookup))
+    get_backend().index(documents)
+    return len(documents)
+
+
+@receiver(post_save, sender=Post)
+@receiver(post_save, sender=Message)
+@receiver(post_save, sender=RoomMessage)
+@receiver(post_save, sender=Room)
+def index_on_save(sender, instance, created, **kwargs):
+    transaction.on_commit(lambda: index_object(instance, created))
+
+
+# ルームの削除は外部キーの CASCADE で、期限切れは expires_at で片付く
+@receiver(post_delete, sender=Post)
+def remove_on_delete(sender, instance, **kwargs):
+    SearchDocument.objects.filter(
+        kind=SearchDocument.Kind.POST, object_id=instance.pk
+    ).delete()
+
+
+# =====================
+# 検索
+# =====================
+class SearchHit:
+    def __init__(self, document, obj):
+        self.document = document
+        self.object = obj
+        self.kind = document.kind
+
+    @property
+    def kind_label(self):
+        return SearchDocument.Kind(self.kind).label
+
+
+def search_documents(user, query, page=1):
+    """query を含む文書を順位順に返す。(ヒットのリスト, 次のページがあるか)。"""
+    terms = words(normalize(query))
+    page = max(1, min(page, SEARCH_MAX_PAGES))
+    if not terms:
+        return [], False
+
+    member_room_ids = [
+        room_id
+        for room_id, status in room_statuses(user).items()
+        if status in RoomMembership.MEMBER_STATUSES
+    ]
+    ids = get_backend().search(
+        terms,
+        member_room_ids,
+        timezone.now(),
+        offset=(page - 1) * SEARCH_PAGE_SIZE,
+        limit=SEARCH_PAGE_SIZE + 1,
+    )
+    has_next = len(ids) > SEARCH_PAGE_SIZE and page < SEARCH_MAX_PAGES
+    ids = ids[:SEARCH_PAGE_SIZE]
+
+    documents = SearchDocument.objects.in_bulk(ids)
+    return _hydrate([documents[i] for i in ids if i in documents]), has_next
+
+
+def _hydrate(documents):
+    # 種類ごとに 1 クエリで元のオブジェクトを読む（消えていたら飛ばす）
+    related = {
+        SearchDocument.Kind.POST: Post.objects.select_related("user"),
+        SearchDocument.Kind.MESSAGE: Message.objects.select_related("user", "room"),
+        SearchDocument.Kind.ROOM_MESSAGE: RoomMessage.objects.select_related("user", "room"),
+        SearchDocument.Kind.ROOM: Room.objects.select_related("host"),
+    }
+    objects = {}
+    for kind, qs in related.items():
+        ids = [d.object_id for d in documents if d.kind == kind]
+        if ids:
+            objects[kind] = qs.in_bulk(ids)
+
+    hits = []
+    for document in documents:
+        obj = objects.get(document.kind, {}).get(document.object_id)
+        if obj is not None:
+            hits.append(SearchHit(document, obj))
+    return hits
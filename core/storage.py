@@ -0,0 +1,149 @@
+"""
+ファイルのストレージ。
+
+静的ファイル（collectstatic 用の BundledStaticStorage）:
+- settings.STATIC_BUNDLES の CSS を 1 ファイルにまとめて縮小する
+- すべてのファイルを内容ハッシュ付きの名前で保存する（ManifestStaticFilesStorage）
+- テキスト系のハッシュ付きファイルは .gz（brotli があれば .br も）を事前に作っておく
+
+バンドルは元の CSS を並べてつなぐだけなので、元の CSS で相対パスの url() は使わない。
+
+アップロード画像（ContentAddressedStorage）:
+- 内容の SHA-256 を名前にして保存し、同じ内容は 1 つだけ置く
+- 実体ごとに MediaBlob の行を持ち、参照数は core.media が数える
+"""
+
+import gzip
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, storages
+from django.utils import timezone
+
+try:
+    import brotli
+except ImportError:  # brotli は任意（なければ .gz だけ作る）
+    brotli = None
+
+# 事前圧縮する拡張子（画像は圧縮済みなので対象外）
+COMPRESSIBLE = (".css", ".js", ".svg", ".json", ".txt")
+
+
+def minify_css(css):
+    """コメントと余分な空白を取り除く。"""
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    css = re.sub(r"\s+", " ", css)
+    css = re.sub(r"\s*([{}:;,>])\s*", r"\1", css)
+    return css.replace(";}", "}").strip()
+
+
+class BundledStaticStorage(ManifestStaticFilesStorage):
+    def stored_name(self, name):
+        # collectstatic 前（開発・テスト）はハッシュなしの名前で返す
+        if not self.hashed_files:
+            return name
+        return super().stored_name(name)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if not dry_run:
+            for bundle, sources in settings.STATIC_BUNDLES.items():
+                self._build_bundle(paths, bundle, sources)
+                paths[bundle] = (self, bundle)
+
+        yield from super().post_process(paths, dry_run, **options)
+
+        if not dry_run:
+            for name in set(self.hashed_files.values()):
+                if name.endswith(COMPRESSIBLE):
+                    self._precompress(name)
+
+    def _build_bundle(self, paths, bundle, sources):
+        parts = []
+        for source in sources:
+            storage, path = paths[source]
+            with storage.open(path) as f:
+                parts.append(f.read().decode())
+        if self.exists(bundle):
+            self.delete(bundle)
+        self._save(bundle, ContentFile(minify_css("\n".join(parts)).encode()))
+
+    def _precompress(self, name):
+        with self.open(name) as f:
+            data = f.read()
+        # mtime=0 にして、同じ内容なら毎回同じ .gz になるようにする
+        variants = [(".gz", gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            variants.append((".br", brotli.compress(data)))
+        for suffix, compressed in variants:
+            if self.exists(name + suffix):
+                self.delete(name + suffix)
+            self._save(name + suffix, ContentFile(compressed))
+
+
+# =====================
+# アップロード画像（内容アドレス）
+# =====================
+BLOB_PREFIX = "blobs/"
+
+
+def blob_name(digest, original_name):
+    # 拡張子は元の名前から（小文字にそろえる）。ディレクトリは 2 段に分ける
+    ext = posixpath.splitext(original_name)[1].lower()
+    return f"{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{ext}"
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # 名前は _save で内容から決めるので、重複よけの接尾辞は付けない
+        return name
+
+    def _save(self, name, content):
+        # 一時ファイルに書きながらハッシュを計算する（アップロードを読むのは 1 回だけ）
+        tmp_dir = self.path("tmp")
+        os.makedirs(tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            digest = hashlib.sha256()
+            size = 0
+            with os.fdopen(fd, "wb") as out:
+                for chunk in content.chunks():
+                    digest.update(chunk)
+                    size += len(chunk)
+                    out.write(chunk)
+
+            name = blob_name(digest.hexdigest(), name)
+            # 行を先に作る（GC が行を消した直後でもファイルを消さないようにする）
+            self._touch(name, size)
+
+            full_path = self.path(name)
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            if self.file_permissions_mode is not None:
+                os.chmod(tmp_path, self.file_permissions_mode)
+            # 同じ内容がすでにあっても置き換えるだけ（中身は同じ）
+            os.replace(tmp_path, full_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return name
+
+    def _touch(self, name, size):
+        from .models import MediaBlob
+
+        now = timezone.now()
+        MediaBlob.objects.update_or_create(
+            name=name,
+            defaults={"touched_at": now},
+            create_defaults={"size": size, "touched_at": now},
+        )
+
+
+def media_storage():
+    # Post.image・Profile.profile_image の storage（settings.STORAGES["media"]）
+    return storages["media"]
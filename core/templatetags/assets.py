@@ -0,0 +1,23 @@
+from django import template
+from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.templatetags.static import static
+from django.utils.html import format_html_join
+
+register = template.Library()
+
+
+@register.simple_tag
+def stylesheet(bundle):
+    """CSS バンドルの <link> を出す。
+
+    collectstatic 済みならハッシュ付きの 1 ファイル、まだなら（DEBUG 中も）
+    元の CSS を 1 つずつ読み込む。
+    """
+    if not settings.DEBUG and bundle in getattr(staticfiles_storage, "hashed_files", {}):
+        names = [bundle]
+    else:
+        names = settings.STATIC_BUNDLES[bundle]
+    return format_html_join(
+        "\n    ", '<link rel="stylesheet" href="{}">', ((static(name),) for name in names)
+    )
@@ -1,3 +1,1518 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import os
+import pickle
+import socket
+import tempfile
+import threading
+from datetime import timedelta
+from io import BytesIO
 
-# Create your tests here.
+from unittest.mock import patch
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.contrib.sessions.models import Session
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.uploadhandler import StopUpload
+from django.core.management import call_command
+from django.db import OperationalError, connection, connections, transaction
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.template.loader import render_to_string
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+
+from . import async_views, db_router, metrics
+from .backends import CachedModelBackend
+from .expiry import purge_all, purge_expired
+from .images import generate_derivatives
+from .management.commands.bench_asgi import chat_urlconf
+from .media import collect_garbage
+from .membership import can_enter_room, pending_request_count, room_statuses
+from .metrics import Histogram
+from .partitions import horizon, partition_bound, partition_name, rotate
+from .models import (
+    Conversation,
+    DirectMessage,
+    MediaBlob,
+    Message,
+    Post,
+    Profile,
+    Room,
+    RoomMembership,
+    SearchDocument,
+)
+from .pubsub import InProcessBroker, LocalSocketBroker
+from .ratelimit import take
+from .search import TermIndexBackend, search_documents
+from .storage import media_storage, minify_css
+from .text import normalize, prefix_range
+from .timeline import TIMELINE_BUILD_KEY, TIMELINE_KEY, build_home_timeline
+from .uploads import OVER_QUOTA, CappedImageUploadHandler, sniff_image
+from .views import DM_PAGE_SIZE, ROOM_PAGE_SIZE, static_asset
+from .writebehind import WriteBehindQueue
+
+
+class RoomMessagesTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create_user("host", password="pass")
+        cls.guest = User.objects.create_user("guest", password="pass")
+        cls.stranger = User.objects.create_user("stranger", password="pass")
+        cls.room = Room.objects.create(name="room", host=cls.host)
+        RoomMembership.objects.create(
+            user=cls.guest, room=cls.room, status=RoomMembership.Status.APPROVED
+        )
+        cls.messages = [
+            Message.objects.create(room=cls.room, user=cls.host, text=f"msg {i}")
+            for i in range(ROOM_PAGE_SIZE + 5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.guest)
+        self.url = reverse("room_messages", args=[self.room.id])
+
+    def test_detail_renders_only_latest_page(self):
+        response = self.client.get(reverse("room_detail", args=[self.room.id]))
+        ids = [msg.id for msg in response.context["messages"]]
+        self.assertEqual(ids, [m.id for m in self.messages[-ROOM_PAGE_SIZE:]])
+        self.assertTrue(response.context["has_older"])
+
+    def test_after_id_returns_only_new_messages(self):
+        response = self.client.get(self.url, {"after_id": self.messages[-3].id})
+        data = response.json()
+        self.assertEqual(data["first_id"], self.messages[-2].id)
+        self.assertEqual(data["last_id"], self.messages[-1].id)
+        self.assertFalse(data["has_more"])
+
+    def test_before_id_pages_backwards(self):
+        response = self.client.get(self.url, {"before_id": self.messages[5].id})
+        data = response.json()
+        self.assertEqual(data["first_id"], self.messages[0].id)
+        self.assertEqual(data["last_id"], self.messages[4].id)
+        self.assertFalse(data["has_more"])
+
+    def test_ajax_send_returns_fragment(self):
+        response = self.client.post(
+            reverse("room_detail", args=[self.room.id]),
+            {"text": "hello", "after_id": self.messages[-1].id},
+            headers={"X-Requested-With": "XMLHttpRequest"},
+        )
+        data = response.json()
+        sent = Message.objects.latest("id")
+        self.assertEqual(data["first_id"], sent.id)
+        self.assertEqual(data["last_id"], sent.id)
+        self.assertIn("hello", data["html"])
+
+    def test_stranger_is_forbidden(self):
+        self.client.force_login(self.stranger)
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 403)
+
+    def test_message_fragments_are_cached(self):
+        detail = reverse("room_detail", args=[self.room.id])
+        self.client.get(detail)
+
+        # 2 回目は断片を描画しない
+        with patch("core.rendering.render_to_string", wraps=render_to_string) as render:
+            response = self.client.get(detail)
+        self.assertEqual(render.call_count, 0)
+        self.assertContains(response, f"msg {ROOM_PAGE_SIZE + 4}")
+
+        # 自分側の断片は別に描画する
+        self.client.force_login(self.host)
+        with patch("core.rendering.render_to_string", wraps=render_to_string) as render:
+            response = self.client.get(detail)
+        self.assertEqual(render.call_count, ROOM_PAGE_SIZE)
+        self.assertContains(response, 'class="room-message mine"')
+
+        # アイコンが変わったら描画し直す
+        self.host.profile.bump_display_version()
+        with patch("core.rendering.render_to_string", wraps=render_to_string) as render:
+            self.client.get(detail)
+        self.assertEqual(render.call_count, ROOM_PAGE_SIZE)
+
+        # 名前が変わっても描画し直す
+        self.host.username = "renamed-host"
+        self.host.save()
+        response = self.client.get(detail)
+        self.assertContains(response, "renamed-host")
+
+
+class PubSubTests(TestCase):
+    def test_in_process_broker_fans_out_to_subscribers(self):
+        broker = InProcessBroker()
+
+        async def run():
+            async with broker.subscribe("room:1") as first, broker.subscribe(
+                "room:1"
+            ) as second, broker.subscribe("room:2") as other:
+                broker.publish("room:1", {"id": 1})
+                self.assertEqual(await first.get(), {"id": 1})
+                self.assertEqual(await second.get(), {"id": 1})
+                self.assertTrue(other.empty())
+
+        asyncio.run(run())
+        self.assertEqual(broker._subscribers, {})
+
+    def test_socket_broker_sends_ids_only_for_oversized_events(self):
+        with tempfile.TemporaryDirectory() as socket_dir:
+            broker = LocalSocketBroker(socket_dir=socket_dir)
+
+            async def run():
+                async with broker.subscribe("room:1") as queue:
+                    with self.assertLogs("core.pubsub", "WARNING"):
+                        broker.publish(
+                            "room:1", {"id": 1, "user_id": 2, "mine": "x" * 70000, "other": ""}
+                        )
+                    return await asyncio.wait_for(queue.get(), 5)
+
+            self.assertEqual(asyncio.run(run()), {"id": 1, "user_id": 2})
+
+    def test_socket_broker_drops_events_for_stuck_receivers(self):
+        with tempfile.TemporaryDirectory() as socket_dir:
+            broker = LocalSocketBroker(socket_dir=socket_dir)
+            # 受信しないプロセスのソケット（キューが埋まる）
+            stuck = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            stuck.bind(os.path.join(socket_dir, "stuck.sock"))
+
+            def publish_many():
+                for i in range(100):
+                    broker.publish("room:1", {"id": i, "user_id": 1})
+
+            with self.assertLogs("core.pubsub", "WARNING"):
+                publisher = threading.Thread(target=publish_many, daemon=True)
+                publisher.start()
+                publisher.join(5)
+            self.assertFalse(publisher.is_alive())
+            stuck.close()
+
+    async def test_room_events_streams_for_members_only(self):
+        host = await User.objects.acreate(username="host")
+        stranger = await User.objects.acreate(username="stranger")
+        room = await Room.objects.acreate(name="room", host=host)
+        url = reverse("room_events", args=[room.id])
+
+        await self.async_client.aforce_login(host)
+        response = await self.async_client.get(url)
+        self.assertEqual(response["Content-Type"], "text/event-stream")
+        stream = aiter(response.streaming_content)
+        self.assertEqual(await anext(stream), b": connected\n\n")
+        await stream.aclose()
+
+        await self.async_client.aforce_login(stranger)
+        response = await self.async_client.get(url)
+        self.assertEqual(response.status_code, 403)
+
+
+class ExpiryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("user", password="pass")
+        cls.room = Room.objects.create(name="room", host=cls.user)
+        past = timezone.now() - timedelta(minutes=1)
+        cls.expired = [
+            Message.objects.create(room=cls.room, user=cls.user, text="old", expires_at=past)
+            for _ in range(5)
+        ]
+        cls.live = Message.objects.create(room=cls.room, user=cls.user, text="new")
+
+    def test_purge_deletes_expired_rows_in_chunks(self):
+        self.assertEqual(purge_expired(Message, batch_size=2), 5)
+        self.assertEqual(list(Message.objects.all()), [self.live])
+
+    def test_unpartitioned_tables_fall_back_to_row_deletes(self):
+        self.assertEqual(purge_all()["message"], 5)
+
+    def test_rotate_drops_expired_buckets_and_adds_future_ones(self):
+        now = partition_bound("p2026101812")
+        with patch(
+            "core.partitions.partitions",
+            return_value=[
+                ("p2026101811", 40),
+                ("p2026101812", 7),
+                (partition_name(horizon(now) - timedelta(hours=2)), 0),
+                ("p_future", 0),
+            ],
+        ), patch("core.partitions._connection") as conn:
+            cursor = conn.return_value.cursor.return_value.__enter__.return_value
+            self.assertEqual(rotate(Message, now), 47)
+
+        drop, reorganize = [call.args[0] for call in cursor.execute.call_args_list]
+        self.assertEqual(drop, "ALTER TABLE core_message DROP PARTITION p2026101811, p2026101812")
+        self.assertIn("REORGANIZE PARTITION p_future INTO (", reorganize)
+        self.assertEqual(reorganize.count("VALUES LESS THAN (TO_SECONDS"), 2)
+        self.assertIn(partition_name(horizon(now)), reorganize)
+
+    def test_room_detail_hides_expired_without_deleting(self):
+        self.client.force_login(self.user)
+        response = self.client.get(reverse("room_detail", args=[self.room.id]))
+        self.assertEqual(list(response.context["messages"]), [self.live])
+        self.assertEqual(Message.objects.count(), 6)
+
+    def test_home_hides_expired_posts(self):
+        cache.clear()
+        Post.objects.create(
+            user=self.user, text="old", expires_at=timezone.now() - timedelta(seconds=1)
+        )
+        fresh = Post.objects.create(user=self.user, text="fresh")
+        response = self.client.get(reverse("home"))
+        self.assertEqual([post["id"] for post in response.context["posts"]], [fresh.id])
+
+
+def full_scans(sql):
+    """SELECT 文の実行計画からフルスキャンしているテーブル名を返す。"""
+    with connection.cursor() as cursor:
+        if connection.vendor == "sqlite":
+            cursor.execute("EXPLAIN QUERY PLAN " + sql)
+            details = [row[3] for row in cursor.fetchall()]
+            return {
+                detail.split()[1]
+                for detail in details
+                if detail.startswith("SCAN ") and "CONSTANT ROW" not in detail
+            }
+        if connection.vendor == "mysql":
+            cursor.execute("EXPLAIN " + sql)
+            columns = [col[0] for col in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            return {row["table"] for row in rows if row["type"] in ("ALL", "index")}
+    return set()
+
+
+class QueryPlanTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create_user("host", password="pass")
+        cls.guest = User.objects.create_user("guest", password="pass")
+        cls.room = Room.objects.create(name="room", host=cls.host)
+        RoomMembership.objects.create(
+            user=cls.guest, room=cls.room, status=RoomMembership.Status.APPROVED
+        )
+        Message.objects.create(room=cls.room, user=cls.host, text="hi")
+        DirectMessage.objects.create(sender=cls.host, receiver=cls.guest, text="hi")
+        Post.objects.create(user=cls.host, text="post")
+
+    def assertNoFullScans(self, name, args=(), allowed=()):
+        self.client.force_login(self.host)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse(name, args=args))
+        for query in ctx.captured_queries:
+            if not query["sql"].startswith("SELECT"):
+                continue
+            scans = full_scans(query["sql"]) - set(allowed)
+            self.assertFalse(scans, f"{name}: full scan on {scans}\n{query['sql']}")
+
+    def test_home(self):
+        self.assertNoFullScans("home")
+
+    def test_room_list(self):
+        # ルーム一覧は全件を新しい順に並べる画面なので core_room の走査は許可する
+        self.assertNoFullScans("room_list", allowed=["core_room"])
+
+    def test_room_detail(self):
+        self.assertNoFullScans("room_detail", [self.room.id])
+
+    def test_room_messages(self):
+        self.assertNoFullScans("room_messages", [self.room.id])
+
+    def test_request_list(self):
+        self.assertNoFullScans("request_list")
+
+    def test_dm_list(self):
+        self.assertNoFullScans("dm_list")
+
+    def test_dm_chat(self):
+        self.assertNoFullScans("dm_chat", [self.guest.id])
+
+    def test_dm_messages(self):
+        dm = DirectMessage.objects.latest("id")
+        self.client.force_login(self.host)
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(
+                reverse("dm_messages", args=[self.guest.id]), {"before_id": dm.id}
+            )
+        for query in ctx.captured_queries:
+            self.assertFalse(full_scans(query["sql"]), query["sql"])
+
+    def test_user_list(self):
+        # 絞り込みなしの 1 ページ目は (search_name, user) の索引を順に読んで LIMIT で止まる
+        self.assertNoFullScans("user_list", allowed=["core_profile"])
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse("user_list"), {"q": "gu"})
+        for query in ctx.captured_queries:
+            self.assertFalse(full_scans(query["sql"]), query["sql"])
+
+    def test_profile(self):
+        self.assertNoFullScans("profile", [self.guest.id])
+
+    def test_send_request_is_idempotent(self):
+        self.client.force_login(self.guest)
+        self.client.post(reverse("send_request", args=[self.room.id]))
+        self.client.post(reverse("send_request", args=[self.room.id]))
+        self.assertEqual(RoomMembership.objects.filter(user=self.guest).count(), 1)
+
+
+class ConversationTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user("alice", password="pass")
+        cls.bob = User.objects.create_user("bob", password="pass")
+        cls.carol = User.objects.create_user("carol", password="pass")
+
+    def test_direct_message_updates_both_sides(self):
+        DirectMessage.objects.create(sender=self.alice, receiver=self.bob, text="one")
+        DirectMessage.objects.create(sender=self.alice, receiver=self.bob, text="two")
+
+        mine = Conversation.objects.get(owner=self.alice, other=self.bob)
+        theirs = Conversation.objects.get(owner=self.bob, other=self.alice)
+        self.assertEqual(mine.last_message_text, "two")
+        self.assertEqual(mine.unread_count, 0)
+        self.assertEqual(theirs.unread_count, 2)
+
+    def test_dm_list_orders_by_latest_and_chat_marks_read(self):
+        DirectMessage.objects.create(sender=self.alice, receiver=self.bob, text="a")
+        DirectMessage.objects.create(sender=self.carol, receiver=self.bob, text="c")
+        self.client.force_login(self.bob)
+
+        response = self.client.get(reverse("dm_list"))
+        others = [conv.other for conv in response.context["conversations"]]
+        self.assertEqual(others, [self.carol, self.alice])
+
+        self.client.get(reverse("dm_chat", args=[self.carol.id]))
+        conv = Conversation.objects.get(owner=self.bob, other=self.carol)
+        self.assertEqual(conv.unread_count, 0)
+        self.assertIsNotNone(conv.last_read_at)
+
+
+class DirectMessagePagingTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user("alice", password="pass")
+        cls.bob = User.objects.create_user("bob", password="pass")
+        cls.messages = [
+            DirectMessage.objects.create(
+                sender=[cls.alice, cls.bob][i % 2],
+                receiver=[cls.bob, cls.alice][i % 2],
+                text=f"dm {i}",
+            )
+            for i in range(DM_PAGE_SIZE + 3)
+        ]
+        # 自分宛ての DM は alice と bob の会話に混ざらない
+        DirectMessage.objects.create(sender=cls.alice, receiver=cls.alice, text="memo")
+
+    def setUp(self):
+        self.client.force_login(self.alice)
+
+    def test_pair_key_is_canonical(self):
+        low, high = sorted((self.alice.id, self.bob.id))
+        for dm in self.messages[:2]:
+            self.assertEqual((dm.low_user_id, dm.high_user_id), (low, high))
+
+    def test_chat_renders_latest_page(self):
+        response = self.client.get(reverse("dm_chat", args=[self.bob.id]))
+        ids = [msg.id for msg in response.context["messages"]]
+        self.assertEqual(ids, [dm.id for dm in self.messages[-DM_PAGE_SIZE:]])
+        self.assertTrue(response.context["has_older"])
+
+    def test_before_id_pages_backwards(self):
+        response = self.client.get(
+            reverse("dm_messages", args=[self.bob.id]),
+            {"before_id": self.messages[-DM_PAGE_SIZE].id},
+        )
+        data = response.json()
+        self.assertEqual(data["first_id"], self.messages[0].id)
+        self.assertEqual(data["last_id"], self.messages[2].id)
+        self.assertFalse(data["has_more"])
+        self.assertNotIn("memo", data["html"])
+
+    def test_after_id_returns_newer_messages(self):
+        # 再接続したブラウザが取りこぼした分
+        response = self.client.get(
+            reverse("dm_messages", args=[self.bob.id]), {"after_id": self.messages[-3].id}
+        )
+        data = response.json()
+        self.assertEqual(data["first_id"], self.messages[-2].id)
+        self.assertEqual(data["last_id"], self.messages[-1].id)
+        self.assertFalse(data["has_more"])
+
+        # 1 ページを超える取りこぼしは has_more を見て続けて取る
+        response = self.client.get(
+            reverse("dm_messages", args=[self.bob.id]), {"after_id": self.messages[0].id}
+        )
+        data = response.json()
+        self.assertEqual(data["first_id"], self.messages[1].id)
+        self.assertEqual(data["last_id"], self.messages[DM_PAGE_SIZE].id)
+        self.assertTrue(data["has_more"])
+
+
+class HomeTimelineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("user", password="pass")
+        cls.first = Post.objects.create(user=cls.user, text="first")
+
+    def setUp(self):
+        cache.clear()
+
+    def test_second_visit_is_served_from_cache(self):
+        self.client.get(reverse("home"))
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("home"))
+        self.assertFalse([q for q in ctx.captured_queries if "core_post" in q["sql"]])
+        self.assertContains(response, "first")
+
+    def test_new_post_is_prepended(self):
+        self.client.get(reverse("home"))
+        with self.captureOnCommitCallbacks(execute=True):
+            second = Post.objects.create(user=self.user, text="second")
+        ids = [entry["id"] for entry in cache.get(TIMELINE_KEY)]
+        self.assertEqual(ids, [second.id, self.first.id])
+
+    def test_delete_invalidates(self):
+        self.client.get(reverse("home"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.delete()
+        self.assertNotContains(self.client.get(reverse("home")), "first")
+
+    def test_rename_invalidates(self):
+        self.client.get(reverse("home"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.username = "renamed"
+            self.user.save()
+        self.assertContains(self.client.get(reverse("home")), "renamed")
+
+    def test_only_one_request_rebuilds_a_stale_timeline(self):
+        self.client.get(reverse("home"))
+        with self.captureOnCommitCallbacks(execute=True):
+            self.first.text = "edited"
+            self.first.save()
+        # 他のプロセスが作り直している間は、古い断片を返して自分では作らない
+        cache.add(TIMELINE_BUILD_KEY, True)
+        with CaptureQueriesContext(connection) as ctx:
+            response = self.client.get(reverse("home"))
+        self.assertFalse([q for q in ctx.captured_queries if "core_post" in q["sql"]])
+        self.assertContains(response, "first")
+        cache.delete(TIMELINE_BUILD_KEY)
+        self.assertContains(self.client.get(reverse("home")), "edited")
+
+
+class RoomMembershipTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create_user("host", password="pass")
+        cls.guest = User.objects.create_user("guest", password="pass")
+        cls.room = Room.objects.create(name="room", host=cls.host)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_room_creates_host_membership(self):
+        self.assertEqual(
+            room_statuses(self.host), {self.room.id: RoomMembership.Status.HOST}
+        )
+
+    def test_permission_checks_come_from_cache(self):
+        self.client.force_login(self.host)
+        self.client.get(reverse("room_list"))
+        with CaptureQueriesContext(connection) as ctx:
+            self.client.get(reverse("room_detail", args=[self.room.id]))
+        self.assertFalse(
+            [q for q in ctx.captured_queries if "core_roommembership" in q["sql"]]
+        )
+
+    def test_request_and_approve_invalidate(self):
+        self.client.force_login(self.guest)
+        self.assertFalse(can_enter_room(self.guest, self.room.id))
+        self.assertEqual(pending_request_count(self.host), 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("send_request", args=[self.room.id]))
+        self.assertEqual(room_statuses(self.guest)[self.room.id], "pending")
+        self.assertEqual(pending_request_count(self.host), 1)
+
+        membership = RoomMembership.objects.get(user=self.guest)
+        self.client.force_login(self.host)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(reverse("approve_request", args=[membership.id]))
+        self.assertTrue(can_enter_room(self.guest, self.room.id))
+        self.assertEqual(pending_request_count(self.host), 0)
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.host = User.objects.create_user("host", password="pass")
+        cls.guest = User.objects.create_user("guest", password="pass")
+
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.room = Room.objects.create(name="ラーメン部", host=self.host)
+            self.post = Post.objects.create(user=self.host, text="東京タワーに行った")
+            self.message = Message.objects.create(
+                room=self.room, user=self.host, text="味噌ラーメンが好き"
+            )
+
+    def search_ids(self, user, query):
+        hits, _ = search_documents(user, query)
+        return [(hit.kind, hit.object.pk) for hit in hits]
+
+    def test_normalize(self):
+        self.assertEqual(normalize("ﾗｰﾒﾝ"), normalize("らーめん"))
+        self.assertEqual(normalize("ＡＢＣ"), "abc")
+
+    def test_finds_japanese_substrings(self):
+        self.assertEqual(self.search_ids(self.guest, "タワー"), [("post", self.post.id)])
+        self.assertEqual(self.search_ids(self.guest, "とうきょう"), [])
+        self.assertEqual(self.search_ids(self.guest, "京"), [("post", self.post.id)])
+
+    def test_room_messages_only_for_members(self):
+        self.assertEqual(self.search_ids(self.guest, "らーめん"), [("room", self.room.id)])
+        self.assertCountEqual(
+            self.search_ids(self.host, "らーめん"),
+            [("room", self.room.id), ("message", self.message.id)],
+        )
+
+    @patch("core.search.SEARCH_CANDIDATES", 3)
+    def test_hidden_matches_do_not_fill_candidates(self):
+        # 参加していないルームの新しいメッセージが候補の上限を超えても、公開の投稿は見つかる
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                Message.objects.create(room=self.room, user=self.host, text=f"東京 {i}")
+        self.assertEqual(self.search_ids(self.guest, "東京"), [("post", self.post.id)])
+
+    def test_expired_and_deleted_are_hidden(self):
+        Message.objects.filter(id=self.message.id).update(expires_at=timezone.now())
+        SearchDocument.objects.filter(object_id=self.message.id).update(
+            expires_at=timezone.now()
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.delete()
+        self.assertEqual(self.search_ids(self.host, "味噌"), [])
+        self.assertEqual(self.search_ids(self.host, "タワー"), [])
+
+    def test_term_index_backend(self):
+        backend = TermIndexBackend()
+        backend.index(SearchDocument.objects.all())
+        now = timezone.now()
+        ids = backend.search(["たわー"], [], now, 0, 10)
+        self.assertEqual(ids, [SearchDocument.objects.get(kind="post").id])
+        self.assertEqual(len(backend.search(["らーめん"], [self.room.id], now, 0, 10)), 2)
+
+    def test_search_view(self):
+        self.client.force_login(self.host)
+        response = self.client.get(reverse("search"), {"q": "ラーメン"})
+        self.assertContains(response, "味噌ラーメンが好き")
+
+
+class UserDirectoryTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.me = User.objects.create_user("me", password="pass")
+        for name in ["タロウ", "たろう2", "タロウ3", "Taro", "TARO_B", "hanako"]:
+            User.objects.create_user(name, password="pass")
+
+    def setUp(self):
+        self.client.force_login(self.me)
+
+    def names(self, response):
+        return [p.user.username for p in response.context["profiles"]]
+
+    def test_prefix_ignores_kana_width_and_case(self):
+        response = self.client.get(reverse("user_list"), {"q": "ﾀﾛ"})
+        self.assertEqual(self.names(response), ["タロウ", "たろう2", "タロウ3"])
+        response = self.client.get(reverse("user_list"), {"q": "ｔａｒｏ"})
+        self.assertEqual(self.names(response), ["Taro", "TARO_B"])
+
+    @patch("core.views.USER_PAGE_SIZE", 4)
+    def test_cursor_pages_through_everyone(self):
+        pages = []
+        after = None
+        while True:
+            params = {"format": "json", **({"after": after} if after else {})}
+            data = self.client.get(reverse("user_list"), params).json()
+            pages.append(data["html"].count("<li"))
+            after = data["next"]
+            if not after:
+                break
+        self.assertEqual(pages, [4, 2])
+
+    def test_kana_prefix_does_not_match_voiced_kana(self):
+        # 「か」の範囲は [か, が)。濁点を区別する照合順序なら「がくせい」は入らない
+        User.objects.create_user("かなこ", password="pass")
+        User.objects.create_user("がくせい", password="pass")
+        response = self.client.get(reverse("user_list"), {"q": "カ"})
+        self.assertContains(response, "かなこ")
+        self.assertNotContains(response, "がくせい")
+
+    def test_prefix_range_skips_surrogates_and_carries(self):
+        self.assertEqual(prefix_range("a\ud7ff"), "a\ue000")
+        self.assertEqual(prefix_range("a\U0010ffff"), "b")
+        self.assertIsNone(prefix_range("\U0010ffff"))
+        for query in ("\ud7ff", "\U0010ffff"):
+            response = self.client.get(reverse("user_list"), {"q": query})
+            self.assertEqual(response.status_code, 200)
+
+    def test_rename_updates_search_name(self):
+        user = User.objects.get(username="hanako")
+        user.username = "Hanamaru"
+        user.save()
+        self.assertEqual(Profile.objects.get(user=user).search_name, "hanamaru")
+
+
+class DatabaseRoutingTests(TransactionTestCase):
+    databases = {"default", "replica"}
+
+    def tearDown(self):
+        db_router._down_until.clear()
+
+    def test_reads_go_to_replica(self):
+        self.assertEqual(Room.objects.all().db, "replica")
+        self.assertEqual(Session.objects.all().db, "default")
+
+    def test_write_pins_rest_of_request(self):
+        user = User.objects.create_user("host", password="pass")
+        token = db_router.start_request()
+        try:
+            self.assertEqual(Room.objects.all().db, "replica")
+            Room.objects.create(name="room", host=user)
+            self.assertEqual(Room.objects.all().db, "default")
+        finally:
+            state = db_router.finish_request(token)
+        self.assertTrue(state.wrote)
+
+    def test_transactions_read_primary(self):
+        with transaction.atomic():
+            self.assertEqual(Room.objects.all().db, "default")
+
+    def test_cookie_pins_following_requests(self):
+        user = User.objects.create_user("host", password="pass")
+        self.client.force_login(user)
+        response = self.client.post(reverse("create_room"), {"name": "room"})
+        self.assertIn("primary_pin", response.cookies)
+        response = self.client.get(reverse("room_list"))
+        self.assertNotIn("primary_pin", response.cookies)
+        self.assertContains(response, "room")
+
+    def test_caches_are_rebuilt_from_primary(self):
+        user = User.objects.create_user("host", password="pass")
+        Room.objects.create(name="room", host=user)
+        Post.objects.create(user=user, text="hello")
+        cache.clear()
+
+        # 読み取りはレプリカへ行くが、キャッシュの作り直しは primary から読む
+        with CaptureQueriesContext(connections["replica"]) as replica:
+            self.assertEqual(Room.objects.count(), 1)
+            self.assertEqual(len(replica), 1)
+            self.assertEqual(len(room_statuses(user)), 1)
+            self.assertEqual(len(build_home_timeline()), 1)
+            self.assertEqual(CachedModelBackend().get_user(user.pk), user)
+        self.assertEqual(len(replica), 1)
+
+    def test_reading_dms_pins_only_when_something_was_unread(self):
+        alice = User.objects.create_user("alice", password="pass")
+        bob = User.objects.create_user("bob", password="pass")
+        DirectMessage.objects.create(sender=bob, receiver=alice, text="hi")
+        self.client.force_login(alice)
+        url = reverse("dm_chat", args=[bob.id])
+
+        self.assertIn("primary_pin", self.client.get(url).cookies)
+        self.client.cookies.pop("primary_pin")
+        self.assertNotIn("primary_pin", self.client.get(url).cookies)
+
+    def test_unavailable_replica_falls_back_to_primary(self):
+        with patch.object(
+            connections["replica"], "ensure_connection", side_effect=OperationalError
+        ) as ensure, self.assertLogs("core.db_router", "WARNING"):
+            self.assertEqual(Room.objects.all().db, "default")
+            self.assertEqual(Room.objects.all().db, "default")
+        # 一度失敗したレプリカはしばらく試さない
+        self.assertEqual(ensure.call_count, 1)
+
+
+class AsyncViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user("alice", password="pass")
+        cls.bob = User.objects.create_user("bob", password="pass")
+        cls.room = Room.objects.create(name="room", host=cls.alice)
+        Post.objects.create(user=cls.bob, text="hello")
+        DirectMessage.objects.create(sender=cls.bob, receiver=cls.alice, text="hi")
+
+    def setUp(self):
+        cache.clear()
+
+    async def test_chat_views_render_and_write_without_threads(self):
+        with self.settings(ROOT_URLCONF=chat_urlconf(async_views)):
+            await self.async_client.aforce_login(self.alice)
+
+            response = await self.async_client.get(reverse("home"))
+            self.assertContains(response, "hello")
+            response = await self.async_client.get(reverse("dm_list"))
+            self.assertEqual(response.context["conversations"][0].other, self.bob)
+
+            response = await self.async_client.get(reverse("dm_chat", args=[self.bob.id]))
+            self.assertEqual([m.text for m in response.context["messages"]], ["hi"])
+            conv = await Conversation.objects.aget(owner=self.alice, other=self.bob)
+            self.assertEqual(conv.unread_count, 0)
+
+            url = reverse("room_detail", args=[self.room.id])
+            response = await self.async_client.post(url, {"text": "async"})
+            self.assertRedirects(response, url, fetch_redirect_response=False)
+            response = await self.async_client.get(url)
+            self.assertEqual([m.text for m in response.context["messages"]], ["async"])
+
+    async def test_room_detail_redirects_non_members(self):
+        with self.settings(ROOT_URLCONF=chat_urlconf(async_views)):
+            await self.async_client.aforce_login(self.bob)
+            response = await self.async_client.get(reverse("room_detail", args=[self.room.id]))
+            self.assertRedirects(response, reverse("room_list"), fetch_redirect_response=False)
+
+    async def test_unchanged_chat_returns_304(self):
+        with self.settings(ROOT_URLCONF=chat_urlconf(async_views)):
+            await self.async_client.aforce_login(self.alice)
+            url = reverse("dm_chat", args=[self.bob.id])
+            await self.async_client.get(url)
+            etag = (await self.async_client.get(url))["ETag"]
+            response = await self.async_client.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(response.status_code, 304)
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user("alice", password="pass")
+        cls.bob = User.objects.create_user("bob", password="pass")
+        cls.room = Room.objects.create(name="room", host=cls.alice)
+        Message.objects.create(room=cls.room, user=cls.alice, text="hello")
+        DirectMessage.objects.create(sender=cls.bob, receiver=cls.alice, text="hi")
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.alice)
+
+    def assertNotModifiedUntil(self, url, change):
+        # 1 回目で CSRF クッキーが発行され、ETag はそれを含む
+        self.client.get(url)
+        response = self.client.get(url)
+        etag = response["ETag"]
+        self.assertIn("no-cache", response["Cache-Control"])
+
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.templates, [])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            change()
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_home(self):
+        self.assertNotModifiedUntil(
+            reverse("home"), lambda: Post.objects.create(user=self.bob, text="new")
+        )
+
+    def test_room_detail(self):
+        self.assertNotModifiedUntil(
+            reverse("room_detail", args=[self.room.id]),
+            lambda: Message.objects.create(room=self.room, user=self.bob, text="new"),
+        )
+
+    def test_dm_list(self):
+        self.assertNotModifiedUntil(
+            reverse("dm_list"),
+            lambda: DirectMessage.objects.create(sender=self.bob, receiver=self.alice, text="new"),
+        )
+
+    def test_dm_chat(self):
+        self.assertNotModifiedUntil(
+            reverse("dm_chat", args=[self.bob.id]),
+            lambda: DirectMessage.objects.create(sender=self.alice, receiver=self.bob, text="new"),
+        )
+
+    def test_home_relative_times_refresh_every_minute(self):
+        start = timezone.now()
+        with patch("django.utils.timezone.now", return_value=start) as now:
+
+            def a_minute_passes():
+                now.return_value = start + timedelta(seconds=61)
+
+            self.assertNotModifiedUntil(reverse("home"), a_minute_passes)
+
+    def test_avatar_change_invalidates_chat_pages(self):
+        self.assertNotModifiedUntil(
+            reverse("room_detail", args=[self.room.id]), self.alice.profile.bump_display_version
+        )
+        self.assertNotModifiedUntil(reverse("dm_list"), self.bob.profile.bump_display_version)
+        self.assertNotModifiedUntil(
+            reverse("dm_chat", args=[self.bob.id]), self.bob.profile.bump_display_version
+        )
+
+    def test_dm_chat_header_follows_the_other_user(self):
+        # 自分しか送っていない会話でも、相手の名前・アイコンは見出しに出る
+        carol = User.objects.create_user("carol", password="pass")
+        DirectMessage.objects.create(sender=self.alice, receiver=carol, text="hi")
+        self.assertNotModifiedUntil(
+            reverse("dm_chat", args=[carol.id]), carol.profile.bump_display_version
+        )
+
+    def test_dm_list_changes_when_read_or_expired(self):
+        self.assertNotModifiedUntil(
+            reverse("dm_list"),
+            lambda: self.client.get(reverse("dm_chat", args=[self.bob.id])),
+        )
+        etag = self.client.get(reverse("dm_list"))["ETag"]
+        later = timezone.now() + settings.CONTENT_TTL + timedelta(minutes=1)
+        with patch("django.utils.timezone.now", return_value=later):
+            response = self.client.get(reverse("dm_list"), headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+
+    def test_etag_is_per_user(self):
+        url = reverse("room_detail", args=[self.room.id])
+        etag = self.client.get(url)["ETag"]
+
+        # 入れないユーザーは 304 ではなく一覧へ戻される
+        self.client.force_login(self.bob)
+        response = self.client.get(url, headers={"If-None-Match": etag})
+        self.assertRedirects(response, reverse("room_list"), fetch_redirect_response=False)
+
+
+class WriteBehindTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user("alice", password="pass")
+        cls.bob = User.objects.create_user("bob", password="pass")
+        cls.room = Room.objects.create(name="room", host=cls.alice)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_flush_inserts_in_order_and_runs_receivers(self):
+        writer = WriteBehindQueue(batch_size=10)
+        for i in range(3):
+            writer.submit(Message(room=self.room, user=self.alice, text=f"queued {i}"))
+        writer.submit(DirectMessage(sender=self.alice, receiver=self.bob, text="dm"))
+        self.assertFalse(Message.objects.exists())
+
+        with self.captureOnCommitCallbacks(execute=True):
+            writer.flush()
+
+        texts = list(Message.objects.order_by("id").values_list("text", flat=True))
+        self.assertEqual(texts, ["queued 0", "queued 1", "queued 2"])
+        dm = DirectMessage.objects.get()
+        self.assertEqual(
+            (dm.low_user_id, dm.high_user_id), tuple(sorted((self.alice.id, self.bob.id)))
+        )
+        # post_save の receiver（会話の更新・検索索引）も走っている
+        self.assertEqual(Conversation.objects.get(owner=self.bob).unread_count, 1)
+        self.assertEqual(
+            SearchDocument.objects.filter(kind=SearchDocument.Kind.MESSAGE).count(), 3
+        )
+        self.assertEqual(len(writer), 0)
+
+    def _flush_without_returning(self, step):
+        # MySQL のように bulk_create が ID を返さない DB を SQLite で真似る
+        def first_insert_id(conn):
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT last_insert_rowid()")
+                return cursor.fetchone()[0] - 2
+
+        writer = WriteBehindQueue(batch_size=10)
+        queued = [Message(room=self.room, user=self.alice, text=f"queued {i}") for i in range(3)]
+        for message in queued:
+            writer.submit(message)
+        features = type(connection.features)
+        with patch.object(features, "can_return_rows_from_bulk_insert", False), \
+                patch("core.writebehind._autoinc_step", return_value=step), \
+                patch("core.writebehind._first_insert_id", side_effect=first_insert_id), \
+                CaptureQueriesContext(connection) as queries, \
+                self.captureOnCommitCallbacks(execute=True):
+            writer.flush()
+        self.assertEqual(
+            [message.pk for message in queued],
+            list(Message.objects.order_by("id").values_list("id", flat=True)),
+        )
+        self.assertEqual(
+            SearchDocument.objects.filter(kind=SearchDocument.Kind.MESSAGE).count(), 3
+        )
+        return [q["sql"] for q in queries if q["sql"].startswith("INSERT INTO \"core_message\"")]
+
+    def test_contiguous_ids_are_read_back_after_one_insert(self):
+        self.assertEqual(len(self._flush_without_returning(step=1)), 1)
+
+    def test_interleaved_ids_fall_back_to_row_inserts(self):
+        self.assertEqual(len(self._flush_without_returning(step=None)), 3)
+
+    @override_settings(WRITE_BEHIND=True)
+    def test_sends_are_queued_and_full_queue_returns_503(self):
+        writer = WriteBehindQueue(max_size=1)
+        self.client.force_login(self.alice)
+        url = reverse("room_detail", args=[self.room.id])
+
+        with patch("core.views.get_writer", return_value=writer):
+            response = self.client.post(
+                url, {"text": "hi"}, headers={"X-Requested-With": "XMLHttpRequest"}
+            )
+            self.assertEqual(response.status_code, 202)
+            self.assertEqual(len(writer), 1)
+
+            response = self.client.post(reverse("dm_chat", args=[self.bob.id]), {"text": "dm"})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response["Retry-After"], "1")
+        self.assertFalse(Message.objects.exists())
+
+
+@override_settings(
+    RATE_LIMITS={"user": (2, 60), "room": (3, 60), "global": (100, 60)},
+    LOAD_SHEDDING_LATENCY_MS=500,
+)
+class RateLimitTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.alice = User.objects.create_user("alice", password="pass")
+        cls.bob = User.objects.create_user("bob", password="pass")
+        cls.room = Room.objects.create(name="room", host=cls.alice)
+        RoomMembership.objects.create(
+            user=cls.bob, room=cls.room, status=RoomMembership.Status.APPROVED
+        )
+
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.url = reverse("room_detail", args=[self.room.id])
+
+    def test_user_and_room_budgets_return_429(self):
+        self.client.force_login(self.alice)
+        for i in range(2):
+            self.assertEqual(self.client.post(self.url, {"text": f"a{i}"}).status_code, 302)
+        response = self.client.post(self.url, {"text": "a2"})
+        self.assertEqual(response.status_code, 429)
+        # 今の区切りが終わり、その分が半分減るまで（最長 1.5 区切り）
+        self.assertLessEqual(int(response["Retry-After"]), 90)
+
+        # ルームの残り 1 回は別のユーザーが使える
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.post(self.url, {"text": "b0"}).status_code, 302)
+        response = self.client.post(
+            self.url, {"text": "b1"}, headers={"X-Requested-With": "XMLHttpRequest"}
+        )
+        self.assertEqual(response.status_code, 429)
+        self.assertIn("retry_after", response.json())
+        self.assertEqual(Message.objects.count(), 3)
+
+    def test_non_members_do_not_spend_the_room_budget(self):
+        carol = User.objects.create_user("carol", password="pass")
+        self.client.force_login(carol)
+        for i in range(5):
+            response = self.client.post(self.url, {"text": f"c{i}"})
+            self.assertRedirects(response, reverse("room_list"), fetch_redirect_response=False)
+            self.client.post(reverse("send_request", args=[self.room.id]))
+
+        self.client.force_login(self.alice)
+        for i in range(2):
+            self.assertEqual(self.client.post(self.url, {"text": f"a{i}"}).status_code, 302)
+        self.client.force_login(self.bob)
+        self.assertEqual(self.client.post(self.url, {"text": "b0"}).status_code, 302)
+        self.assertEqual(Message.objects.count(), 3)
+
+    def test_budget_refills_gradually_across_boundaries(self):
+        # 固定の区切りで数えると、区切りの直前と直後で 2 倍使えてしまう
+        with patch("core.ratelimit.time.time", return_value=59.9) as now:
+            self.assertIsNone(take(1, ["user"], {}))
+            self.assertIsNone(take(1, ["user"], {}))
+            now.return_value = 60.1
+            self.assertEqual(take(1, ["user"], {}), 30)
+            # 2 回 / 60 秒なので、前の区切りの分は 30 秒で 1 回分戻る
+            now.return_value = 89.9
+            self.assertIsNotNone(take(1, ["user"], {}))
+            now.return_value = 90.1
+            self.assertIsNone(take(1, ["user"], {}))
+            self.assertIsNotNone(take(1, ["user"], {}))
+
+    def test_concurrent_takes_cannot_overspend(self):
+        with patch("core.ratelimit.time.time", return_value=30.0):
+            self.assertIsNone(take(1, ["user"], {}))
+            self.assertIsNone(take(1, ["user"], {}))
+            # 使われる前の値を読んだリクエストも、増やした後の値で断られ、増やした分を戻す
+            with patch.object(cache, "get_many", return_value={}):
+                self.assertIsNotNone(take(1, ["user"], {}))
+            self.assertEqual(cache.get("ratelimit:user:1:0"), 2)
+
+    def test_rejected_scope_does_not_spend_other_tokens(self):
+        other = {"room_id": self.room.id + 1}
+        for user_id in (10, 11, 12):
+            self.assertIsNone(take(user_id, ["user", "room"], {"room_id": self.room.id}))
+        # ルームが空なので断られるが、ユーザーのトークンは減らない
+        self.assertIsNotNone(take(1, ["user", "room"], {"room_id": self.room.id}))
+        self.assertIsNone(take(1, ["user", "room"], other))
+        self.assertIsNone(take(1, ["user", "room"], other))
+
+    def test_load_shedding_rejects_only_non_essential_writes(self):
+        metrics.recent_latency_ms.value = 800
+        self.client.force_login(self.alice)
+
+        response = self.client.post(reverse("create_post"), {"text": "hello"})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("Retry-After", response)
+        self.assertFalse(Post.objects.exists())
+        self.assertEqual(self.client.post(self.url, {"text": "chat"}).status_code, 302)
+
+    def test_join_requests_are_limited(self):
+        rooms = [Room.objects.create(name=f"r{i}", host=self.alice) for i in range(3)]
+        self.client.force_login(self.bob)
+        self.assertEqual(
+            self.client.get(reverse("send_request", args=[rooms[0].id])).status_code, 405
+        )
+        for room in rooms[:2]:
+            response = self.client.post(reverse("send_request", args=[room.id]))
+            self.assertEqual(response.status_code, 302)
+        response = self.client.post(reverse("send_request", args=[rooms[2].id]))
+        self.assertEqual(response.status_code, 429)
+
+        metrics.recent_latency_ms.value = 800
+        self.client.force_login(self.alice)
+        response = self.client.post(reverse("send_request", args=[self.room.id]))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(RoomMembership.objects.filter(status="pending").count(), 2)
+
+    async def test_async_views_share_the_budget(self):
+        with self.settings(ROOT_URLCONF=chat_urlconf(async_views)):
+            await self.async_client.aforce_login(self.alice)
+            statuses = [
+                (await self.async_client.post(self.url, {"text": f"a{i}"})).status_code
+                for i in range(3)
+            ]
+        self.assertEqual(statuses, [302, 302, 429])
+
+
+def make_image(size=(800, 600), fmt="JPEG", exif=None, color="red"):
+    buffer = BytesIO()
+    Image.new("RGB", size, color).save(buffer, fmt, **({"exif": exif} if exif else {}))
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageDerivativeTests(TestCase):
+    def test_post_derivatives_are_resized_and_stripped(self):
+        exif = Image.Exif()
+        exif[0x010F] = "camera"
+        user = User.objects.create_user("user", password="pass")
+        post = Post.objects.create(
+            user=user,
+            text="photo",
+            image=SimpleUploadedFile("photo.jpg", make_image(exif=exif.tobytes())),
+        )
+
+        variants = generate_derivatives(post)
+        post.refresh_from_db()
+        self.assertEqual(post.image_variants, variants)
+        self.assertEqual(variants["source"], post.image.name)
+
+        with post.image.storage.open(variants["thumb"]) as f:
+            thumb = Image.open(f)
+            self.assertEqual(thumb.size, (240, 240))
+            self.assertFalse(thumb.getexif())
+        with post.image.storage.open(variants["full"]) as f:
+            self.assertEqual(Image.open(f).size, (800, 600))
+        self.assertIn("240w", post.image_srcset)
+
+    def test_profile_avatar_falls_back_to_original(self):
+        user = User.objects.create_user("user", password="pass")
+        self.assertIsNone(user.profile.avatar_url)
+
+        user.profile.profile_image = SimpleUploadedFile("me.png", make_image(fmt="PNG"))
+        user.profile.save()
+        self.assertEqual(user.profile.avatar_url, user.profile.profile_image.url)
+        self.assertEqual(user.profile.display_version, 1)
+
+        generate_derivatives(user.profile)
+        user.profile.refresh_from_db()
+        self.assertEqual(
+            user.profile.avatar_url,
+            user.profile.profile_image.storage.url(user.profile.image_variants["avatar"]),
+        )
+        self.assertEqual(user.profile.display_version, 2)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class MediaBlobTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user("user", password="pass")
+
+    def post(self, data):
+        return Post.objects.create(
+            user=self.user, text="photo", image=SimpleUploadedFile("photo.jpg", data)
+        )
+
+    def test_identical_uploads_share_one_blob(self):
+        data = make_image()
+        first, second = self.post(data), self.post(data)
+
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(first.image.name.startswith("blobs/"))
+        blob = MediaBlob.objects.get(name=first.image.name)
+        self.assertEqual((blob.refcount, blob.size), (2, len(data)))
+
+        first.delete()
+        blob.refresh_from_db()
+        self.assertEqual(blob.refcount, 1)
+
+    def test_replaced_image_is_collected_after_grace(self):
+        profile = self.user.profile
+        profile.profile_image = SimpleUploadedFile("a.png", make_image(fmt="PNG"))
+        profile.save()
+        old = profile.profile_image.name
+        generate_derivatives(profile)
+        derived = set(profile.image_variants.values()) - {old}
+        self.assertEqual(MediaBlob.objects.filter(name__in=derived, refcount=1).count(), 2)
+
+        profile.profile_image = SimpleUploadedFile("b.png", make_image(fmt="PNG", color="blue"))
+        profile.save()
+        self.assertEqual(MediaBlob.objects.get(name=old).refcount, 0)
+        # 古い派生画像は作り直されるまで参照されたまま
+        self.assertEqual(MediaBlob.objects.filter(name__in=derived, refcount=1).count(), 2)
+        generate_derivatives(profile)
+
+        storage = profile.profile_image.storage
+        self.assertEqual(collect_garbage(), 0)
+        self.assertTrue(storage.exists(old))
+
+        later = timezone.now() + settings.MEDIA_GC_GRACE * 2
+        self.assertEqual(collect_garbage(later), 3)
+        self.assertFalse(MediaBlob.objects.filter(name__in={old, *derived}).exists())
+        self.assertFalse(storage.exists(old))
+        self.assertTrue(storage.exists(profile.profile_image.name))
+
+    def test_files_are_deleted_while_the_row_is_locked(self):
+        post = self.post(make_image(color="blue"))
+        name = post.image.name
+        post.delete()
+
+        storage = media_storage()
+        rows_at_delete = []
+
+        def delete(path):
+            # 同じ内容の保存はこの行で待つので、ファイルを消す時点で行が残っていること
+            rows_at_delete.append(MediaBlob.objects.filter(name=path).exists())
+            type(storage).delete(storage, path)
+
+        later = timezone.now() + settings.MEDIA_GC_GRACE * 2
+        with patch.object(storage, "delete", side_effect=delete):
+            self.assertEqual(collect_garbage(later), 1)
+        self.assertEqual(rows_at_delete, [True])
+        self.assertFalse(storage.exists(name))
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class UploadHandlerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("user", password="pass")
+        self.client.force_login(self.user)
+
+    def post(self, data, name="photo.jpg", progress_id=None):
+        url = reverse("create_post")
+        if progress_id:
+            url += f"?X-Progress-ID={progress_id}"
+        return self.client.post(
+            url, {"text": "photo", "image": SimpleUploadedFile(name, data)}
+        )
+
+    def test_sniff_image(self):
+        self.assertEqual(sniff_image(make_image()[:12]), "jpeg")
+        self.assertEqual(sniff_image(make_image(fmt="PNG")[:12]), "png")
+        self.assertEqual(sniff_image(make_image(fmt="WEBP")[:12]), "webp")
+        self.assertIsNone(sniff_image(b"<html><body>"))
+
+    def test_image_is_streamed_to_temporary_file(self):
+        response = self.post(make_image(), progress_id="abc")
+        self.assertRedirects(response, reverse("home"))
+        self.assertEqual(Post.objects.get().image.name[:6], "blobs/")
+
+        progress = self.client.get(reverse("upload_progress"), {"id": "abc"}).json()
+        self.assertTrue(progress["done"])
+        self.assertEqual(progress["received"], len(make_image()))
+
+    def test_non_image_is_rejected(self):
+        response = self.post(b"MZ\x90\x00" + b"\x00" * 5000, name="photo.jpg")
+        self.assertContains(response, "画像ファイル")
+        self.assertFalse(Post.objects.exists())
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=1024)
+    def test_large_image_is_cut_off(self):
+        response = self.post(make_image(), progress_id="big")
+        self.assertContains(response, "MB までです")
+        self.assertFalse(Post.objects.exists())
+        progress = self.client.get(reverse("upload_progress"), {"id": "big"}).json()
+        self.assertLessEqual(progress["received"], 1024 + 65536)
+
+    def test_per_user_quota(self):
+        data = make_image()
+        with self.settings(IMAGE_UPLOAD_USER_BYTES_PER_HOUR=len(data) * 2):
+            self.post(data)
+            self.post(data)
+            response = self.post(data)
+        self.assertContains(response, "アップロードが多すぎます")
+        self.assertEqual(Post.objects.count(), 2)
+
+    def test_parallel_uploads_share_the_quota(self):
+        # 2 つのアップロードが同時に進んでも、合計は上限を超えない
+        def start():
+            request = RequestFactory().post(reverse("create_post"))
+            request.user = self.user
+            handler = CappedImageUploadHandler(request)
+            handler.handle_raw_input(None, request.META, 1024, b"boundary")
+            handler.new_file("image", "photo.jpg", "image/jpeg", 1024)
+            return handler
+
+        data = make_image()
+        with self.settings(IMAGE_UPLOAD_USER_BYTES_PER_HOUR=len(data) + 100):
+            first, second = start(), start()
+            first.receive_data_chunk(data, 0)
+            with self.assertRaises(StopUpload) as stopped:
+                second.receive_data_chunk(data, 0)
+        # 接続は切らず、残りを読み捨ててフォームのエラーとして返す
+        self.assertFalse(stopped.exception.connection_reset)
+        self.assertEqual(second.request.upload_error, OVER_QUOTA)
+        # 断った分は枠に戻っている
+        self.assertEqual(cache.get(first.quota_key), len(data))
+        self.assertEqual(first.file_complete(len(data)).size, len(data))
+
+    def test_profile_form_shows_upload_error(self):
+        response = self.client.post(
+            reverse("edit_profile", args=[self.user.id]),
+            {"bio": "hi", "profile_image": SimpleUploadedFile("me.png", b"not an image")},
+        )
+        self.assertContains(response, "画像ファイル")
+        self.user.profile.refresh_from_db()
+        self.assertFalse(self.user.profile.bio)
+
+
+class StaticAssetTests(TestCase):
+    def test_minify_css(self):
+        css = "/* コメント */\n.a ,\n.b {\n    color : red;\n}\n"
+        self.assertEqual(minify_css(css), ".a,.b{color:red}")
+
+    def test_collectstatic_bundles_hashes_and_precompresses(self):
+        with tempfile.TemporaryDirectory() as root, override_settings(STATIC_ROOT=root):
+            call_command("collectstatic", interactive=False, verbosity=0)
+            hashed = staticfiles_storage.stored_name("core/app.css")
+            self.assertRegex(hashed, r"^core/app\.[0-9a-f]{12}\.css$")
+            with staticfiles_storage.open(hashed) as f:
+                css = f.read()
+            self.assertIn(b".post-card{", css)
+            self.assertNotIn(b"/*", css)
+            with staticfiles_storage.open(hashed + ".gz") as f:
+                self.assertEqual(gzip.decompress(f.read()), css)
+
+            # ページはバンドル 1 ファイルだけを読み込む
+            response = self.client.get(reverse("login"))
+            self.assertContains(response, f'href="/static/{hashed}"')
+            self.assertNotContains(response, "core/style.css")
+
+            request = RequestFactory().get("/", HTTP_ACCEPT_ENCODING="gzip")
+            response = static_asset(request, hashed)
+            response.close()
+            self.assertEqual(response["Content-Encoding"], "gzip")
+            self.assertEqual(response["Content-Type"], "text/css")
+            self.assertIn("immutable", response["Cache-Control"])
+            self.assertIn("Accept-Encoding", response["Vary"])
+
+            response = static_asset(RequestFactory().get("/"), "core/app.css")
+            response.close()
+            self.assertFalse(response.has_header("Content-Encoding"))
+            self.assertNotIn("immutable", response["Cache-Control"])
+
+    def test_large_responses_are_gzipped(self):
+        response = self.client.get(reverse("login"), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertEqual(response["Content-Encoding"], "gzip")
+
+        with self.settings(GZIP_MIN_LENGTH=10**6):
+            response = self.client.get(reverse("login"), HTTP_ACCEPT_ENCODING="gzip")
+        self.assertFalse(response.has_header("Content-Encoding"))
+
+
+class QueryBudgetTests(TestCase):
+    """URL ごとのクエリ数の上限（表示件数に比例して増えないこと）。
+
+    セッションとログインユーザーの読み込みで常に 2 クエリかかる。
+    キャッシュは毎回空にするので、参加状況などを作り直す分も含む。
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [User.objects.create_user(f"user{i}", password="pass") for i in range(6)]
+        cls.me = cls.users[0]
+        cls.room = Room.objects.create(name="room", host=cls.me)
+        cls.other_rooms = [
+            Room.objects.create(name=f"room{i}", host=cls.users[i]) for i in range(1, 4)
+        ]
+        for user in cls.users[1:5]:
+            RoomMembership.objects.create(user=user, room=cls.room)
+        RoomMembership.objects.create(
+            user=cls.me, room=cls.other_rooms[0], status=RoomMembership.Status.APPROVED
+        )
+        RoomMembership.objects.create(user=cls.me, room=cls.other_rooms[1])
+        for i in range(30):
+            Message.objects.create(room=cls.room, user=cls.users[i % 5], text=f"msg {i}")
+            DirectMessage.objects.create(
+                sender=cls.users[i % 2], receiver=cls.users[1 - i % 2], text=f"dm {i}"
+            )
+        for user in cls.users[2:6]:
+            DirectMessage.objects.create(sender=user, receiver=cls.me, text="hi")
+        for user in cls.users:
+            Post.objects.create(user=user, text=f"post by {user.username}")
+        cls.pending = RoomMembership.objects.filter(
+            room=cls.room, status=RoomMembership.Status.PENDING
+        ).first()
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.me)
+        # セッションは cached_db、ユーザーは CachedModelBackend が cache から返す
+        CachedModelBackend().get_user(self.me.pk)
+
+    def assertQueryBudget(self, budget, name, args=(), method="get"):
+        with self.assertNumQueries(budget):
+            response = getattr(self.client, method)(reverse(name, args=args))
+        self.assertLess(response.status_code, 400)
+
+    def test_home(self):
+        self.assertQueryBudget(1, "home")
+
+    def test_create_post(self):
+        self.assertQueryBudget(0, "create_post")
+
+    def test_create_room(self):
+        self.assertQueryBudget(0, "create_room")
+
+    def test_room_list(self):
+        self.assertQueryBudget(2, "room_list")
+
+    def test_room_detail(self):
+        # ETag 用の集計 +1（dm_list・dm_chat も同じ）
+        self.assertQueryBudget(4, "room_detail", [self.room.id])
+
+    def test_room_messages(self):
+        self.assertQueryBudget(3, "room_messages", [self.room.id])
+
+    def test_send_request(self):
+        # get_or_create の INSERT はセーブポイントで囲まれる（+2）
+        self.assertQueryBudget(6, "send_request", [self.other_rooms[2].id], method="post")
+
+    def test_request_list(self):
+        self.assertQueryBudget(2, "request_list")
+
+    def test_approve_request(self):
+        self.assertQueryBudget(2, "approve_request", [self.pending.id])
+
+    def test_dm_list(self):
+        self.assertQueryBudget(2, "dm_list")
+
+    def test_dm_chat(self):
+        self.assertQueryBudget(5, "dm_chat", [self.users[1].id])
+
+    def test_dm_messages(self):
+        self.assertQueryBudget(2, "dm_messages", [self.users[1].id])
+
+    def test_user_list(self):
+        self.assertQueryBudget(1, "user_list")
+
+    def test_profile(self):
+        self.assertQueryBudget(1, "profile", [self.users[1].id])
+
+    def test_edit_profile(self):
+        self.assertQueryBudget(1, "edit_profile", [self.me.id])
+
+    def test_login_and_signup(self):
+        self.client.logout()
+        self.assertQueryBudget(0, "login")
+        self.assertQueryBudget(0, "signup")
+
+
+class CachedIdentityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user("user", password="pass")
+        self.client.force_login(self.user)
+
+    def test_user_and_profile_come_from_cache(self):
+        backend = CachedModelBackend()
+        with self.assertNumQueries(1):
+            backend.get_user(self.user.pk)
+        with self.assertNumQueries(0):
+            user = backend.get_user(self.user.pk)
+            self.assertEqual(user.profile.user_id, self.user.pk)
+
+    def test_saving_profile_invalidates_cached_user(self):
+        backend = CachedModelBackend()
+        backend.get_user(self.user.pk)
+
+        profile = self.user.profile
+        profile.bio = "hello"
+        profile.save()
+        self.assertEqual(backend.get_user(self.user.pk).profile.bio, "hello")
+
+        profile.bump_display_version()
+        self.assertEqual(
+            backend.get_user(self.user.pk).profile.display_version, profile.display_version
+        )
+
+        self.user.is_active = False
+        self.user.save()
+        self.assertIsNone(backend.get_user(self.user.pk))
+
+    async def test_aget_user(self):
+        user = await CachedModelBackend().aget_user(self.user.pk)
+        self.assertEqual(user.profile.user_id, self.user.pk)
+        self.assertEqual((await cache.aget(f"auth:user:{self.user.pk}"))[0], user)
+
+    def test_password_hash_is_not_cached(self):
+        self.client.get(reverse("home"))
+        entry = cache.get(f"auth:user:{self.user.pk}")
+        self.assertNotIn(self.user.password.encode(), pickle.dumps(entry))
+        # セッションの照合は cache の値で済み、パスワードを変えれば切れる
+        response = self.client.get(reverse("home"))
+        self.assertEqual(response.context["user"], self.user)
+        self.user.set_password("changed")
+        self.user.save()
+        response = self.client.get(reverse("home"))
+        self.assertFalse(response.context["user"].is_authenticated)
+
+
+class PerformanceMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_server_timing_header(self):
+        response = self.client.get(reverse("home"))
+        self.assertRegex(
+            response["Server-Timing"],
+            r'^db;dur=[\d.]+;desc="\d+ queries", tpl;dur=[\d.]+, total;dur=[\d.]+$',
+        )
+
+    def test_histogram_quantiles(self):
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.observe(value)
+        self.assertAlmostEqual(histogram.quantile(0.5), 50, delta=50 * 0.2)
+        self.assertAlmostEqual(histogram.quantile(0.99), 99, delta=99 * 0.2)
+
+    def test_metrics_endpoint_is_staff_only(self):
+        user = User.objects.create_user("user", password="pass")
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse("metrics")).status_code, 302)
+
+        user.is_staff = True
+        user.save()
+        self.client.get(reverse("home"))
+        response = self.client.get(reverse("metrics"))
+        self.assertContains(
+            response, 'sns_request_duration_seconds{view="home",quantile="0.95"}'
+        )
+        self.assertContains(response, 'sns_db_queries_count{view="home"}')
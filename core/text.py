@@ -0,0 +1,38 @@
+import re
+import sys
+import unicodedata
+
+# カタカナ → ひらがな（「ラーメン」でも「らーめん」でも当たるように）
+_KATAKANA_TO_HIRAGANA = {code: code - 0x60 for code in range(ord("ァ"), ord("ヶ") + 1)}
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text):
+    """全角・半角（NFKC）、大文字・小文字、カタカナ・ひらがなの違いをならす。"""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return text.translate(_KATAKANA_TO_HIRAGANA)
+
+
+def words(normalized):
+    # 記号・空白・絵文字で区切る（日本語は区切りが無いので 1 語のまま）
+    return _WORD_RE.findall(normalized)
+
+
+def prefix_range(prefix):
+    """前方一致を範囲検索（prefix <= x < 上限）に直すための上限を返す。
+
+    列がコードポイント順で比べる照合順序（SQLite の BINARY、MySQL の utf8mb4_bin）
+    であることが前提。「か」と「が」を同じに扱う照合順序では範囲が空になる。
+    上限がない（prefix 以降がすべて当たる）ときは None。
+    """
+    while prefix:
+        code = ord(prefix[-1]) + 1
+        if code == 0xD800:
+            # サロゲートは文字列に現れず、DB に渡すと符号化できないので飛ばす
+            code = 0xE000
+        if code <= sys.maxunicode:
+            return prefix[:-1] + chr(code)
+        # U+10FFFF の次の文字はないので、その文字を落として前の文字で繰り上げる
+        prefix = prefix[:-1]
+    return None
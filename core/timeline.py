@@ -0,0 +1,161 @@
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.safestring import mark_safe
+
+from .models import Post
+
+TIMELINE_KEY = "timeline:home"
+# 保存するたびに変わる値（ホームの ETag に使う）
+TIMELINE_VERSION_KEY = "timeline:home:version"
+TIMELINE_LOCK_KEY = "timeline:home:lock"
+# 作り直しが必要な印（invalidate_home_timeline）。作り直す間は古いものを返す
+TIMELINE_STALE_KEY = "timeline:home:stale"
+# 作り直すプロセスは 1 つだけ（全投稿の描画を伴うので）
+TIMELINE_BUILD_KEY = "timeline:home:build"
+BUILD_LOCK_TIMEOUT = 30
+
+
+# =====================
+# ホームのタイムライン（全ユーザー共通なのでキャッシュを共有する）
+# =====================
+def _entry(post):
+    return {
+        "id": post.id,
+        "html": render_to_string("core/partials/post_card.html", {"post": post}),
+        "created_at": post.created_at,
+        "expires_at": post.expires_at,
+    }
+
+
+def _timeout(entries, now):
+    # 一番古い投稿が期限切れになる時点でキャッシュも切れる
+    if not entries:
+        return int(settings.CONTENT_TTL.total_seconds())
+    oldest = min(entry["expires_at"] for entry in entries)
+    return max(1, int((oldest - now).total_seconds()))
+
+
+def _store(entries, now):
+    version = uuid.uuid4().hex
+    cache.set_many(
+        {TIMELINE_KEY: entries, TIMELINE_VERSION_KEY: version},
+        _timeout(entries, now),
+    )
+    return version
+
+
+def build_home_timeline():
+    return _build()[0]
+
+
+def _build():
+    # 読んでいる間に来た invalidate を取りこぼさないよう、印は読む前に消す
+    cache.delete(TIMELINE_STALE_KEY)
+    now = timezone.now()
+    # 投稿直後に消したキャッシュを遅れたレプリカから作り直さないよう primary から読む
+    posts = (
+        Post.objects.using(DEFAULT_DB_ALIAS)
+        .live(now)
+        .select_related("user")
+        .order_by("-created_at")
+    )
+    entries = [_entry(post) for post in posts]
+    return entries, _store(entries, now)
+
+
+def _cached(values):
+    return TIMELINE_KEY in values and TIMELINE_VERSION_KEY in values
+
+
+def _load(values):
+    """(entries, 版)。古くなっていれば 1 プロセスだけが作り直し、他は古いものを返す。"""
+    if _cached(values):
+        entries, version = values[TIMELINE_KEY], values[TIMELINE_VERSION_KEY]
+        if TIMELINE_STALE_KEY not in values:
+            return entries, version
+        if not cache.add(TIMELINE_BUILD_KEY, True, BUILD_LOCK_TIMEOUT):
+            # 他のプロセスが作り直している
+            return entries, version
+    elif not cache.add(TIMELINE_BUILD_KEY, True, BUILD_LOCK_TIMEOUT):
+        # 古いものもない（期限切れ・初回）ときは、待たずに自分でも作る
+        return _build()
+    try:
+        return _build()
+    finally:
+        cache.delete(TIMELINE_BUILD_KEY)
+
+
+_KEYS = [TIMELINE_KEY, TIMELINE_VERSION_KEY, TIMELINE_STALE_KEY]
+
+
+def _live(entries, now):
+    return [
+        dict(entry, html=mark_safe(entry["html"]))
+        for entry in entries
+        if entry["expires_at"] > now
+    ]
+
+
+def get_home_timeline():
+    now = timezone.now()
+    entries, _ = _load(cache.get_many(_KEYS))
+    return _live(entries, now)
+
+
+async def aget_home_timeline():
+    now = timezone.now()
+    values = await cache.aget_many(_KEYS)
+    if _cached(values) and TIMELINE_STALE_KEY not in values:
+        entries = values[TIMELINE_KEY]
+    else:
+        # 作り直しは全投稿の描画を伴うのでスレッドで行う
+        entries, _ = await sync_to_async(_load)(values)
+    return _live(entries, now)
+
+
+def home_timeline_version():
+    """タイムラインが変わると変わる値。古くなっていれば作り直す。"""
+    return _load(cache.get_many(_KEYS))[1]
+
+
+def invalidate_home_timeline():
+    # 消さずに印を付ける（作り直す間、他のリクエストは古いものを返す）
+    cache.set(TIMELINE_STALE_KEY, True, int(settings.CONTENT_TTL.total_seconds()))
+
+
+def _append(post):
+    # 他のプロセスが同時に書き換えていたら、追記せず作り直してもらう
+    if not cache.add(TIMELINE_LOCK_KEY, True, 5):
+        invalidate_home_timeline()
+        return
+    try:
+        entries = cache.get(TIMELINE_KEY)
+        if entries is None:
+            return
+        now = timezone.now()
+        if post.expires_at > now:
+            entries = [_entry(post)] + entries
+        _store(entries, now)
+    finally:
+        cache.delete(TIMELINE_LOCK_KEY)
+
+
+@receiver(post_save, sender=Post)
+def add_to_home_timeline(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(lambda: _append(instance))
+    else:
+        transaction.on_commit(invalidate_home_timeline)
+
+
+@receiver(post_delete, sender=Post)
+def remove_from_home_timeline(sender, instance, **kwargs):
+    transaction.on_commit(invalidate_home_timeline)
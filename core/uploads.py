@@ -0,0 +1,166 @@
+"""
+画像アップロードの受け取り（settings.FILE_UPLOAD_HANDLERS）。
+
+- アップロードは常に一時ファイルへチャンクごとに書く（メモリに載せるのは 1 チャンクだけ）
+- 1 ファイルの上限（IMAGE_UPLOAD_MAX_BYTES）と、ユーザーごとの 1 時間あたりの
+  上限（IMAGE_UPLOAD_USER_BYTES_PER_HOUR）を超えたら、その場で受信をやめる
+- 先頭のバイトで画像の形式を確かめ、画像でなければ残りを読まずにやめる
+- ?X-Progress-ID=... が付いていれば、受信済みのバイト数を cache に書く（upload_progress）
+
+受信をやめたときは request.upload_error に理由を入れる。残りの本文は保存せずに読み捨てる
+（接続を切るとブラウザには通信エラーとしか出ない）。ファイルより前のフィールド
+（CSRF トークン・本文）は受け取り済みなので、view は upload_error() を見てフォームを返す。
+ユーザーごとの上限は、受け取るチャンクごとに cache.incr で先に確保する（同時のアップロード
+でも合計が上限を超えない）。受け取りをやめたファイルの分は戻す。
+"""
+
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.uploadhandler import StopUpload, TemporaryFileUploadHandler
+
+PROGRESS_PARAM = "X-Progress-ID"
+PROGRESS_TTL = 300
+
+TOO_LARGE = "画像は {mb}MB までです"
+OVER_QUOTA = "画像のアップロードが多すぎます。しばらく待ってから送信してください。"
+NOT_AN_IMAGE = "画像ファイル（JPEG・PNG・GIF・WebP）を選んでください"
+
+# 先頭のバイト → 形式（WebP は RIFF....WEBP）
+SIGNATURES = [
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF87a", "gif"),
+    (b"GIF89a", "gif"),
+]
+HEADER_SIZE = 12
+
+
+def sniff_image(header):
+    """先頭のバイトから画像の形式を返す（画像でなければ None）。"""
+    for signature, kind in SIGNATURES:
+        if header.startswith(signature):
+            return kind
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def upload_error(request):
+    return getattr(request, "upload_error", None)
+
+
+def progress_key(user_id, progress_id):
+    return f"upload-progress:{user_id}:{progress_id[:64]}"
+
+
+def get_progress(user_id, progress_id):
+    """{"received", "size", "done", "error"}（記録がなければ None）。"""
+    return cache.get(progress_key(user_id, progress_id))
+
+
+def _quota_key(user_id):
+    return f"upload-quota:{user_id}:{int(time.time() // 3600)}"
+
+
+def _reserve(key, size):
+    """1 時間の枠から size バイトを確保し、確保後の合計を返す。"""
+    cache.add(key, 0, 3600)
+    try:
+        return cache.incr(key, size)
+    except ValueError:
+        # add と incr のあいだに追い出された
+        cache.add(key, size, 3600)
+        return size
+
+
+class CappedImageUploadHandler(TemporaryFileUploadHandler):
+    def handle_raw_input(self, input_data, META, content_length, boundary, encoding=None):
+        self.content_length = content_length
+        self.progress_id = self.request.GET.get(PROGRESS_PARAM, "")
+
+    def new_file(self, *args, **kwargs):
+        user = getattr(self.request, "user", None)
+        if user is None or not user.is_authenticated:
+            # 未ログインのアップロードは受け取らない（ログイン画面に戻すのは view の仕事）
+            raise StopUpload()
+        self.user_id = user.id
+        self.quota_key = _quota_key(self.user_id)
+        self.reserved = 0
+        # リクエスト全体が上限を大きく超えるなら、1 バイトも保存せずにやめる
+        # （フォームの他のフィールドの分として 64KB は見逃す）
+        if self.content_length > settings.IMAGE_UPLOAD_MAX_BYTES + 65536:
+            self._abort(self._too_large())
+        if cache.get(self.quota_key, 0) >= settings.IMAGE_UPLOAD_USER_BYTES_PER_HOUR:
+            self._abort(OVER_QUOTA)
+
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.header = b""
+        self._report()
+
+    def receive_data_chunk(self, raw_data, start):
+        if len(self.header) < HEADER_SIZE:
+            self.header += raw_data[: HEADER_SIZE - len(self.header)]
+            if len(self.header) >= HEADER_SIZE and sniff_image(self.header) is None:
+                self._abort(NOT_AN_IMAGE)
+
+        self.received += len(raw_data)
+        if self.received > settings.IMAGE_UPLOAD_MAX_BYTES:
+            self._abort(self._too_large())
+        self.reserved += len(raw_data)
+        if _reserve(self.quota_key, len(raw_data)) > settings.IMAGE_UPLOAD_USER_BYTES_PER_HOUR:
+            self._abort(OVER_QUOTA)
+
+        self.file.write(raw_data)
+        self._report()
+
+    def file_complete(self, file_size):
+        # HEADER_SIZE より小さいファイルはここで確かめる（もう読み終えているので捨てるだけ）
+        if sniff_image(self.header) is None:
+            self.request.upload_error = NOT_AN_IMAGE
+            self.file.close()
+            self._release()
+            self._report(error=NOT_AN_IMAGE)
+            return None
+        # 枠は受け取りながら確保済み
+        self._report(done=True)
+        return super().file_complete(file_size)
+
+    def upload_interrupted(self):
+        super().upload_interrupted()
+        self._release()
+        self._report(error="interrupted")
+
+    def _too_large(self):
+        return TOO_LARGE.format(mb=settings.IMAGE_UPLOAD_MAX_BYTES // (1024 * 1024))
+
+    def _release(self):
+        # 受け取らなかったファイルの分を枠に戻す
+        if self.reserved:
+            try:
+                cache.decr(self.quota_key, self.reserved)
+            except ValueError:
+                pass
+            self.reserved = 0
+
+    def _abort(self, message):
+        self.request.upload_error = message
+        self._release()
+        self._report(error=message)
+        if getattr(self, "file", None) is not None:
+            self.file.close()
+        # 残りの本文は保存せずに読み捨て、view がフォームにエラーを出して返す
+        raise StopUpload()
+
+    def _report(self, done=False, error=None):
+        if not self.progress_id:
+            return
+        progress = {
+            "received": getattr(self, "received", 0),
+            "size": self.content_length,
+            "done": done,
+            "error": error,
+        }
+        cache.set(progress_key(self.user_id, self.progress_id), progress, PROGRESS_TTL)
@@ -1,18 +1,27 @@
 from django.urls import path
-from . import views
+from . import async_views, events, views
 from django.contrib.auth.views import LogoutView, LoginView
 from django.conf import settings
 from django.conf.urls.static import static
 
+# ASGI で動かすときはホーム・ルーム・DM を非同期版にする
+chat_views = async_views if settings.ASYNC_VIEWS else views
+
 urlpatterns = [
     path("", LoginView.as_view(template_name="registration/login.html"), name="login"),
-    path("home/", views.home, name="home"),
+    path("home/", chat_views.home, name="home"),
     # 投稿
     path("post/new/", views.create_post, name="create_post"),
     # ルーム
     path("create-room/", views.create_room, name="create_room"),
     path("rooms/", views.room_list, name="room_list"),
-    path("rooms/<int:room_id>/", views.room_detail, name="room_detail"),
+    path("rooms/<int:room_id>/", chat_views.room_detail, name="room_detail"),
+    path(
+        "rooms/<int:room_id>/messages/",
+        views.room_messages,
+        name="room_messages",
+    ),
+    path("rooms/<int:room_id>/events/", events.room_events, name="room_events"),
     path("rooms/request/<int:room_id>/", views.send_request, name="send_request"),
     path("requests/", views.request_list, name="request_list"),
     path(
@@ -21,13 +30,20 @@ urlpatterns = [
         name="approve_request",
     ),
     # DM
-    path("dm/", views.dm_list, name="dm_list"),
-    path("dm/<int:user_id>/", views.dm_chat, name="dm_chat"),
+    path("dm/", chat_views.dm_list, name="dm_list"),
+    path("dm/<int:user_id>/", chat_views.dm_chat, name="dm_chat"),
+    path("dm/<int:user_id>/messages/", views.dm_messages, name="dm_messages"),
+    path("dm/<int:user_id>/events/", events.dm_events, name="dm_events"),
+    # 検索
+    path("search/", views.search, name="search"),
     # ユーザー一覧
     path("users/", views.user_list, name="user_list"),
     # プロフィール
     path("profile/<int:user_id>/", views.profile, name="profile"),
     path("profile/<int:user_id>/edit/", views.edit_profile, name="edit_profile"),
+    path("uploads/progress/", views.upload_progress, name="upload_progress"),
+    # 性能メトリクス
+    path("metrics/", views.metrics_view, name="metrics"),
     # 認証
     path("signup/", views.signup, name="signup"),
     path("logout/", LogoutView.as_view(), name="logout"),
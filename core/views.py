@@ -1,7 +1,34 @@
+from django.conf import settings
 from django.shortcuts import render, redirect, get_object_or_404
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import FileResponse, Http404, HttpResponse, JsonResponse
 from django.contrib.auth.decorators import login_required
+from django.views.decorators.http import require_POST
 from django.contrib.auth.models import User
-from .models import Room, RoomRequest, Post, Message, DirectMessage, Profile
+from .models import (
+    Room,
+    RoomMembership,
+    Post,
+    Message,
+    DirectMessage,
+    Profile,
+    Conversation,
+)
+from .membership import (
+    can_enter_room,
+    hosted_room_ids,
+    pending_request_count,
+    room_statuses,
+)
+from .conditional import conditional_page
+from .metrics import render_prometheus
+from .ratelimit import rate_limit, retry_later
+from .rendering import render_direct_messages, render_room_messages, render_user_rows
+from .search import search_documents
+from .text import normalize, prefix_range
+from .timeline import get_home_timeline, home_timeline_version
+from .uploads import get_progress, upload_error
+from .writebehind import QueueFull, get_writer
 from .forms import (
     RoomForm,
     MessageForm,
@@ -9,22 +36,34 @@ from .forms import (
     JapaneseUserCreationForm,
     ProfileForm,
 )
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+import mimetypes
+import os
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.utils._os import safe_join
+from django.utils.cache import patch_vary_headers
 from django.utils import timezone
-from datetime import datetime, timedelta
-from django.db.models import Max, Q, DateTimeField, Value
-from django.db.models.functions import Greatest, Coalesce
+from django.db.models import Q
 
 
 # =====================
 # ホーム画面
 # =====================
-def home(request):
-    limit = timezone.now() - timedelta(hours=24)
+# ホームの「○分前」は断片の外で毎回描くので、ETag も 1 分ごとに変える
+HOME_ETAG_BUCKET_SECONDS = 60
+
 
-    # 24時間以内の投稿だけ表示
-    posts = Post.objects.filter(
-        created_at__gte=limit
-    ).select_related("user").order_by("-created_at")
+def _home_version(user):
+    # タイムラインのキャッシュを作り直す・追記するたびに変わる
+    bucket = int(timezone.now().timestamp() // HOME_ETAG_BUCKET_SECONDS)
+    return (home_timeline_version(), bucket)
+
+
+@conditional_page(_home_version)
+def home(request):
+    # 24時間以内の投稿（描画済みの断片ごとキャッシュされている）
+    posts = get_home_timeline()
 
     return render(
         request,
@@ -39,6 +78,7 @@ def home(request):
 # 新規投稿
 # =====================
 @login_required
+@rate_limit("user", "global", shed=True)
 def create_post(request):
     if request.method == "POST":
         text = request.POST.get("text", "").strip()
@@ -51,6 +91,11 @@ def create_post(request):
                 {"error": "投稿内容を入力してください"},
             )
 
+        # 大きすぎる・画像でないファイルは受信の途中でやめている（core.uploads）
+        error = upload_error(request)
+        if error:
+            return render(request, "core/create_post.html", {"error": error})
+
         Post.objects.create(user=request.user, text=text, image=image)
         return redirect("home")
 
@@ -80,34 +125,21 @@ def create_room(request):
 # =====================
 @login_required
 def room_list(request):
-    rooms = Room.objects.all().order_by("-created_at")
-
-    # 自分が申請したルームID一覧
-    requested_room_ids = RoomRequest.objects.filter(user=request.user).values_list(
-        "room_id",
-        flat=True,
-    )
-
-    # 自分が承認済みのルームID一覧
-    approved_room_ids = RoomRequest.objects.filter(
-        user=request.user, approved=True
-    ).values_list("room_id", flat=True)
+    rooms = list(Room.objects.all().order_by("-created_at"))
 
-    # 自分が作成者のルーム
-    my_rooms = Room.objects.filter(host=request.user)
+    # 自分の参加状況（作成者・承認待ち・参加中）はキャッシュから付ける
+    statuses = room_statuses(request.user)
+    for room in rooms:
+        room.membership_status = statuses.get(room.id)
 
     # 未承認リクエスト数（作成者用）
-    request_count = RoomRequest.objects.filter(
-        room__in=my_rooms, approved=False
-    ).count()
+    request_count = pending_request_count(request.user)
 
     return render(
         request,
         "core/rooms.html",
         {
             "rooms": rooms,
-            "requested_room_ids": requested_room_ids,
-            "approved_room_ids": approved_room_ids,
             "request_count": request_count,
             "has_requests": request_count > 0,
         },
@@ -118,64 +150,111 @@ def room_list(request):
 # ルーム参加リクエスト
 # =====================
 @login_required
+@require_POST
+@rate_limit("user", "global", shed=True)
 def send_request(request, room_id):
-    room = Room.objects.get(id=room_id)
+    room = get_object_or_404(Room, id=room_id)
 
-    already = RoomRequest.objects.filter(user=request.user, room=room).exists()
-    if not already:
-        RoomRequest.objects.create(user=request.user, room=room)
+    # 申請済み・参加済みなら何もしない
+    # (user, room) の一意制約があるので、同時に送られても 1 件だけ作られる
+    if room.id not in room_statuses(request.user):
+        RoomMembership.objects.get_or_create(user=request.user, room=room)
 
     return redirect("room_list")
 
 
 @login_required
 def request_list(request):
-    my_rooms = Room.objects.filter(host=request.user)
-    requests = RoomRequest.objects.filter(room__in=my_rooms, approved=False)
+    requests = RoomMembership.objects.filter(
+        room_id__in=hosted_room_ids(request.user),
+        status=RoomMembership.Status.PENDING,
+    ).select_related("user", "room")
 
     return render(request, "core/request_list.html", {"requests": requests})
 
 
 @login_required
 def approve_request(request, request_id):
-    req = get_object_or_404(RoomRequest, id=request_id)
+    req = get_object_or_404(
+        RoomMembership.objects.select_related("room"),
+        id=request_id,
+        status=RoomMembership.Status.PENDING,
+    )
 
     # ルーム作成者以外は承認できない
-    if req.room.host != request.user:
+    if req.room.host_id != request.user.id:
         return redirect("room_list")
 
-    req.approved = True
-    req.save()
+    req.status = RoomMembership.Status.APPROVED
+    req.save(update_fields=["status"])
 
     return redirect("request_list")
 
 
+# ルーム画面で一度に表示するメッセージ数
+ROOM_PAGE_SIZE = 50
+
+
+def _parse_cursor(value):
+    try:
+        return int(value) if value not in (None, "") else None
+    except ValueError:
+        return None
+
+
+def _room_messages_response(request, messages, has_more=False, status=200):
+    return JsonResponse(
+        {
+            "html": render_room_messages(messages, request.user),
+            "first_id": messages[0].id if messages else None,
+            "last_id": messages[-1].id if messages else None,
+            "has_more": has_more,
+        },
+        status=status,
+    )
+
+
+def _save_message(instance):
+    """メッセージを保存する。保存済みなら True。
+
+    WRITE_BEHIND のときは書き込みキューに入れるだけで False を返す（保存と配信は
+    flusher が行う）。キューが満杯なら QueueFull。
+    """
+    if settings.WRITE_BEHIND:
+        get_writer().submit(instance)
+        return False
+    instance.save()
+    return True
+
+
+def _room_version(user, room_id):
+    # 入れないユーザー・存在しないルームは view に任せる（リダイレクト・404）
+    if not can_enter_room(user, room_id):
+        return None
+    # 表示する範囲（最新 N 件と、さらに古いものがあるか）だけを room_id の索引で読む
+    # 投稿者がアイコン・名前を変えれば display_version が変わる
+    return tuple(
+        Message.objects.live()
+        .filter(room_id=room_id)
+        .order_by("-id")
+        .values_list("id", "user__profile__display_version")[: ROOM_PAGE_SIZE + 1]
+    )
+
+
 @login_required
+# ルームの枠はメンバーの書き込みだけで使う（入れないユーザーは view がリダイレクトする）
+@rate_limit("user", "room", "global", when=can_enter_room)
+@conditional_page(_room_version)
 def room_detail(request, room_id):
     room = get_object_or_404(Room, id=room_id)
 
     # ======================
     # 入室許可チェック
     # ======================
-    is_host = room.host == request.user
-    is_approved = RoomRequest.objects.filter(
-        user=request.user, room=room, approved=True
-    ).exists()
-
-    if not (is_host or is_approved):
+    is_host = room.host_id == request.user.id
+    if not can_enter_room(request.user, room.id):
         return redirect("room_list")
 
-    # ======================
-    # ★ 24時間超えメッセージ削除 ★
-    # ======================
-    limit = timezone.now() - timedelta(hours=24)
-    Message.objects.filter(room=room, created_at__lt=limit).delete()
-
-    # ======================
-    # メッセージ取得
-    # ======================
-    messages = Message.objects.filter(room=room).order_by("created_at")
-
     # ======================
     # メッセージ送信
     # ======================
@@ -185,79 +264,241 @@ def room_detail(request, room_id):
             msg = form.save(commit=False)
             msg.room = room
             msg.user = request.user
-            msg.save()
+            try:
+                saved = _save_message(msg)
+            except QueueFull:
+                return retry_later(request, 503, 1)
+
+            if request.headers.get("X-Requested-With") == "XMLHttpRequest":
+                # 送信者には after_id 以降（自分の投稿を含む）の断片だけ返す
+                # キューに入れただけのときは 202（自分の投稿はイベントで届く）
+                after_id = _parse_cursor(request.POST.get("after_id"))
+                if after_id is None:
+                    new_messages = [msg] if saved else []
+                else:
+                    new_messages = list(
+                        Message.objects.live()
+                        .filter(room=room, id__gt=after_id)
+                        .select_related("user__profile")
+                        .order_by("id")[:ROOM_PAGE_SIZE]
+                    )
+                return _room_messages_response(
+                    request, new_messages, status=200 if saved else 202
+                )
+
             return redirect("room_detail", room_id=room.id)
     else:
         form = MessageForm()
 
+    # ======================
+    # メッセージ取得（最新 N 件だけ・期限切れは除外）
+    # ======================
+    latest = list(
+        Message.objects.live()
+        .filter(room=room)
+        .select_related("user__profile")
+        .order_by("-id")[: ROOM_PAGE_SIZE + 1]
+    )
+    has_older = len(latest) > ROOM_PAGE_SIZE
+    messages = latest[:ROOM_PAGE_SIZE][::-1]
     return render(
         request,
         "core/room_detail.html",
         {
             "room": room,
             "messages": messages,
+            "messages_html": render_room_messages(messages, request.user),
             "form": form,
             "is_host": is_host,
+            "has_older": has_older,
+            "first_id": messages[0].id if messages else None,
+            "last_id": messages[-1].id if messages else None,
         },
     )
 
 
+# ======================
+# メッセージ差分取得（after_id / before_id）
+# ======================
+@login_required
+def room_messages(request, room_id):
+    room = get_object_or_404(Room, id=room_id)
+    if not can_enter_room(request.user, room.id):
+        return JsonResponse({"error": "forbidden"}, status=403)
+
+    after_id = _parse_cursor(request.GET.get("after_id"))
+    before_id = _parse_cursor(request.GET.get("before_id"))
+    qs = Message.objects.live().filter(room=room).select_related("user__profile")
+
+    if before_id is not None:
+        # 古いメッセージ（上方向へのページング）
+        page = list(qs.filter(id__lt=before_id).order_by("-id")[: ROOM_PAGE_SIZE + 1])
+        has_more = len(page) > ROOM_PAGE_SIZE
+        messages = page[:ROOM_PAGE_SIZE][::-1]
+    elif after_id is not None:
+        # 新着メッセージ
+        page = list(qs.filter(id__gt=after_id).order_by("id")[: ROOM_PAGE_SIZE + 1])
+        has_more = len(page) > ROOM_PAGE_SIZE
+        messages = page[:ROOM_PAGE_SIZE]
+    else:
+        # カーソルなし → 最新 N 件
+        page = list(qs.order_by("-id")[: ROOM_PAGE_SIZE + 1])
+        has_more = len(page) > ROOM_PAGE_SIZE
+        messages = page[:ROOM_PAGE_SIZE][::-1]
+
+    return _room_messages_response(request, messages, has_more)
+
+
 # ==============================
 # DM 一覧（会話相手一覧）
 # ==============================
+def _dm_list_version(user):
+    # 新着・既読・期限切れ・相手のアイコンや名前の変更で変わる（キャッシュした owner ごとの版）
+    return Conversation.list_version(user.id)
+
+
 @login_required
+@conditional_page(_dm_list_version)
 def dm_list(request):
-    me = request.user
-
-    users = (
-        User.objects.filter(Q(dm_sender__receiver=me) | Q(dm_receiver__sender=me))
-        .exclude(id=me.id)
-        .annotate(
-            last_sent_at=Max("dm_sender__created_at", filter=Q(dm_sender__receiver=me)),
-            last_received_at=Max(
-                "dm_receiver__created_at", filter=Q(dm_receiver__sender=me)
-            ),
-        )
-        .annotate(last_dm_at=Greatest("last_sent_at", "last_received_at"))
-        .order_by("-last_dm_at")
-        .distinct()
+    # 会話テーブルから自分の行を新しい順に読むだけ
+    conversations = (
+        Conversation.objects.live()
+        .filter(owner=request.user)
+        .exclude(other=request.user)
+        .select_related("other__profile")
+        .order_by("-last_message_at")
     )
 
     return render(
         request,
         "core/dm_list.html",
-        {"users": users},
+        {"conversations": conversations},
     )
 
 
 # ==============================
 # DM チャット画面
 # ==============================
+# DM 画面で一度に表示するメッセージ数
+DM_PAGE_SIZE = 50
+
+
+def _dm_page(user, other_user, before_id=None, after_id=None):
+    # 会話キーの索引を新しい方から読み、(created_at, id) のカーソルで遡る
+    qs = (
+        DirectMessage.objects.live()
+        .between(user, other_user)
+        .select_related("sender__profile")
+        .order_by("-created_at", "-id")
+    )
+    if after_id is not None:
+        # after_id より新しい分（再接続時の取りこぼし補完）。古い順に返す
+        page = list(qs.filter(id__gt=after_id).reverse()[: DM_PAGE_SIZE + 1])
+        return page[:DM_PAGE_SIZE], len(page) > DM_PAGE_SIZE
+    if before_id is not None:
+        cursor = qs.filter(id=before_id).values_list("created_at", flat=True).first()
+        if cursor is None:
+            return [], False
+        qs = qs.filter(created_at__lte=cursor).exclude(
+            created_at=cursor, id__gte=before_id
+        )
+
+    page = list(qs[: DM_PAGE_SIZE + 1])
+    return page[:DM_PAGE_SIZE][::-1], len(page) > DM_PAGE_SIZE
+
+
+def _dm_version(user, user_id):
+    # 表示する範囲（最新 N 件と、さらに古いものがあるか）だけを会話キーの索引で読む
+    low, high = sorted((user.id, user_id))
+    ids = (
+        DirectMessage.objects.live()
+        .filter(low_user_id=low, high_user_id=high)
+        .order_by("-created_at", "-id")
+        .values_list("id", flat=True)[: DM_PAGE_SIZE + 1]
+    )
+    # 見出し（相手）と各メッセージのアイコン・名前は 2 人の display_version で変わる
+    versions = (
+        Profile.objects.filter(user_id__in={user.id, user_id})
+        .order_by("user_id")
+        .values_list("user_id", "display_version")
+    )
+    return (*ids, *versions)
+
+
 @login_required
+@rate_limit("user", "global")
+@conditional_page(_dm_version)
 def dm_chat(request, user_id):
     other_user = get_object_or_404(User, id=user_id)
 
-    messages = DirectMessage.objects.filter(
-        sender__in=[request.user, other_user],
-        receiver__in=[request.user, other_user],
-    ).order_by("created_at")
-
     if request.method == "POST":
         text = request.POST.get("text", "").strip()
         if text:
-            DirectMessage.objects.create(
-                sender=request.user,
-                receiver=other_user,
-                text=text,
-            )
+            try:
+                _save_message(
+                    DirectMessage(sender=request.user, receiver=other_user, text=text)
+                )
+            except QueueFull:
+                return retry_later(request, 503, 1)
         return redirect("dm_chat", user_id=other_user.id)
 
+    Conversation.mark_read(request.user, other_user)
+
+    messages, has_older = _dm_page(request.user, other_user)
     return render(
         request,
         "core/dm_chat.html",
         {
             "other_user": other_user,
             "messages": messages,
+            "messages_html": render_direct_messages(messages, request.user),
+            "has_older": has_older,
+            "first_id": messages[0].id if messages else None,
+            "last_id": messages[-1].id if messages else None,
+        },
+    )
+
+
+# ==============================
+# DM の過去ログ取得（before_id）
+# ==============================
+@login_required
+def dm_messages(request, user_id):
+    other_user = get_object_or_404(User, id=user_id)
+    messages, has_more = _dm_page(
+        request.user,
+        other_user,
+        before_id=_parse_cursor(request.GET.get("before_id")),
+        after_id=_parse_cursor(request.GET.get("after_id")),
+    )
+
+    return JsonResponse(
+        {
+            "html": render_direct_messages(messages, request.user),
+            "first_id": messages[0].id if messages else None,
+            "last_id": messages[-1].id if messages else None,
+            "has_more": has_more,
+        }
+    )
+
+
+# ==============================
+# 検索（投稿・ルームメッセージ・ルーム）
+# ==============================
+@login_required
+def search(request):
+    query = request.GET.get("q", "").strip()
+    page = _parse_cursor(request.GET.get("page")) or 1
+    hits, has_next = search_documents(request.user, query, page)
+
+    return render(
+        request,
+        "core/search.html",
+        {
+            "query": query,
+            "hits": hits,
+            "page": page,
+            "has_next": has_next,
         },
     )
 
@@ -265,10 +506,61 @@ def dm_chat(request, user_id):
 # ==============================
 # ユーザー一覧（DM送信用）
 # ==============================
+# ユーザー一覧の 1 ページの人数
+USER_PAGE_SIZE = 30
+
+
+def _encode_user_cursor(profile):
+    value = f"{profile.search_name}\t{profile.user_id}"
+    return urlsafe_b64encode(value.encode()).decode()
+
+
+def _decode_user_cursor(value):
+    # 不正なカーソルは先頭から
+    try:
+        name, user_id = urlsafe_b64decode(value.encode()).decode().rsplit("\t", 1)
+        return name, int(user_id)
+    except (AttributeError, ValueError, UnicodeError):
+        return None
+
+
 @login_required
 def user_list(request):
-    users = User.objects.exclude(id=request.user.id)
-    return render(request, "core/user_list.html", {"users": users})
+    # 正規化した名前の前方一致（大文字・小文字、全角・半角、カナの違いを無視）
+    query = normalize(request.GET.get("q", "").strip())
+    profiles = Profile.objects.select_related("user").exclude(user=request.user)
+    if query:
+        profiles = profiles.filter(search_name__gte=query)
+        upper = prefix_range(query)
+        if upper is not None:
+            profiles = profiles.filter(search_name__lt=upper)
+
+    # (search_name, user_id) のカーソルで次のページへ
+    after = _decode_user_cursor(request.GET.get("after"))
+    if after is not None:
+        name, user_id = after
+        profiles = profiles.filter(
+            Q(search_name__gt=name) | Q(search_name=name, user_id__gt=user_id)
+        )
+
+    page = list(profiles.order_by("search_name", "user_id")[: USER_PAGE_SIZE + 1])
+    next_cursor = None
+    if len(page) > USER_PAGE_SIZE:
+        page = page[:USER_PAGE_SIZE]
+        next_cursor = _encode_user_cursor(page[-1])
+
+    if request.GET.get("format") == "json":
+        return JsonResponse({"html": render_user_rows(page), "next": next_cursor})
+
+    return render(
+        request,
+        "core/user_list.html",
+        {
+            "profiles": page,
+            "query": request.GET.get("q", ""),
+            "next_cursor": next_cursor,
+        },
+    )
 
 
 # ==============================
@@ -291,7 +583,7 @@ def signup(request):
 # ==============================
 @login_required
 def profile(request, user_id):
-    user_profile = get_object_or_404(Profile, user__id=user_id)
+    user_profile = get_object_or_404(Profile.objects.select_related("user"), user__id=user_id)
     return render(request, "core/profile.html", {"profile": user_profile})
 
 
@@ -303,16 +595,77 @@ def edit_profile(request, user_id):
     profile = get_object_or_404(Profile, user__id=user_id)
 
     # 他人のプロフィール編集は禁止
-    if profile.user != request.user:
+    if profile.user_id != request.user.id:
         return redirect("profile", user_id=user_id)
 
     if request.method == "POST":
         form = ProfileForm(request.POST, request.FILES, instance=profile)
         if form.is_valid():
-            form.save()
-            return redirect("profile", user_id=user_id)
+            error = upload_error(request)
+            if error is None:
+                form.save()
+                return redirect("profile", user_id=user_id)
+            form.add_error("profile_image", error)
 
     else:
         form = ProfileForm(instance=profile)
 
     return render(request, "core/edit_profile.html", {"form": form})
+
+
+# ==============================
+# 画像アップロードの進み具合（?X-Progress-ID= で送ったフォームから取得する）
+# ==============================
+@login_required
+def upload_progress(request):
+    progress = get_progress(request.user.id, request.GET.get("id", ""))
+    if progress is None:
+        return JsonResponse({"error": "not found"}, status=404)
+    return JsonResponse(progress)
+
+
+# ==============================
+# 性能メトリクス（スタッフのみ・Prometheus 形式）
+# ==============================
+@staff_member_required
+def metrics_view(request):
+    return HttpResponse(
+        render_prometheus(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+# ==============================
+# 静的ファイル（SERVE_STATIC のときだけ config.urls に登録）
+# ==============================
+STATIC_ENCODINGS = [("br", ".br"), ("gzip", ".gz")]
+
+
+def static_asset(request, path):
+    try:
+        full = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full):
+        raise Http404
+
+    # 事前圧縮した .br / .gz があればそちらを返す
+    accepted = request.headers.get("Accept-Encoding", "")
+    encoding = None
+    for name, suffix in STATIC_ENCODINGS:
+        if name in accepted and os.path.isfile(full + suffix):
+            encoding = name
+            full += suffix
+            break
+
+    content_type = mimetypes.guess_type(path)[0] or "application/octet-stream"
+    response = FileResponse(open(full, "rb"), content_type=content_type)
+    if encoding:
+        response["Content-Encoding"] = encoding
+    patch_vary_headers(response, ["Accept-Encoding"])
+
+    # 内容ハッシュ付きの名前は中身が変わらないので 1 年キャッシュ
+    if path in set(getattr(staticfiles_storage, "hashed_files", {}).values()):
+        response["Cache-Control"] = "public, max-age=31536000, immutable"
+    else:
+        response["Cache-Control"] = "public, max-age=60"
+    return response
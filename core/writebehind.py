@@ -0,0 +1,215 @@
+import atexit
+import logging
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connections, router, transaction
+from django.db.models.signals import post_save
+
+from .models import DirectMessage
+
+logger = logging.getLogger(__name__)
+
+# save() で行っている処理のうち、bulk_create では呼ばれないもの
+BEFORE_INSERT = {
+    DirectMessage: DirectMessage.assign_pair,
+}
+
+
+class QueueFull(Exception):
+    """書き込み待ちが上限に達した（呼び出し側は 503 を返して送り直してもらう）。"""
+
+
+# =====================
+# 書き込みキュー（メッセージの INSERT をまとめる）
+# =====================
+class WriteBehindQueue:
+    """submit() されたメッセージを、別スレッドがまとめて保存する。
+
+    batch_size 件たまるか、最初の 1 件から interval 秒たつごとに
+    1 トランザクションで bulk_create し、そのあと post_save（created=True）を送る
+    （会話の更新・検索索引・配信はこれまでどおり receiver が行う）。
+    キューは 1 本なので、ルーム・会話ごとの順序は送信順のまま保たれる。
+    """
+
+    def __init__(self, max_size=5000, batch_size=200, interval=0.05):
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue = queue.Queue(max_size)
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._stopping = threading.Event()
+
+    def submit(self, instance):
+        try:
+            self._queue.put_nowait(instance)
+        except queue.Full:
+            raise QueueFull from None
+
+    def __len__(self):
+        return self._queue.qsize()
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopping.clear()
+            self._thread = threading.Thread(
+                target=self._run, name="write-behind", daemon=True
+            )
+            self._thread.start()
+
+    def stop(self):
+        """flusher を止め、残っている分をすべて保存する（終了時）。"""
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def flush(self):
+        """キューが空になるまで、呼び出したスレッドで保存する。"""
+        while True:
+            batch = self._take(block=False)
+            if not batch:
+                return
+            self._write(batch)
+
+    def _run(self):
+        try:
+            while not self._stopping.is_set():
+                batch = self._take(block=True)
+                if batch:
+                    self._write(batch)
+        finally:
+            connections.close_all()
+
+    def _take(self, block):
+        try:
+            # 止めるときに気付けるよう、待つのは短い間だけ
+            first = self._queue.get(timeout=0.5) if block else self._queue.get_nowait()
+        except queue.Empty:
+            return []
+        batch = [first]
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                if block and remaining > 0:
+                    batch.append(self._queue.get(timeout=remaining))
+                else:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        with self._flush_lock:
+            close_old_connections()
+            try:
+                with transaction.atomic():
+                    for model, instances in _group(batch):
+                        _insert(model, instances)
+            except DatabaseError:
+                # 1 件の不正な行でバッチ全体を失わないよう、1 件ずつ保存し直す
+                logger.warning(
+                    "Batch insert of %d messages failed, retrying one by one", len(batch)
+                )
+                for instance in batch:
+                    instance.pk = None
+                    try:
+                        instance.save()
+                    except DatabaseError:
+                        logger.exception("Dropped queued %s", type(instance).__name__)
+
+
+def _group(batch):
+    # モデルごとに、送信順を保ったまま分ける
+    groups = {}
+    for instance in batch:
+        groups.setdefault(type(instance), []).append(instance)
+    return groups.items()
+
+
+# DB ごとの _autoinc_step の結果
+_steps = {}
+
+
+def _autoinc_step(connection):
+    """1 文の複数行 INSERT に振られる ID の間隔（連続するとは限らない設定なら None）。
+
+    MySQL（InnoDB）は innodb_autoinc_lock_mode が 0 / 1 なら、1 文で入れた行に
+    auto_increment_increment ずつの連続した ID を振る。2（interleaved）では他の文と
+    混ざることがある。
+    """
+    if connection.vendor != "mysql":
+        return None
+    if connection.alias not in _steps:
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT @@innodb_autoinc_lock_mode, @@auto_increment_increment")
+            mode, step = cursor.fetchone()
+        _steps[connection.alias] = step if mode in (0, 1) else None
+    return _steps[connection.alias]
+
+
+def _first_insert_id(connection):
+    # 直前の複数行 INSERT の最初の行の ID
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT LAST_INSERT_ID()")
+        return cursor.fetchone()[0]
+
+
+def _insert(model, instances):
+    using = router.db_for_write(model)
+    connection = connections[using]
+    step = None
+    if not connection.features.can_return_rows_from_bulk_insert:
+        step = _autoinc_step(connection)
+        if step is None:
+            # ID を確実に知る方法がないので、同じトランザクション内で 1 件ずつ INSERT する
+            # （コミットはまとめて 1 回なので、律速するコミット数は減らせる）
+            for instance in instances:
+                instance.save(using=using)
+            return
+
+    prepare = BEFORE_INSERT.get(model)
+    if prepare is not None:
+        for instance in instances:
+            prepare(instance)
+    # 1 文で入れる（ID が連続するのは 1 文の中だけ）
+    model.objects.using(using).bulk_create(instances, batch_size=len(instances))
+    if step is not None:
+        first = _first_insert_id(connection)
+        for i, instance in enumerate(instances):
+            instance.pk = first + i * step
+    for instance in instances:
+        post_save.send(
+            sender=model,
+            instance=instance,
+            created=True,
+            update_fields=None,
+            raw=False,
+            using=using,
+        )
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_writer():
+    """プロセスに 1 つの書き込みキュー（初回に flusher を起動する）。"""
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                writer = WriteBehindQueue(
+                    max_size=settings.WRITE_BEHIND_QUEUE_SIZE,
+                    batch_size=settings.WRITE_BEHIND_BATCH_SIZE,
+                    interval=settings.WRITE_BEHIND_INTERVAL,
+                )
+                writer.start()
+                # 正常終了時は受け付け済みの分を書き切る
+                atexit.register(writer.stop)
+                _writer = writer
+    return _writer